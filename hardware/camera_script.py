@@ -1,13 +1,34 @@
 import sys
 import io
 import os
+import time
+
+# Startup timing starts before the heavy imports (cv2, numpy, requests)
+STARTUP_T0 = time.time()
+
 import cv2
+import numpy as np
 import requests
-import time
+import urllib3
 import json
+import math
+import hashlib
+import contextlib
+import uuid
+import queue
+import signal
+import subprocess
+import socketserver
+import atexit
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
 import threading
 import re
-from datetime import datetime
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Force UTF-8 encoding for stdout (helps, but we will also remove emojis to be safe)
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -19,17 +40,40 @@ warnings.filterwarnings("ignore", category=UserWarning, module="torch.utils.data
 # Check for OCR flag
 ENABLE_OCR = os.environ.get('ENABLE_OCR', '0') == '1' or '--ocr' in sys.argv
 
-reader = None
-websocket = None
+# allowlist='ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789' improves accuracy
+OCR_ALLOWLIST = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
 
-try:
-    if ENABLE_OCR:
-        import easyocr
-        reader = easyocr.Reader(['en'])
-        print("[INFO] OCR Enabled (EasyOCR)")
-except Exception as e:
-    print('[WARN] OCR not available:', e)
-    reader = None
+# OCR engine (OCR_BACKEND or --ocr-backend): easyocr, tesseract (needs
+# pytesseract) or onnx (a CTC text recognizer run by ONNX Runtime, or OpenCV DNN
+# when onnxruntime is missing). OCR_THREADS caps intra-op threads (0 = library
+# default) and OCR_INT8=1 uses int8-quantized weights where the engine can.
+# These are the defaults; the "ocr" key in camera_config.json overrides them,
+# per station if needed:
+#   {"ocr": {"backend": "easyocr", "threads": 4,
+#            "stations": {"2": {"backend": "onnx", "model": "plate_crnn.onnx"}}}}
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'easyocr')
+if '--ocr-backend' in sys.argv and sys.argv.index('--ocr-backend') + 1 < len(sys.argv):
+    OCR_BACKEND = sys.argv[sys.argv.index('--ocr-backend') + 1]
+OCR_THREADS = int(os.environ.get('OCR_THREADS', '0'))
+OCR_INT8 = os.environ.get('OCR_INT8', '0') == '1'
+OCR_ONNX_MODEL = os.environ.get('OCR_ONNX_MODEL', '')
+OCR_ONNX_CHARSET = '0123456789abcdefghijklmnopqrstuvwxyz'  # CTC blank is index 0
+
+# Out-of-process OCR (OCR_PROCESS=1 or --ocr-process): EasyOCR runs in a worker
+# process so torch never holds up the WebSocket or capture threads. Images
+# travel through OCR_SHM_SLOTS shared-memory slots; only result records are
+# pickled back. A crashed worker is restarted with exponential backoff, and so
+# is one that has held work without answering for OCR_HANG_TIMEOUT seconds
+# (well above a slow full-frame CPU readtext).
+OCR_PROCESS = os.environ.get('OCR_PROCESS', '0') == '1' or '--ocr-process' in sys.argv
+OCR_SHM_SLOTS = 4
+OCR_SHM_SLOT_BYTES = 1920 * 1080 * 3
+OCR_RESTART_MAX_BACKOFF = 30  # seconds
+OCR_HANG_TIMEOUT = float(os.environ.get('OCR_HANG_TIMEOUT', '60'))  # seconds
+
+reader = None  # OCR backend of this process's own station
+readers = {}  # ocr_spec key -> loaded backend (stations with the same spec share one)
+websocket = None
 
 try:
     import websocket as _ws
@@ -44,6 +88,336 @@ SERVER_URL = "http://localhost:5000"
 WS_URL = "ws://localhost:5000/ws"
 STATION_ID = 1
 
+CAMERA_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'camera_config.json')
+# Auto-scan results are cached in camera_config.json, keyed by device path,
+# so a restart doesn't have to open every camera again.
+PROBE_CACHE_TTL = 24 * 3600  # seconds
+PROBE_WORKERS = 8  # camera indices opened at once while probing
+
+# Capture negotiation for device indices. Left to driver defaults, USB
+# cameras stream raw YUYV at a low frame rate with several frames queued in
+# the driver, so every read is already old. Instead ask for CAPTURE_FOURCC
+# at the supported size and rate closest to CAPTURE_WIDTH x CAPTURE_HEIGHT @
+# CAPTURE_FPS, with CAPTURE_BUFFER driver buffers. Each device's modes are
+# enumerated once (v4l2-ctl where installed, otherwise by trying common
+# modes) and kept under "devices" in camera_config.json. The "capture" key
+# there overrides these defaults, per station if needed:
+#   {"capture": {"fourcc": "MJPG", "width": 1920, "height": 1080, "fps": 30,
+#                "stations": {"2": {"width": 1280, "height": 720}}}}
+CAPTURE_NEGOTIATE = os.environ.get('CAPTURE_NEGOTIATE', '1') == '1'
+CAPTURE_FOURCC = os.environ.get('CAPTURE_FOURCC', 'MJPG')
+CAPTURE_WIDTH = int(os.environ.get('CAPTURE_WIDTH', '1280'))
+CAPTURE_HEIGHT = int(os.environ.get('CAPTURE_HEIGHT', '720'))
+CAPTURE_FPS = float(os.environ.get('CAPTURE_FPS', '30'))
+CAPTURE_BUFFER = int(os.environ.get('CAPTURE_BUFFER', '1'))
+COMMON_MODES = [('MJPG', 1920, 1080), ('MJPG', 1280, 720), ('MJPG', 640, 480),
+                ('YUYV', 1280, 720), ('YUYV', 640, 480)]
+MODE_CACHE_TTL = 30 * 24 * 3600  # seconds
+
+# --- STARTUP ---
+# Nothing expensive happens at import: the camera index is resolved when
+# main() needs it, and the OCR model loads on a background thread while the
+# WebSocket connects and the camera opens.
+startup_times = {}  # stage -> (seconds since STARTUP_T0 when done, duration or None)
+
+def mark_startup(stage, duration=None):
+    startup_times[stage] = (time.time() - STARTUP_T0, duration)
+
+def startup_report():
+    """Log where startup time went so far"""
+    log("[STARTUP] Timing report:")
+    for stage, (at, took) in sorted(startup_times.items(), key=lambda kv: kv[1][0]):
+        took_s = f"{took * 1000:6.0f} ms" if took is not None else " " * 9
+        log(f"  {stage:<18} {took_s}   ready at +{at * 1000:.0f} ms")
+    if ENABLE_OCR and not ocr_ready.is_set():
+        log("  ocr model          (still loading in background)")
+
+ocr_ready = threading.Event()
+ocr_loader = None
+
+def load_ocr():
+    """Build the OCR backend(s) and run one warm-up inference each"""
+    global reader
+    try:
+        specs = [ocr_spec(STATION_ID)]
+        if SUPERVISOR:
+            specs += [ocr_spec(station) for station in load_station_map()]
+        for spec in specs:
+            if ocr_spec_key(spec) not in readers:
+                readers[ocr_spec_key(spec)] = build_reader(spec)
+        reader = readers[ocr_spec_key(specs[0])]
+    except Exception as e:
+        log(f"[WARN] OCR not available: {e}")
+        reader = None
+    finally:
+        ocr_ready.set()
+
+def build_reader(spec):
+    """Load one backend (in this process or a worker) and warm it up"""
+    start = time.time()
+    if OCR_PROCESS:
+        loaded = ProcessOcr(spec)
+        if not loaded.ready.wait(120):
+            raise RuntimeError("OCR worker process did not become ready")
+        mark_startup(f"ocr worker ready ({spec['backend']})", time.time() - start)
+        log(f"[INFO] OCR Enabled ({spec['backend']} worker process), ready at +{(time.time() - STARTUP_T0) * 1000:.0f} ms")
+        return loaded
+    loaded = make_ocr_backend(spec)
+    mark_startup(f"ocr load ({spec['backend']})", time.time() - start)
+    # The first call pays for lazy runtime init; do it now, not on a car
+    start = time.time()
+    loaded.readtext(np.full((64, 256), 255, dtype=np.uint8), allowlist=OCR_ALLOWLIST)
+    mark_startup(f"ocr warm-up ({spec['backend']})", time.time() - start)
+    log(f"[INFO] OCR Enabled ({loaded.describe()}), ready at +{(time.time() - STARTUP_T0) * 1000:.0f} ms")
+    return loaded
+
+def ocr_spec(station_id=None):
+    """Effective OCR settings for a station: env/CLI defaults, then camera_config.json"""
+    spec = {'backend': OCR_BACKEND, 'threads': OCR_THREADS, 'int8': OCR_INT8, 'model': OCR_ONNX_MODEL}
+    config = load_camera_config().get('ocr', {})
+    spec.update({k: v for k, v in config.items() if k != 'stations'})
+    station_id = STATION_ID if station_id is None else station_id
+    spec.update(config.get('stations', {}).get(str(station_id), {}))
+    return spec
+
+def ocr_spec_key(spec):
+    return tuple(sorted((k, str(v)) for k, v in spec.items()))
+
+def start_ocr_loader():
+    global ocr_loader
+    if not ENABLE_OCR:
+        ocr_ready.set()
+        return
+    if ocr_loader is None:
+        ocr_loader = threading.Thread(target=load_ocr, name="ocr-loader")
+        ocr_loader.daemon = True
+        ocr_loader.start()
+
+_readers_lock = threading.Lock()
+station_readers = {}  # station id -> backend, resolved once
+
+def get_reader(station_id=None):
+    """Return the OCR backend for a station, waiting for the background load if it is still running"""
+    if ENABLE_OCR and not ocr_ready.is_set():
+        start_ocr_loader()
+        log("[INFO] Waiting for OCR model to finish loading...")
+        ocr_ready.wait()
+    if station_id is None or station_id == STATION_ID or reader is None:
+        return reader
+    found = station_readers.get(station_id)
+    if found is not None:
+        return found
+    with _readers_lock:
+        spec = ocr_spec(station_id)
+        key = ocr_spec_key(spec)
+        if key not in readers:
+            try:
+                readers[key] = build_reader(spec)
+            except Exception as e:
+                log(f"[WARN] OCR backend for station {station_id} not available, using default: {e}")
+                readers[key] = reader
+        station_readers[station_id] = readers[key]
+        return readers[key]
+
+def load_camera_config():
+    try:
+        if os.path.exists(CAMERA_CONFIG_PATH):
+            with open(CAMERA_CONFIG_PATH, 'r', encoding='utf-8') as cf:
+                return json.load(cf)
+    except Exception:
+        pass
+    return {}
+
+def save_camera_config(cfg):
+    with open(CAMERA_CONFIG_PATH, 'w', encoding='utf-8') as cf:
+        json.dump(cfg, cf, indent=4)
+
+def device_key(index):
+    """Stable identity for a capture index: its /dev/v4l/by-id link or /dev node
+    where the OS has one, otherwise just the index."""
+    node = f"/dev/video{index}"
+    by_id = "/dev/v4l/by-id"
+    if os.path.isdir(by_id):
+        for name in sorted(os.listdir(by_id)):
+            link = os.path.join(by_id, name)
+            if os.path.realpath(link) == node:
+                return link
+    return node if os.path.exists(node) else f"index:{index}"
+
+def capture_api():
+    """DirectShow on Windows (MSMF takes seconds to open), the default elsewhere"""
+    return cv2.CAP_DSHOW if sys.platform == 'win32' else cv2.CAP_ANY
+
+def probe_camera(index, with_modes=False):
+    """Open a capture index and try to grab one frame.
+
+    With `with_modes`, returns (ok, modes) and enumerates the device's modes
+    while it is open.
+    """
+    cap = cv2.VideoCapture(index, capture_api())
+    if not cap.isOpened():
+        cap.release()
+        return (False, []) if with_modes else False
+    # try to grab a frame
+    ret, _ = cap.read()
+    modes = enumerate_modes(index, cap) if with_modes and ret else []
+    cap.release()
+    return (bool(ret), modes) if with_modes else bool(ret)
+
+def probe_cameras(indices, with_modes=False):
+    """probe_camera() for several indices at once; {index: result}"""
+    indices = list(indices)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(PROBE_WORKERS, len(indices))), thread_name_prefix="probe") as pool:
+        futures = {i: pool.submit(probe_camera, i, with_modes) for i in indices}
+        for i, fut in futures.items():
+            try:
+                results[i] = fut.result()
+            except Exception:
+                results[i] = (False, []) if with_modes else False
+    return results
+
+def fourcc_name(code):
+    """Four-character code as reported, padding kept ("Y16 "); strip only for display"""
+    code = int(code)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).replace("\x00", " ")
+
+def fourcc_code(name):
+    """cv2 FOURCC for a name; short names (e.g. "Y16" from old configs) are space padded"""
+    return cv2.VideoWriter_fourcc(*str(name).ljust(4)[:4])
+
+def list_modes_v4l2(index):
+    """Modes reported by `v4l2-ctl --list-formats-ext`, or None if it is unavailable"""
+    try:
+        out = subprocess.run(['v4l2-ctl', '-d', f'/dev/video{index}', '--list-formats-ext'],
+                             capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if out.returncode != 0:
+        return None
+    modes = []
+    fourcc = None
+    for line in out.stdout.splitlines():
+        m = re.search(r"'(.{4})'", line)
+        if m and 'Size' not in line:
+            fourcc = m.group(1)
+            continue
+        m = re.search(r'Size: \w+ (\d+)x(\d+)', line)
+        if m and fourcc:
+            modes.append({'fourcc': fourcc, 'width': int(m.group(1)), 'height': int(m.group(2)), 'fps': []})
+            continue
+        m = re.search(r'\(([\d.]+) fps\)', line)
+        if m and modes:
+            modes[-1]['fps'].append(float(m.group(1)))
+    return modes
+
+def probe_modes(cap):
+    """Ask the driver for COMMON_MODES one by one and keep what it accepts"""
+    modes = []
+    for fourcc, width, height in COMMON_MODES:
+        cap.set(cv2.CAP_PROP_FOURCC, fourcc_code(fourcc))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        cap.set(cv2.CAP_PROP_FPS, CAPTURE_FPS)
+        if not cap.read()[0]:
+            continue
+        got = fourcc_name(cap.get(cv2.CAP_PROP_FOURCC))
+        mode = {'fourcc': got if got.strip() else fourcc,
+                'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'fps': [round(cap.get(cv2.CAP_PROP_FPS), 3)]}
+        if all((m['fourcc'], m['width'], m['height']) != (mode['fourcc'], mode['width'], mode['height']) for m in modes):
+            modes.append(mode)
+    return modes
+
+def enumerate_modes(index, cap):
+    """Supported [{fourcc, width, height, fps: [...]}] of an open device"""
+    modes = list_modes_v4l2(index) if sys.platform.startswith('linux') else None
+    return modes if modes else probe_modes(cap)
+
+def store_device_modes(found):
+    """Persist {index: modes} under "devices" in camera_config.json.
+
+    An empty list is stored too, so a device that reports nothing is not
+    enumerated again on every start.
+    """
+    if not found:
+        return
+    cfg = load_camera_config()
+    devices = cfg.setdefault('devices', {})
+    for i, modes in found.items():
+        devices[device_key(i)] = {'index': i, 'modes': modes, 'ts': time.time()}
+    try:
+        save_camera_config(cfg)
+    except Exception as e:
+        log(f"[WARN] Could not save camera modes: {e}")
+
+def describe_modes(modes):
+    by_format = {}
+    for m in modes:
+        rate = f"@{max(m['fps']):g}" if m.get('fps') else ""
+        by_format.setdefault(m['fourcc'].strip(), []).append(f"{m['width']}x{m['height']}{rate}")
+    return "; ".join(f"{fourcc} {', '.join(sizes)}" for fourcc, sizes in by_format.items())
+
+def capture_spec(station_id=None):
+    """Requested capture mode for a station: env defaults, then camera_config.json"""
+    spec = {'fourcc': CAPTURE_FOURCC, 'width': CAPTURE_WIDTH, 'height': CAPTURE_HEIGHT,
+            'fps': CAPTURE_FPS, 'buffer': CAPTURE_BUFFER}
+    config = load_camera_config().get('capture', {})
+    spec.update({k: v for k, v in config.items() if k != 'stations'})
+    station_id = STATION_ID if station_id is None else station_id
+    spec.update(config.get('stations', {}).get(str(station_id), {}))
+    return spec
+
+def get_device_modes(index, cap):
+    """Cached modes for a device, enumerating (and saving) them when stale"""
+    entry = load_camera_config().get('devices', {}).get(device_key(index))
+    if entry and entry.get('index') == index and time.time() - entry.get('ts', 0) < MODE_CACHE_TTL:
+        return entry.get('modes', [])
+    modes = enumerate_modes(index, cap)
+    store_device_modes({index: modes})
+    return modes
+
+def choose_mode(modes, want):
+    """Supported mode closest to the request: its format if offered, then the
+    nearest size, then the highest rate not above the requested one"""
+    pool = [m for m in modes if m['fourcc'].ljust(4) == str(want['fourcc']).ljust(4)] or modes
+    area = want['width'] * want['height']
+    best = min(pool, key=lambda m: (abs(m['width'] * m['height'] - area), -max(m.get('fps') or [0])))
+    rates = best.get('fps') or [want['fps']]
+    fps = max([r for r in rates if r <= want['fps'] + 0.5] or [min(rates)])
+    return {'fourcc': best['fourcc'], 'width': best['width'], 'height': best['height'], 'fps': fps}
+
+def negotiate_capture(cap, index, station_id=None):
+    """Set format, size, rate and buffer depth; returns what the driver accepted"""
+    want = capture_spec(station_id)
+    modes = get_device_modes(index, cap)
+    mode = choose_mode(modes, want) if modes else want
+    # FOURCC first: on V4L2 the size list depends on the format
+    cap.set(cv2.CAP_PROP_FOURCC, fourcc_code(mode['fourcc']))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, mode['width'])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, mode['height'])
+    cap.set(cv2.CAP_PROP_FPS, mode['fps'])
+    buffered = cap.set(cv2.CAP_PROP_BUFFERSIZE, want['buffer'])
+    got = {'fourcc': fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)), 'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+           'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), 'fps': round(cap.get(cv2.CAP_PROP_FPS), 2),
+           'buffer': int(cap.get(cv2.CAP_PROP_BUFFERSIZE)) if buffered else None}
+    log(f"[INFO] Camera {index}: {got['fourcc'].strip() or '?'} {got['width']}x{got['height']} @ {got['fps']:g} fps, "
+        f"buffer {got['buffer'] if got['buffer'] is not None else 'driver default'} "
+        f"(asked {want['fourcc']} {want['width']}x{want['height']} @ {want['fps']:g}, {len(modes)} known modes)")
+    return got
+
+def frame_age(cap):
+    """Milliseconds since the driver timestamped the frame just read, or None.
+
+    V4L2 reports the buffer timestamp (CLOCK_MONOTONIC) as CAP_PROP_POS_MSEC;
+    backends without one give 0 or a stream position, which is rejected.
+    """
+    stamp = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if stamp <= 0:
+        return None
+    age = time.monotonic() * 1000.0 - stamp
+    return age if 0 <= age < 10000 else None
+
 # CAMERA selection:
 # - If `CAMERA_ID` env var is set or `--camera N` passed, use that.
 # - Otherwise try indices 1..5 first (USB cams are often not index 0),
@@ -58,14 +432,10 @@ def parse_camera_id():
             pass
 
     # Config file override (saved selection)
+    cfg = load_camera_config()
     try:
-        config_path = os.path.join(os.path.dirname(__file__), 'camera_config.json')
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as cf:
-                import json as _json
-                cfg = _json.load(cf)
-                if 'camera_id' in cfg:
-                    return int(cfg['camera_id'])
+        if 'camera_id' in cfg:
+            return int(cfg['camera_id'])
     except Exception:
         pass
 
@@ -78,59 +448,63 @@ def parse_camera_id():
         pass
 
     # Auto-scan: prefer indices 1..5, then 0
-    def probe(index):
-        cap = cv2.VideoCapture(index, cv2.CAP_DSHOW if hasattr(cv2, 'CAP_DSHOW') else 0)
-        if not cap.isOpened():
-            cap.release()
-            return False
-        # try to grab a frame
-        ret, _ = cap.read()
-        cap.release()
-        return bool(ret)
+    scan_order = list(range(1, 6))
 
-    for i in range(1, 6):
-        try:
-            if probe(i):
-                return i
-        except Exception:
-            continue
+    # A recent successful probe of the same device skips the scan entirely
+    cache = cfg.get('probe_cache', {})
+    for i in scan_order:
+        entry = cache.get(device_key(i))
+        if entry and entry.get('index') == i and time.time() - entry.get('ts', 0) < PROBE_CACHE_TTL:
+            return i
+
+    results = probe_cameras(scan_order)
+    for i in scan_order:
+        if results[i]:
+            cache = {device_key(i): {'index': i, 'ts': time.time()}}
+            cfg['probe_cache'] = cache
+            try:
+                save_camera_config(cfg)
+            except Exception:
+                pass
+            return i
 
     # fallback to 0
     return 0
 
-CAMERA_ID = parse_camera_id()
-    
+def forget_camera_probe(index):
+    """Drop a cached probe result (e.g. the cached device failed to open)"""
+    cfg = load_camera_config()
+    if cfg.get('probe_cache', {}).pop(device_key(index), None) is not None:
+        save_camera_config(cfg)
+
+_camera_id = None
+
+def get_camera_id():
+    global _camera_id
+    if _camera_id is None:
+        start = time.time()
+        _camera_id = parse_camera_id()
+        mark_startup("camera select", time.time() - start)
+    return _camera_id
 
 def list_cameras(max_index: int = 10):
-    """Probe camera indices 0..max_index and print which ones can be opened.
+    """Probe camera indices 0..max_index (in parallel) and print which ones can
+    be opened, with their supported modes, which are saved to camera_config.json.
 
     Returns a dict of index -> boolean (True if probe succeeded).
     """
-    results = {}
-    for i in range(0, max_index + 1):
-        try:
-            cap = cv2.VideoCapture(i, cv2.CAP_DSHOW if hasattr(cv2, 'CAP_DSHOW') else 0)
-            ok = False
-            if cap.isOpened():
-                ret, _ = cap.read()
-                ok = bool(ret)
-            if cap.isOpened():
-                cap.release()
-            results[i] = ok
-        except Exception:
-            results[i] = False
+    probed = probe_cameras(range(0, max_index + 1), with_modes=True)
+    results = {i: ok for i, (ok, _) in probed.items()}
+    store_device_modes({i: modes for i, (ok, modes) in probed.items() if ok})
     print("Camera probe results:")
-    for idx, ok in results.items():
+    for idx, (ok, modes) in probed.items():
         print(f"  index {idx}: {'OK' if ok else 'no'}")
+        if modes:
+            print(f"    modes: {describe_modes(modes)}")
     return results
 
-# If user asked to list cameras, do it and exit early.
-if '--list-cameras' in sys.argv:
-    list_cameras(10)
-    sys.exit(0)
-
-# Interactive selection: show cameras, let user pick, save to `hardware/camera_config.json`.
-if '--select-camera' in sys.argv:
+def select_camera():
+    """Interactive selection: show cameras, let user pick, save to `hardware/camera_config.json`."""
     res = list_cameras(10)
     ok_indices = [i for i, ok in res.items() if ok]
     if not ok_indices:
@@ -146,205 +520,237 @@ if '--select-camera' in sys.argv:
         if sel_i not in ok_indices:
             print(f'Index {sel_i} did not probe OK. Aborting.')
             sys.exit(1)
-        cfg = {'camera_id': sel_i}
-        config_path = os.path.join(os.path.dirname(__file__), 'camera_config.json')
-        with open(config_path, 'w', encoding='utf-8') as cf:
-            import json as _json
-            _json.dump(cfg, cf)
-        print(f'Saved default camera index {sel_i} to {config_path}')
+        cfg = load_camera_config()
+        cfg['camera_id'] = sel_i
+        save_camera_config(cfg)
+        print(f'Saved default camera index {sel_i} to {CAMERA_CONFIG_PATH}')
         sys.exit(0)
     except Exception as e:
         print('Error during selection:', e)
         sys.exit(1)
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
 
-# Create captures directory
-CAPTURES_DIR = "captures"
-if not os.path.exists(CAPTURES_DIR):
-    os.makedirs(CAPTURES_DIR)
-    print(f"✓ Created {CAPTURES_DIR}/ directory")
+# Burst capture: on trigger, grab BURST_FRAMES frames over BURST_WINDOW seconds,
+# rank them by a cheap quality score and OCR only the best BURST_TOP_K.
+BURST_FRAMES = int(os.environ.get('BURST_FRAMES', '8'))
+BURST_TOP_K = int(os.environ.get('BURST_TOP_K', '3'))
+BURST_WINDOW = float(os.environ.get('BURST_WINDOW', '0.6'))  # seconds
 
-# --- STATE ---
-should_capture = False
+# Plate localization: find plate-shaped, high-contrast regions and OCR only
+# those crops before falling back to the full frame. PLATE_CASCADE may point
+# to a Haar/LBP cascade XML (e.g. haarcascade_russian_plate_number.xml).
+PLATE_LOCALIZE = os.environ.get('PLATE_LOCALIZE', '1') == '1'
+PLATE_CASCADE = os.environ.get('PLATE_CASCADE')
+PLATE_MAX_ROIS = 3
+PLATE_ASPECT_RANGE = (2.0, 6.0)  # width / height; single-row plates are ~4.5
+PLATE_AREA_RANGE = (0.001, 0.2)  # fraction of the frame
+LOCALIZE_WIDTH = 960  # contour search runs on a frame downscaled to this width
 
-def log(message):
-    """Print with timestamp"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {message}", flush=True)
+# Full Indian plate: LLNNLLNNNN (new) or LLNNLNNNN (older series)
+STRICT_PLATE_RE = re.compile(r'^[A-Z]{2}[0-9]{2}[A-Z]{1,2}[0-9]{4}$')
+# Loose structure check: 2 Letters + Digits/Letters + 4 Digits
+PLATE_STRUCTURE_RE = re.compile(r'^[A-Z]{2}.*[0-9]{4}$')
 
-def on_message(ws, message):
-    global should_capture
-    log(f"[MSG] Received: {message}")
-    try:
-        data = json.loads(message)
-        if data.get("type") == "CAMERA_TRIGGER":
-             # Accept trigger for this station OR if stationId is missing (broadcast)
-             target_station = data.get("stationId")
-             if target_station is None or target_station == STATION_ID:
-                log("[TRIG] TRIGGER RECEIVED! Starting capture sequence...")
-                should_capture = True
-             else:
-                log(f"[INFO] Ignored trigger for station {target_station}")
-    except Exception as e:
-        log(f"[ERR] Error parsing message: {e}")
+# Candidate expansion: how many alternative readings heuristic_clean's
+# beam search keeps, and the minimum score relative to the best one.
+PLATE_TOP_K = int(os.environ.get('PLATE_TOP_K', '3'))
+PLATE_ALT_MIN = 0.25
+PLATE_BEAM_WIDTH = 16
 
-def on_error(ws, error):
-    log(f"[ERR] WebSocket Error: {error}")
+# Multi-frame voting: reads from every frame/variant vote per character,
+# weighted by OCR confidence. The burst stops and identifies as soon as the
+# fused plate is strict and its score reaches VOTE_CONVERGE_SCORE.
+VOTE_CONVERGE_SCORE = float(os.environ.get('VOTE_CONVERGE_SCORE', '0.6'))
+VOTE_SUPPORT_SCALE = 1.0  # confidence mass at which support saturates (~63%)
+VOTE_TOP_N = 3
 
-def on_close(ws, close_status_code, close_msg):
-    log("[INFO] WebSocket Closed")
+# Variant execution for detect_plate:
+# - "cascade": run variants in order, stop at the first strict plate read
+#   with confidence >= EARLY_EXIT_CONF
+# - "parallel": run all variants on a thread pool (OpenCV/torch release the
+#   GIL), return as soon as one satisfies the same early-exit rule
+# - "all": old behaviour, run every variant
+VARIANT_MODE = os.environ.get('VARIANT_MODE', 'cascade')
+EARLY_EXIT_CONF = float(os.environ.get('EARLY_EXIT_CONF', '0.6'))
 
-def on_open(ws):
-    log("[INFO] WebSocket Connected to Server")
-    # Register as a CAMERA so server can distinguish it from browser clients
+# Per-station, per-hour variant win rates, used to pick the cascade order.
+# Hour buckets with fewer than VARIANT_STATS_MIN attempts use the station's
+# all-day numbers instead.
+VARIANT_STATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'variant_stats.json')
+VARIANT_STATS_MIN = 5
+VARIANT_STATS_SAVE_INTERVAL = 30  # seconds
+
+# Batched OCR: all readtext calls (every station, every variant) go through
+# one worker thread that groups requests arriving within OCR_BATCH_WAIT_MS
+# into a single readtext_batched call of up to OCR_BATCH_MAX images. A request
+# not started within OCR_DEADLINE seconds is dropped instead of stalling others;
+# one that has started is always waited for.
+OCR_BATCHING = os.environ.get('OCR_BATCHING', '1') == '1'
+OCR_BATCH_MAX = int(os.environ.get('OCR_BATCH_MAX', '8'))
+OCR_BATCH_WAIT = float(os.environ.get('OCR_BATCH_WAIT_MS', '15')) / 1000.0
+OCR_QUEUE_MAX = 32
+OCR_DEADLINE = float(os.environ.get('OCR_DEADLINE', '5.0'))  # seconds
+
+# Recognizer-only fast path: for crops that are already known to be a plate
+# (localizer output, or fixed boxes per station in roi_config.json) skip
+# EasyOCR's CRAFT detector and run only the recognizer. The detector path
+# runs only if the fast path finds nothing. roi_config.json format:
+#   {"1": [[x, y, w, h], ...]}  pixels, or fractions of the frame if all <= 1
+RECOGNIZER_FAST_PATH = os.environ.get('RECOGNIZER_FAST_PATH', '1') == '1'
+ROI_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'roi_config.json')
+
+# Gate decisions go over the already-open WebSocket as IDENTIFY messages
+# (replies matched by requestId). When the socket is down the HTTP endpoint is
+# used through a keep-alive session instead of a new connection per plate.
+IDENTIFY_OVER_WS = os.environ.get('IDENTIFY_OVER_WS', '1') == '1'
+IDENTIFY_TIMEOUT = 5.0  # seconds
+HTTP_POOL_SIZE = 4
+
+# Local booking index: upcoming bookings for this process's stations, pulled
+# from /api/bookings every BOOKING_REFRESH_INTERVAL seconds and at once when
+# the server pushes BOOKINGS_CHANGED. A gate decision is made from it right
+# away and the server identify call (which drives the gate) runs in the
+# background. Entries the index authorized while the server was unreachable
+# are appended to PENDING_ENTRIES_PATH and replayed in order when it is back.
+BOOKING_CACHE = os.environ.get('BOOKING_CACHE', '1') == '1'
+BOOKING_REFRESH_INTERVAL = 60  # seconds
+BOOKING_EARLY_ENTRY = 30 * 60  # seconds before the start time the gate opens
+PENDING_ENTRIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pending_entries.jsonl')
+
+# Offline gate: with the server unreachable the ESP32 gets no GATE_OPEN, so a
+# local "authorized" decision goes straight to the gate controller's own
+# endpoint (LOCAL_GATE_URL, or per station {"gates": {"2": "http://.../gate/open"}}
+# in camera_config.json). Only entries it confirms opening are queued for
+# replay. HARDWARE_TOKEN (shared with the ESP32 and the server) authenticates
+# that call and the replay.
+LOCAL_GATE_URL = os.environ.get('LOCAL_GATE_URL', '')
+LOCAL_GATE_TIMEOUT = 2.0  # seconds
+HARDWARE_TOKEN = os.environ.get('HARDWARE_TOKEN', '')
+
+# Fuzzy matching of OCR reads against the plates booked at the station today
+# (from the booking index). Substitutions cost 1 minus the OCR_CONFUSIONS
+# weight, so O->0 is nearly free; a match is accepted when its cost is at most
+# FUZZY_MAX_COST and beats the next plate by FUZZY_MARGIN.
+FUZZY_MATCH = os.environ.get('FUZZY_MATCH', '1') == '1'
+FUZZY_MAX_EDITS = 3  # BK-tree search radius (plain edits)
+FUZZY_MAX_COST = float(os.environ.get('FUZZY_MAX_COST', '0.6'))
+FUZZY_MARGIN = float(os.environ.get('FUZZY_MARGIN', '0.5'))
+
+# Every trigger (WebSocket, control socket, SIGUSR1, 'c') goes through one
+# queue. A repeat for a station within TRIGGER_DEBOUNCE seconds of the last
+# accepted one is dropped (IR sensor bounce), a trigger for a station that
+# already has one queued is merged into it, and a newer trigger for a station
+# whose capture is still running cancels that capture at its next checkpoint.
+TRIGGER_DEBOUNCE = float(os.environ.get('TRIGGER_DEBOUNCE', '1.0'))  # seconds
+
+# Recent-vehicle cache: when the sensor re-fires on a car that has not moved,
+# detect_plate reuses the previous reads instead of running OCR again and the
+# burst ends there, so one earlier observation is voted only once. Keyed by
+# a 64-bit difference hash of the first plate ROI (or the downscaled frame when
+# there is none); entries expire after RECENT_CACHE_TTL seconds and are dropped
+# once the server has answered for that vehicle.
+RECENT_CACHE = os.environ.get('RECENT_CACHE', '1') == '1'
+RECENT_CACHE_TTL = float(os.environ.get('RECENT_CACHE_TTL', '20'))  # seconds
+RECENT_CACHE_SIZE = 32
+RECENT_HASH_DISTANCE = 6  # max differing hash bits for "same scene"
+
+# Latency tracing: every trigger gets a trace ID (from the server's
+# CAMERA_TRIGGER when it sends one) that follows it through the pipeline and
+# the identify payload. Per-stage histograms are written in Prometheus text
+# format to METRICS_PATH (and served on --metrics-port); one JSON line per
+# trigger goes to TRACE_LOG_PATH.
+TRACING = os.environ.get('TRACING', '1') == '1'
+METRICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.prom')
+TRACE_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces.jsonl')
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+# Frame grabber: how many recent frames the background reader keeps
+FRAME_BUFFER_SIZE = int(os.environ.get('FRAME_BUFFER_SIZE', '4'))
+HEARTBEAT_INTERVAL = 5  # seconds
+
+def cli_int(flag, env_name, default):
+    """Integer option from `--flag N`, then the env var, then the default"""
+    if flag in sys.argv:
+        try:
+            return int(sys.argv[sys.argv.index(flag) + 1])
+        except Exception:
+            pass
     try:
-        ws.send(json.dumps({"type": "REGISTER_CAMERA", "stationId": STATION_ID}))
-        log(f"[INFO] Registered as CAMERA for Station {STATION_ID}")
-    except Exception as e:
-        log(f"[WARN] Registration error: {e}")
+        return int(os.environ.get(env_name, default))
+    except Exception:
+        return default
 
-def ws_thread():
-    if websocket is None:
-        log('[WARN] Skipping WebSocket thread because websocket-client is not available.')
-        return
+def cli_str(flag, env_name, default):
+    """String option from `--flag VALUE`, then the env var, then the default"""
+    if flag in sys.argv and sys.argv.index(flag) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(flag) + 1]
+    return os.environ.get(env_name, default)
 
-    ws = websocket.WebSocketApp(WS_URL,
-                                on_open=on_open,
-                                on_message=on_message,
-                                on_error=on_error,
-                                on_close=on_close)
-    ws.run_forever()
+# Headless mode: no OpenCV windows or key polling. Manual triggers come from
+# SIGUSR1 (POSIX) or the local control socket:  echo trigger | nc 127.0.0.1 8765
+HEADLESS = '--headless' in sys.argv or os.environ.get('HEADLESS', '0') == '1'
+CONTROL_PORT = cli_int('--control-port', 'CONTROL_PORT', 8765)  # 0 disables
 
-def save_image(frame, prefix="capture"):
-    """Save image with timestamp"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{CAPTURES_DIR}/{prefix}_{timestamp}.jpg"
-    cv2.imwrite(filename, frame)
-    log(f"[SAVE] Saved: {filename}")
-    return filename
-
-def process_frame_with_retry(frame):
-    """Try to detect plate with retries"""
-    log("="*60)
-    log("[INFO] STARTING PLATE DETECTION SEQUENCE")
-    log("="*60)
-    
-    for attempt in range(1, MAX_RETRIES + 1):
-        log(f"[INFO] Attempt {attempt}/{MAX_RETRIES}")
-        
-        # Save the captured image
-        saved_file = save_image(frame, f"attempt{attempt}")
-        
-        # Try to detect plate
-        plate_number = detect_plate(frame)
-        
-        if plate_number:
-            log(f"[SUCCESS] Plate detected: {plate_number}")
-            # Check booking
-            check_booking(plate_number)
-            return True
-        else:
-            log(f"[FAIL] No plate detected in attempt {attempt}")
-            if attempt < MAX_RETRIES:
-                log(f"[WAIT] Waiting {RETRY_DELAY}s before retry...")
-                time.sleep(RETRY_DELAY)
-    
-    log("[FAIL] No plate detected after 3 attempts")
-    log("="*60)
-    return False
+# Optional MJPEG preview on http://127.0.0.1:PREVIEW_PORT/ (0 disables).
+# Frames are only encoded while at least one viewer is connected.
+PREVIEW_PORT = cli_int('--preview', 'PREVIEW_PORT', 0)
+PREVIEW_FPS = 5
+PREVIEW_WIDTH = 640
+METRICS_PORT = cli_int('--metrics-port', 'METRICS_PORT', 0)  # 0 disables /metrics
 
-def get_preprocessed_variants(frame):
-    """Generate multiple preprocessed versions of the frame to try"""
-    variants = []
-    
-    # 1. Grayscale + Bilateral (Standard)
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    bi = cv2.bilateralFilter(gray, 11, 17, 17)
-    variants.append(("Standard", bi))
-    
-    # 2. CLAHE (Contrast Enhancement) - Good for shadows
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    cl = clahe.apply(gray)
-    variants.append(("Contrast", cl))
-    
-    # 3. Adaptive Threshold (Binary) - Good for clear text
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-    variants.append(("Threshold", thresh))
-    
-    return variants
+# Frame source (--source / FRAME_SOURCE): read a video file, a directory of
+# images (played at SOURCE_FPS) or an RTSP/HTTP URL instead of a capture
+# device. Files and directories play at their own frame rate (--pace realtime)
+# or as fast as the pipeline takes them (--pace fast). --triggers "2.5,9,14.2"
+# (or a file with one time per line) fires a trigger at those media seconds;
+# in fast mode the source then holds after one burst until the capture
+# sequence has finished, so every run sees the same frames.
+FRAME_SOURCE = cli_str('--source', 'FRAME_SOURCE', '')
+SOURCE_PACE = cli_str('--pace', 'SOURCE_PACE', 'realtime')
+SOURCE_FPS = float(os.environ.get('SOURCE_FPS', '10'))  # image directories, and videos without a rate
+SOURCE_TRIGGERS = cli_str('--triggers', 'SOURCE_TRIGGERS', '')
 
-def heuristic_clean(text):
-    """Fix common OCR errors based on Indian Plate format (LLNNLLNNNN)"""
-    # LL = 2 Letters (State)
-    # NN = 2 Numbers (District)
-    # LL = 2 Letters (Series) - Sometimes 1 Letter
-    # NNNN = 4 Numbers (Unique ID)
-    
-    # Common confusions
-    to_digit = {'O': '0', 'I': '1', 'Z': '2', 'S': '5', 'B': '8', 'G': '6', 'Q': '0', 'D': '0', 'A': '4'}
-    to_alpha = {'0': 'O', '1': 'I', '2': 'Z', '5': 'S', '8': 'B', '6': 'G', '4': 'A'}
-    
-    # Remove any non-alphanumeric
-    clean = ''.join(c for c in text if c.isalnum()).upper()
-    
-    # If length is 10 (Standard: RJ14CV0002), try to force mask LLNNLLNNNN
-    if len(clean) == 10:
-        res = list(clean)
-        # 0,1: Letters
-        res[0] = to_alpha.get(res[0], res[0])
-        res[1] = to_alpha.get(res[1], res[1])
-        # 2,3: Digits
-        res[2] = to_digit.get(res[2], res[2])
-        res[3] = to_digit.get(res[3], res[3])
-        # 4,5: Letters
-        res[4] = to_alpha.get(res[4], res[4])
-        res[5] = to_alpha.get(res[5], res[5])
-        # 6-9: Digits
-        res[6] = to_digit.get(res[6], res[6])
-        res[7] = to_digit.get(res[7], res[7])
-        res[8] = to_digit.get(res[8], res[8])
-        res[9] = to_digit.get(res[9], res[9])
-        
-        candidate = "".join(res)
-        # Verify strict pattern
-        if re.match(r'^[A-Z]{2}[0-9]{2}[A-Z]{2}[0-9]{4}$', candidate):
-            return candidate
-
-    # If length is 9 (Older: KA01A1234), try mask LLNNLNNNN
-    if len(clean) == 9:
-        res = list(clean)
-        # 0,1: Letters
-        res[0] = to_alpha.get(res[0], res[0])
-        res[1] = to_alpha.get(res[1], res[1])
-        # 2,3: Digits
-        res[2] = to_digit.get(res[2], res[2])
-        res[3] = to_digit.get(res[3], res[3])
-        # 4: Letter
-        res[4] = to_alpha.get(res[4], res[4])
-        # 5-8: Digits
-        res[5] = to_digit.get(res[5], res[5])
-        res[6] = to_digit.get(res[6], res[6])
-        res[7] = to_digit.get(res[7], res[7])
-        res[8] = to_digit.get(res[8], res[8])
-        
-        candidate = "".join(res)
-        if re.match(r'^[A-Z]{2}[0-9]{2}[A-Z]{1}[0-9]{4}$', candidate):
-            return candidate
+# Supervisor mode (--supervisor): one process, one WebSocket and one shared
+# OCR model for several gates. The station -> camera map comes from
+# `--stations FILE` or the "stations" key in camera_config.json, e.g.
+# {"1": 0, "2": 2}.
+SUPERVISOR = '--supervisor' in sys.argv
 
-    # Fallback: Just try to fix last 4 digits
-    if len(clean) >= 4:
-        prefix = clean[:-4]
-        suffix = clean[-4:]
-        new_suffix = ''.join([to_digit.get(c, c) for c in suffix])
-        if new_suffix.isdigit():
-            return prefix + new_suffix
-            
-    return clean
-# Duplicate configuration block removed — using values defined earlier.
+def load_station_map():
+    """Return {station id: camera index or source}, or {} if none configured"""
+    stations = None
+    if '--stations' in sys.argv:
+        try:
+            path = sys.argv[sys.argv.index('--stations') + 1]
+            with open(path, 'r', encoding='utf-8') as f:
+                stations = json.load(f)
+        except Exception as e:
+            print('[WARN] Could not read station map:', e)
+    if stations is None:
+        stations = load_camera_config().get('stations', {})
+    result = {}
+    for station, camera in stations.items():
+        if isinstance(camera, str) and camera.isdigit():
+            camera = int(camera)
+        result[int(station)] = camera
+    return result
+
+# Captures directory (created on first save). Images are written by a
+# background thread; the directory is kept under CAPTURE_MAX_MB and
+# CAPTURE_MAX_AGE_DAYS by deleting the oldest files first.
+CAPTURES_DIR = "captures"
+CAPTURE_JPEG_QUALITY = int(os.environ.get('CAPTURE_JPEG_QUALITY', '85'))
+CAPTURE_MAX_BYTES = int(float(os.environ.get('CAPTURE_MAX_MB', '200')) * 1024 * 1024)
+CAPTURE_MAX_AGE = float(os.environ.get('CAPTURE_MAX_AGE_DAYS', '7')) * 86400  # seconds
+CAPTURE_QUEUE_SIZE = 16
+CAPTURE_DEDUPE_WINDOW = 64  # recent content hashes remembered for dedupe
 
 # --- STATE ---
-should_capture = False
+pipelines = {}  # station id -> StationPipeline
+wake_main = threading.Event()  # set on every trigger so the main loop reacts at once
+ws_app = None  # connected WebSocketApp, None while the socket is down
+identify_pending = {}  # requestId -> Future waiting for IDENTIFY_RESULT
+identify_lock = threading.Lock()
+identify_ids = itertools.count(1)
 
 def log(message):
     """Print with timestamp"""
@@ -352,18 +758,35 @@ def log(message):
     print(f"[{timestamp}] {message}", flush=True)
 
 def on_message(ws, message):
-    global should_capture
     log(f"[MSG] Received: {message}")
     try:
         data = json.loads(message)
         if data.get("type") == "CAMERA_TRIGGER":
-             # Accept trigger for this station OR if stationId is missing (broadcast)
+             # Route to the pipeline for this station; missing stationId is a broadcast
              target_station = data.get("stationId")
-             if target_station is None or target_station == STATION_ID:
-                log("[TRIG] TRIGGER RECEIVED! Starting capture sequence...")
-                should_capture = True
+             if target_station is None:
+                targets = list(pipelines.values())
+             else:
+                targets = [p for sid, p in pipelines.items() if sid == target_station]
+             if targets:
+                delivery = None
+                if data.get("serverTs") is not None:
+                    # Same clock only when server and camera share a host (or NTP)
+                    delivery = max(0.0, time.time() - data["serverTs"] / 1000.0)
+                    record_stage("trigger.delivery", delivery)
+                for pipeline in targets:
+                    log(f"[TRIG] TRIGGER RECEIVED for station {pipeline.station_id}!")
+                    pipeline.trigger("server", data.get("traceId"), delivery)
              else:
                 log(f"[INFO] Ignored trigger for station {target_station}")
+        elif data.get("type") == "BOOKINGS_CHANGED":
+            if BOOKING_CACHE:
+                get_booking_cache().invalidate()
+        elif data.get("type") == "IDENTIFY_RESULT":
+            with identify_lock:
+                fut = identify_pending.pop(data.get("requestId"), None)
+            if fut is not None and not fut.done():
+                fut.set_result(data)
     except Exception as e:
         log(f"[ERR] Error parsing message: {e}")
 
@@ -371,16 +794,33 @@ def on_error(ws, error):
     log(f"[ERR] WebSocket Error: {error}")
 
 def on_close(ws, close_status_code, close_msg):
+    global ws_app
     log("[INFO] WebSocket Closed")
+    ws_app = None
+    with identify_lock:
+        pending = list(identify_pending.values())
+        identify_pending.clear()
+    for fut in pending:
+        if not fut.done():
+            fut.set_exception(ConnectionError("WebSocket closed before IDENTIFY_RESULT"))
 
 def on_open(ws):
+    global ws_app
     log("[INFO] WebSocket Connected to Server")
+    if "websocket connect" not in startup_times:
+        mark_startup("websocket connect")
     # Register as a CAMERA so server can distinguish it from browser clients
-    try:
-        ws.send(json.dumps({"type": "REGISTER_CAMERA", "stationId": STATION_ID}))
-        log(f"[INFO] Registered as CAMERA for Station {STATION_ID}")
-    except Exception as e:
-        log(f"[WARN] Registration error: {e}")
+    # (once per station when a supervisor runs several gates on this socket)
+    for station_id in (list(pipelines) or [STATION_ID]):
+        try:
+            ws.send(json.dumps({"type": "REGISTER_CAMERA", "stationId": station_id}))
+            log(f"[INFO] Registered as CAMERA for Station {station_id}")
+        except Exception as e:
+            log(f"[WARN] Registration error: {e}")
+    ws_app = ws
+    if BOOKING_CACHE:
+        # Back online: replay offline entries and pick up missed changes
+        get_booking_cache().invalidate()
 
 def ws_thread():
     if websocket is None:
@@ -394,202 +834,2516 @@ def ws_thread():
                                 on_close=on_close)
     ws.run_forever()
 
-def save_image(frame, prefix="capture"):
-    """Save image with timestamp"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{CAPTURES_DIR}/{prefix}_{timestamp}.jpg"
-    cv2.imwrite(filename, frame)
-    log(f"[SAVE] Saved: {filename}")
-    return filename
-
-def process_frame_with_retry(frame):
-    """Try to detect plate with retries"""
-    log("="*60)
-    log("[INFO] STARTING PLATE DETECTION SEQUENCE")
-    log("="*60)
-    
-    for attempt in range(1, MAX_RETRIES + 1):
-        log(f"[INFO] Attempt {attempt}/{MAX_RETRIES}")
-        
-        # Save the captured image
-        saved_file = save_image(frame, f"attempt{attempt}")
-        
-        # Try to detect plate
-        candidates = detect_plate(frame)
-        
-        if candidates:
-            log(f"[SUCCESS] Candidates detected: {candidates}")
-            # Check booking
-            check_booking(candidates)
-            return True
-        else:
-            log(f"[FAIL] No plate detected in attempt {attempt}")
-            if attempt < MAX_RETRIES:
-                log(f"[WAIT] Waiting {RETRY_DELAY}s before retry...")
-                time.sleep(RETRY_DELAY)
-    
-    log("[FAIL] No plate detected after 3 attempts")
-    # Notify server of failure so LCD can be reset (GATE_DENIED)
-    check_booking("NO_PLATE_DETECTED")
-    log("="*60)
-    return False
+# --- TRACING ---
+class StageMetrics:
+    """Cumulative per-stage latency histograms in Prometheus text format"""
 
-def get_preprocessed_variants(frame):
-    """Generate multiple preprocessed versions of the frame to try"""
-    variants = []
-    
-    # 1. Grayscale + Bilateral (Standard)
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    bi = cv2.bilateralFilter(gray, 11, 17, 17)
-    variants.append(("Standard", bi))
-    
-    # 2. CLAHE (Contrast Enhancement) - Good for shadows
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    cl = clahe.apply(gray)
-    variants.append(("Contrast", cl))
-    
-    # 3. Adaptive Threshold (Binary) - Good for clear text
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-    variants.append(("Threshold", thresh))
-    
-    return variants
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}  # (stage, detail) -> [bucket counts..., sum, count]
+        self.outcomes = {}  # outcome -> finished traces
 
-def heuristic_clean(text):
-    """Fix common OCR errors based on Indian Plate format (LLNNLLNNNN)"""
-    # LL = 2 Letters (State)
-    # NN = 2 Numbers (District)
-    # LL = 2 Letters (Series) - Sometimes 1 Letter
-    # NNNN = 4 Numbers (Unique ID)
-    
-    # Common confusions
-    to_digit = {'O': '0', 'I': '1', 'Z': '2', 'S': '5', 'B': '8', 'G': '6', 'Q': '0', 'D': '0', 'A': '4', 'L': '4'}
-    to_alpha = {'0': 'O', '1': 'I', '2': 'Z', '5': 'S', '8': 'B', '6': 'G', '4': 'A'}
-    
-    # Remove any non-alphanumeric
-    clean = ''.join(c for c in text if c.isalnum()).upper()
-    
-    # If length is 10 (Standard: RJ14CV0002), try to force mask LLNNLLNNNN
-    if len(clean) == 10:
-        res = list(clean)
-        # 0,1: Letters
-        res[0] = to_alpha.get(res[0], res[0])
-        res[1] = to_alpha.get(res[1], res[1])
-        # 2,3: Digits
-        res[2] = to_digit.get(res[2], res[2])
-        res[3] = to_digit.get(res[3], res[3])
-        # 4,5: Letters
-        res[4] = to_alpha.get(res[4], res[4])
-        res[5] = to_alpha.get(res[5], res[5])
-        # 6-9: Digits
-        res[6] = to_digit.get(res[6], res[6])
-        res[7] = to_digit.get(res[7], res[7])
-        res[8] = to_digit.get(res[8], res[8])
-        res[9] = to_digit.get(res[9], res[9])
-        
-        candidate = "".join(res)
-        # Verify strict pattern
-        if re.match(r'^[A-Z]{2}[0-9]{2}[A-Z]{2}[0-9]{4}$', candidate):
-            return candidate
-
-    # If length is 9 (Older: KA01A1234), try mask LLNNLNNNN
-    if len(clean) == 9:
-        res = list(clean)
-        # 0,1: Letters
-        res[0] = to_alpha.get(res[0], res[0])
-        res[1] = to_alpha.get(res[1], res[1])
-        # 2,3: Digits
-        res[2] = to_digit.get(res[2], res[2])
-        res[3] = to_digit.get(res[3], res[3])
-        # 4: Letter
-        res[4] = to_alpha.get(res[4], res[4])
-        # 5-8: Digits
-        res[5] = to_digit.get(res[5], res[5])
-        res[6] = to_digit.get(res[6], res[6])
-        res[7] = to_digit.get(res[7], res[7])
-        res[8] = to_digit.get(res[8], res[8])
-        
-        candidate = "".join(res)
-        if re.match(r'^[A-Z]{2}[0-9]{2}[A-Z]{1}[0-9]{4}$', candidate):
-            return candidate
+    def observe(self, stage, seconds, detail=None):
+        with self.lock:
+            row = self.series.setdefault((stage, detail or ""), [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    row[i] += 1
+            row[-2] += seconds
+            row[-1] += 1
 
-    # Fallback: Just try to fix last 4 digits
-    if len(clean) >= 4:
-        prefix = clean[:-4]
-        suffix = clean[-4:]
-        new_suffix = ''.join([to_digit.get(c, c) for c in suffix])
-        if new_suffix.isdigit():
-            return prefix + new_suffix
-            
-    return clean
+    def count_outcome(self, outcome):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
 
-def detect_plate(frame):
-    """Detect plate from frame using multiple preprocessing strategies"""
-    if reader is None:
-        log('[WARN] OCR disabled or not available. Skipping text detection.')
-        log('[INFO] To enable OCR: pip install easyocr && set ENABLE_OCR=1')
-        return []
+    def render(self):
+        lines = ["# HELP gate_stage_seconds Time spent per gate pipeline stage",
+                 "# TYPE gate_stage_seconds histogram"]
+        with self.lock:
+            series = sorted(self.series.items())
+            outcomes = sorted(self.outcomes.items())
+        for (stage, detail), row in series:
+            labels = f'stage="{stage}"' + (f',detail="{detail}"' if detail else "")
+            for bound, n in zip(self.buckets, row):
+                lines.append(f'gate_stage_seconds_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'gate_stage_seconds_bucket{{{labels},le="+Inf"}} {row[-1]}')
+            lines.append(f'gate_stage_seconds_sum{{{labels}}} {row[-2]:.6f}')
+            lines.append(f'gate_stage_seconds_count{{{labels}}} {row[-1]}')
+        lines += ["# HELP gate_triggers_total Finished trigger traces by outcome",
+                  "# TYPE gate_triggers_total counter"]
+        lines += [f'gate_triggers_total{{outcome="{o}"}} {n}' for o, n in outcomes]
+        return "\n".join(lines) + "\n"
 
-    log("[INFO] Running OCR (trying multiple filters)...")
-    
-    candidates = []
-    seen_candidates = set()
-    
-    variants = get_preprocessed_variants(frame)
-    
-    for name, img in variants:
+    def write(self, path=None):
+        """Atomic write, so a textfile collector never sees half a file"""
+        path = path or METRICS_PATH
         try:
-            # allowlist='ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789' improves accuracy
-            result = reader.readtext(img, allowlist='ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
-        except Exception as e:
-            continue
+            tmp = path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+        except OSError as e:
+            log(f"[WARN] Could not write metrics: {e}")
 
-        if not result:
-            continue
+stage_metrics = StageMetrics()
+_trace_local = threading.local()
+_trace_log_lock = threading.Lock()
 
-        for i, (bbox, text, prob) in enumerate(result):
-            # Clean text
-            clean_text = ''.join(e for e in text if e.isalnum()).upper()
-            
-            # Filter noise (Timestamps are usually long, plates are 8-10 chars)
-            if len(clean_text) < 6 or len(clean_text) > 11:
-                continue
-            
-            # Apply heuristic cleaning
-            cleaned_plate = heuristic_clean(clean_text)
-            
-            # Check if it looks like an Indian Plate (e.g., KA01AB1234)
-            # Pattern: 2 Letters + Digits/Letters + 4 Digits
-            is_plate_structure = re.match(r'^[A-Z]{2}.*[0-9]{4}$', cleaned_plate) is not None
-            
-            log(f"  [{name}] Found: '{clean_text}' -> '{cleaned_plate}' (conf: {prob:.2f}) {'[PLATE MATCH]' if is_plate_structure else ''}")
-            
-            # Collection Logic:
-            # Collect if:
-            # 1. Matches Plate Structure
-            # 2. High confidence (> 0.4)
-            
-            should_add = False
-            if is_plate_structure:
-                should_add = True
-            elif prob > 0.4 and len(cleaned_plate) >= 8: # Arbitrary confidence threshold for non-perfect structures
-                should_add = True
-                
-            if should_add and cleaned_plate not in seen_candidates:
-                candidates.append(cleaned_plate)
-                seen_candidates.add(cleaned_plate)
+class Trace:
+    """Spans of one trigger, from sensor to gate decision"""
 
-    # Sort candidates by structure match (prioritize regex match)? 
-    # For now, just sending all of them is fine, server checks all.
-    # But maybe we want to identify the "best" one for logging?
-    
-    if candidates:
+    def __init__(self, station_id, source, t0=None, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.station_id = station_id
+        self.source = source
+        self.t0 = time.time() if t0 is None else t0
+        self.lock = threading.Lock()
+        self.spans = []  # (stage, detail, start, seconds)
+        self.events = []
+        self.handed_off = False  # identify (and finish) happens on another thread
+        self.finished = False
+
+    def add(self, stage, seconds, detail=None, start=None):
+        start = time.time() - seconds if start is None else start
+        with self.lock:
+            self.spans.append((stage, detail, start, seconds))
+
+    def event(self, message):
+        with self.lock:
+            self.events.append((time.time(), message))
+
+    def finish(self, outcome):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            spans = list(self.spans)
+            events = list(self.events)
+        total = time.time() - self.t0
+        stage_metrics.observe("trigger.total", total, outcome)
+        stage_metrics.count_outcome(outcome)
+        record = {
+            "traceId": self.trace_id,
+            "stationId": self.station_id,
+            "source": self.source,
+            "start": datetime.fromtimestamp(self.t0).astimezone().isoformat(),
+            "outcome": outcome,
+            "totalMs": round(total * 1000, 1),
+            "spans": [{"stage": st, "detail": d, "startMs": round((b - self.t0) * 1000, 1),
+                       "durationMs": round(sec * 1000, 1)} for st, d, b, sec in sorted(spans, key=lambda x: x[2])],
+            "events": [{"atMs": round((at - self.t0) * 1000, 1), "event": e} for at, e in events],
+        }
+        with _trace_log_lock:
+            try:
+                with open(TRACE_LOG_PATH, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                log(f"[WARN] Could not write trace log: {e}")
+            stage_metrics.write()
+        log(f"[TRACE] {self.trace_id} {outcome} in {total * 1000:.0f} ms")
+
+def current_trace():
+    return getattr(_trace_local, 'trace', None)
+
+@contextlib.contextmanager
+def use_trace(trace):
+    """Make `trace` current on this thread (for work handed to pools)"""
+    previous = current_trace()
+    _trace_local.trace = trace
+    try:
+        yield trace
+    finally:
+        _trace_local.trace = previous
+
+def record_stage(stage, seconds, detail=None, start=None):
+    """Histogram sample, plus a span on the current trace if there is one"""
+    if not TRACING:
+        return
+    stage_metrics.observe(stage, seconds, detail)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(stage, seconds, detail, start)
+
+@contextlib.contextmanager
+def traced(stage, detail=None):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.time() - start, detail, start)
+
+class MetricsServer:
+    """Serves the stage histograms on http://127.0.0.1:METRICS_PORT/metrics"""
+
+    def __init__(self, port=METRICS_PORT):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = stage_metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics")
+        self.thread.daemon = True
+        self.thread.start()
+        log(f"[INFO] Metrics on http://127.0.0.1:{port}/metrics")
+
+    def stop(self):
+        self.httpd.shutdown()
+
+# --- TRIGGER QUEUE ---
+class TriggerSuperseded(Exception):
+    """Raised inside a capture sequence when a newer trigger replaced it"""
+
+def check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise TriggerSuperseded("newer trigger for this station")
+
+class TriggerQueue:
+    """Timestamped, per-station trigger queue with debounce and coalescing"""
+
+    def __init__(self, debounce=TRIGGER_DEBOUNCE):
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.queued = OrderedDict()  # station id -> (timestamp, source, Trace), oldest first
+        self.last_accepted = {}  # station id -> timestamp of the last accepted trigger
+        self.stats = {"accepted": 0, "debounced": 0, "coalesced": 0, "superseded": 0}
+
+    def put(self, station_id, source, ts=None, trace_id=None, delivery=None, debounce=None):
+        """Queue a trigger; returns "queued", "coalesced" or "debounced" """
+        ts = time.time() if ts is None else ts
+        debounce = self.debounce if debounce is None else debounce
+        with self.lock:
+            last = self.last_accepted.get(station_id)
+            if last is not None and ts - last < debounce:
+                self.stats["debounced"] += 1
+                result = "debounced"
+            else:
+                self.last_accepted[station_id] = ts
+                if station_id in self.queued:
+                    # Keep the first timestamp: the car was there since then
+                    self.stats["coalesced"] += 1
+                    result = "coalesced"
+                    self.queued[station_id][2].event(f"coalesced trigger ({source})")
+                else:
+                    trace = Trace(station_id, source, ts, trace_id)
+                    if delivery is not None:
+                        trace.add("trigger.delivery", delivery, start=ts - delivery)
+                    self.queued[station_id] = (ts, source, trace)
+                    self.stats["accepted"] += 1
+                    result = "queued"
+        if result == "queued":
+            wake_main.set()
+        else:
+            log(f"[TRIG] Station {station_id}: {result} trigger ({source}), {self.stats[result]} so far")
+        return result
+
+    def peek(self, station_id):
+        with self.lock:
+            return self.queued.get(station_id)
+
+    def take(self, station_id):
+        with self.lock:
+            return self.queued.pop(station_id, None)
+
+    def superseded(self):
+        with self.lock:
+            self.stats["superseded"] += 1
+
+trigger_queue = TriggerQueue()
+
+# --- FRAME GRABBER ---
+class FrameGrabber:
+    """Drain the capture device on a background thread into a ring buffer.
+
+    OCR takes seconds; if frames are only read between OCR runs the driver
+    queue fills up and the next trigger sees a stale picture. The grabber
+    keeps reading at device rate and only the newest FRAME_BUFFER_SIZE
+    (timestamp, frame) pairs are kept.
+    """
+
+    def __init__(self, cap, size=FRAME_BUFFER_SIZE, measure_age=False):
+        self.cap = cap
+        self.frames = deque(maxlen=max(1, size))
+        self.measure_age = measure_age
+        self.ages = deque(maxlen=max(1, size))  # (timestamp, driver-reported age in ms)
+        self.cond = threading.Condition()
+        self.frame_count = 0
+        self.failed = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="frame-grabber")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def _run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                if getattr(self.cap, 'finished', False):
+                    log("[INFO] Frame source finished")
+                else:
+                    log("[ERR] Failed to read frame")
+                with self.cond:
+                    self.failed = True
+                    self.cond.notify_all()
+                break
+            ts = time.time()
+            age = frame_age(self.cap) if self.measure_age else None
+            with self.cond:
+                self.frames.append((ts, frame))
+                self.ages.append((ts, age))
+                self.frame_count += 1
+                self.cond.notify_all()
+
+    def latest(self):
+        """Return the newest (timestamp, frame), or (None, None) if empty"""
+        with self.cond:
+            if not self.frames:
+                return None, None
+            return self.frames[-1]
+
+    def collect(self, count, window, after_ts):
+        """Gather up to `count` frames newer than `after_ts` within `window` seconds"""
+        burst = []
+        last_ts = after_ts
+        deadline = time.time() + window
+        while len(burst) < count:
+            remaining = deadline - time.time()
+            if remaining <= 0 or self.failed:
+                break
+            if self.wait_for_frame(last_ts, remaining)[1] is None:
+                continue
+            # Take every buffered frame we have not seen, oldest first
+            for ts, frame in self.since(last_ts)[:count - len(burst)]:
+                burst.append((ts, frame))
+                last_ts = ts
+        if not burst:
+            # Nothing new arrived in time: fall back to the newest frame we hold
+            ts, frame = self.latest()
+            if frame is not None:
+                burst.append((ts, frame))
+        return burst
+
+    def age_of(self, ts):
+        """Driver-reported age (ms) of the buffered frame read at `ts`, if known"""
+        with self.cond:
+            return next((age for t, age in self.ages if t == ts), None)
+
+    def since(self, after_ts):
+        with self.cond:
+            return [(ts, frame) for ts, frame in self.frames if ts > after_ts]
+
+    def wait_for_frame(self, after_ts, timeout):
+        """Block until a frame newer than `after_ts` arrives (or timeout).
+
+        Falls back to the newest frame we have if nothing newer shows up.
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while not self.failed and (not self.frames or self.frames[-1][0] <= after_ts):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            if not self.frames:
+                return None, None
+            return self.frames[-1]
+
+# --- FRAME SOURCES ---
+class ImageSequence:
+    """cv2.VideoCapture stand-in that plays a directory of images in name order"""
+
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, directory, fps=SOURCE_FPS):
+        self.paths = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                            if f.lower().endswith(self.EXTENSIONS))
+        self.fps = fps
+        self.index = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def read(self):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.paths))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.index)
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.paths = []
+
+def load_trigger_script(spec):
+    """Trigger times in media seconds, from "2.5,9,14" or a file with one per line"""
+    if not spec:
+        return []
+    text = spec
+    if os.path.isfile(spec):
+        with open(spec, 'r', encoding='utf-8') as f:
+            text = "\n".join(line.split('#')[0] for line in f)
+    times = []
+    for part in re.split(r'[,\s]+', text.strip()):
+        if not part:
+            continue
+        try:
+            times.append(float(part))
+        except ValueError:
+            log(f"[WARN] Ignoring trigger time {part!r}")
+    return sorted(times)
+
+class ReplaySource:
+    """Pacing and scripted triggers around a file, directory or stream capture.
+
+    Media time is the index of the frame just read divided by the source
+    frame rate (wall time since the first read for live URLs). Scripted
+    triggers go to the attached station once media time reaches them. With
+    pace "fast" the source then hands out one burst of frames and waits for
+    that capture sequence to finish before reading on.
+    """
+
+    def __init__(self, cap, name, pace=SOURCE_PACE, triggers=(), live=False):
+        self.cap = cap
+        self.name = name
+        self.live = live
+        self.pace = 'realtime' if live else pace
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else SOURCE_FPS
+        self.triggers = deque(sorted(triggers))
+        self.pipeline = None
+        self.frames_read = 0
+        self.t0 = None
+        self.last_fired = None  # media time of the last accepted scripted trigger
+        self.fired = 0
+        self.hold = False
+        self.burst_left = 0
+        self.finished = False
+
+    def attach(self, pipeline):
+        self.pipeline = pipeline
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+    def media_time(self):
+        if self.live:
+            return time.time() - self.t0
+        return (self.frames_read - 1) / self.fps
+
+    def read(self):
+        if self.t0 is None:
+            self.t0 = time.time()
+        if self.hold and self.burst_left <= 0:
+            self.wait_idle()
+            self.hold = False
+        ret, frame = self.cap.read()
+        if not ret:
+            # Let the last capture finish before the station shuts down
+            self.wait_idle()
+            self.finished = True
+            return ret, frame
+        self.frames_read += 1
+        media = self.media_time()
+        if self.pace == 'realtime' and not self.live:
+            delay = self.t0 + media - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self.burst_left -= 1
+        while self.triggers and self.triggers[0] <= media:
+            self.fire(self.triggers.popleft())
+        return ret, frame
+
+    def fire(self, at):
+        if self.pipeline is None:
+            return
+        station_id = self.pipeline.station_id
+        if self.pace == 'fast':
+            # Wall-clock debounce means nothing when frames are not paced
+            if self.last_fired is not None and at - self.last_fired < TRIGGER_DEBOUNCE:
+                log(f"[TRIG] Station {station_id}: debounced scripted trigger at {at:.2f}s")
+                return
+            result = trigger_queue.put(station_id, "script", debounce=0)
+        else:
+            result = trigger_queue.put(station_id, "script")
+        log(f"[TRIG] Station {station_id}: scripted trigger at {at:.2f}s "
+            f"(frame {self.frames_read} of {self.name}) {result}")
+        if result != "queued":
+            return
+        self.last_fired = at
+        self.fired += 1
+        if self.pace == 'fast':
+            # The frame being returned is the first of the burst
+            self.hold = True
+            self.burst_left = BURST_FRAMES - 1
+
+    def wait_idle(self):
+        """Block until every accepted scripted trigger has been captured"""
+        if self.pipeline is None:
+            return
+        with self.pipeline.done:
+            while self.pipeline.script_runs < self.fired and not stop_requested.is_set():
+                self.pipeline.done.wait(0.2)
+
+def open_source(spec, station_id=None):
+    """Capture for a device index, video file, image directory or RTSP/HTTP URL"""
+    if isinstance(spec, int):
+        cap = cv2.VideoCapture(spec, capture_api())
+        if cap.isOpened() and CAPTURE_NEGOTIATE:
+            start = time.time()
+            negotiate_capture(cap, spec, station_id)
+            mark_startup("camera negotiate" if not SUPERVISOR else f"camera negotiate s{station_id}",
+                         time.time() - start)
+        return cap
+    cap = ImageSequence(spec) if os.path.isdir(spec) else cv2.VideoCapture(spec)
+    if not cap.isOpened():
+        return cap
+    live = '://' in spec
+    triggers = load_trigger_script(SOURCE_TRIGGERS)
+    if live and not triggers:
+        return cap
+    source = ReplaySource(cap, os.path.basename(spec.rstrip('/\\')) or spec, triggers=triggers, live=live)
+    log(f"[INFO] Frame source {spec}: {'live' if live else f'{source.fps:g} fps, {source.pace} pace'}"
+        f", {len(triggers)} scripted trigger(s)")
+    return source
+
+# --- CAPTURE WRITER ---
+class CaptureWriter:
+    """Write capture JPEGs on a background thread with dedupe and a disk budget.
+
+    submit() never blocks: if the queue is full the image is dropped. Frames
+    whose pixels hash the same as a recently written one are skipped, and
+    after every write the oldest files are evicted until the directory is
+    within max_bytes and max_age.
+    """
+
+    def __init__(self, directory=None, quality=CAPTURE_JPEG_QUALITY,
+                 max_bytes=CAPTURE_MAX_BYTES, max_age=CAPTURE_MAX_AGE):
+        self.directory = directory or CAPTURES_DIR
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.queue = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        self.recent = OrderedDict()  # content hash -> filename
+        self.files = None            # [[mtime, size, path], ...] oldest first, built on first write
+        self.total_bytes = 0
+        self.thread = threading.Thread(target=self._run, name="capture-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, frame, prefix="capture"):
+        """Queue a frame for writing; returns the planned filename or None if dropped"""
+        # Millisecond resolution so a burst doesn't overwrite itself
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        filename = f"{self.directory}/{prefix}_{timestamp}.jpg"
+        try:
+            self.queue.put_nowait((frame, filename))
+        except queue.Full:
+            log(f"[WARN] Capture queue full, dropping {filename}")
+            return None
+        return filename
+
+    def flush(self, timeout=5.0):
+        """Wait (bounded) for queued images to hit the disk"""
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def _run(self):
+        while True:
+            frame, filename = self.queue.get()
+            try:
+                self._write(frame, filename)
+            except Exception as e:
+                log(f"[ERR] Failed to save {filename}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, frame, filename):
+        digest = hashlib.blake2b(np.ascontiguousarray(frame).data, digest_size=16).hexdigest()
+        if digest in self.recent:
+            self.recent.move_to_end(digest)
+            log(f"[SAVE] Skipped duplicate of {self.recent[digest]}")
+            return
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+            log(f"✓ Created {self.directory}/ directory")
+        if self.files is None:
+            self._scan()
+
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise RuntimeError("JPEG encode failed")
+        base, n = filename[:-4], 1
+        while os.path.exists(filename):
+            filename = f"{base}_{n}.jpg"
+            n += 1
+        with open(filename, 'wb') as f:
+            f.write(buf.tobytes())
+
+        self.recent[digest] = filename
+        while len(self.recent) > CAPTURE_DEDUPE_WINDOW:
+            self.recent.popitem(last=False)
+        self.files.append([time.time(), len(buf), filename])
+        self.total_bytes += len(buf)
+        log(f"[SAVE] Saved: {filename} ({len(buf) // 1024} KB)")
+        self._evict()
+
+    def _scan(self):
+        self.files = []
+        for name in os.listdir(self.directory):
+            if not name.lower().endswith('.jpg'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            self.files.append([st.st_mtime, st.st_size, path])
+        self.files.sort()
+        self.total_bytes = sum(f[1] for f in self.files)
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        removed = 0
+        while self.files and (self.total_bytes > self.max_bytes or self.files[0][0] < cutoff):
+            mtime, size, path = self.files.pop(0)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            log(f"[SAVE] Evicted {removed} old capture(s), {self.total_bytes // (1024 * 1024)} MB in use")
+
+_capture_writer = None
+
+def get_capture_writer():
+    global _capture_writer
+    if _capture_writer is None:
+        _capture_writer = CaptureWriter()
+    return _capture_writer
+
+def save_image(frame, prefix="capture"):
+    """Queue image for saving with a millisecond timestamp (non-blocking)"""
+    return get_capture_writer().submit(frame, prefix)
+
+def score_frame(frame):
+    """Cheap quality score for ranking burst frames (higher is better).
+
+    Combines focus (variance of the Laplacian), exposure (mid-grey mean and
+    few clipped pixels) and motion blur (how lopsided x vs y gradients are).
+    Runs on a downscaled grey copy so scoring a whole burst costs a few ms.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    h, w = gray.shape[:2]
+    if w > 320:
+        gray = cv2.resize(gray, (320, max(1, int(h * 320 / w))), interpolation=cv2.INTER_AREA)
+
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    mean = float(gray.mean())
+    clipped = float(((gray < 10) | (gray > 245)).mean())
+    exposure = max(0.0, 1.0 - abs(mean - 128) / 128) * (1.0 - clipped)
+
+    # Motion blur smears edges along one axis: compare gradient energy in x and y
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    ex, ey = float((gx * gx).mean()), float((gy * gy).mean())
+    isotropy = min(ex, ey) / max(ex, ey) if max(ex, ey) > 0 else 0.0
+
+    score = sharpness * (0.25 + 0.75 * exposure) * (0.5 + 0.5 * isotropy)
+    return score, {"sharpness": sharpness, "exposure": exposure, "isotropy": isotropy}
+
+def rank_burst(frames):
+    """Score (timestamp, frame) pairs and return them best-first with their scores"""
+    scored = []
+    for ts, frame in frames:
+        score, details = score_frame(frame)
+        scored.append((score, ts, frame, details))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return scored
+
+def process_burst(frames, station_id=None, trigger_ts=None, cancel=None):
+    """OCR the best-scoring burst frames until the plate vote converges"""
+    log("="*60)
+    log("[INFO] STARTING PLATE DETECTION SEQUENCE")
+    log("="*60)
+
+    with traced("frame.rank"):
+        ranked = rank_burst(frames)
+    top = ranked[:BURST_TOP_K]
+    log(f"[INFO] Burst: {len(frames)} frames, OCR on best {len(top)}")
+
+    voter = PlateVoter()
+    candidates = []
+    for rank, (score, ts, frame, details) in enumerate(top, start=1):
+        check_cancel(cancel)
+        log(f"[INFO] Frame {rank}/{len(top)} (score {score:.0f}, sharp {details['sharpness']:.0f}, "
+            f"exp {details['exposure']:.2f}, iso {details['isotropy']:.2f})")
+
+        # Save the captured image
+        prefix = f"station{station_id}_burst{rank}" if SUPERVISOR else f"burst{rank}"
+        with traced("capture.save"):
+            saved_file = save_image(frame, prefix)
+
+        # Try to detect plate
+        with traced("detect.plate"):
+            found = detect_plate(frame, voter=voter, station_id=station_id, cancel=cancel, trigger_ts=trigger_ts)
+        for plate in found:
+            if plate not in candidates:
+                candidates.append(plate)
+
+        if isinstance(found, CachedCandidates):
+            # The cached reads are one earlier observation: vote them once, not once per frame
+            fused_list = voter.ranked()
+            ordered = fused_list + [p for p in candidates if p not in fused_list]
+            log(f"[SUCCESS] Recent vehicle, reusing its reads: {ordered}")
+            check_booking(ordered, station_id, trigger_ts)
+            return True
+
+        fused, vote_score = voter.fuse()
+        if voter.converged():
+            # Fused plate goes first so the server sees it as plateNumber
+            fused_list = voter.ranked()
+            ordered = fused_list + [p for p in candidates if p not in fused_list]
+            log(f"[SUCCESS] Vote converged: {fused} (score {vote_score:.2f})")
+            check_booking(ordered, station_id, trigger_ts)
+            return True
+        log(f"[INFO] Vote after frame {rank}: {fused or '-'} (score {vote_score:.2f})")
+        if BOOKING_CACHE and FUZZY_MATCH and candidates:
+            # A confident near-miss on a booked plate ends the burst early
+            fused_list = voter.ranked()
+            ordered = fused_list + [p for p in candidates if p not in fused_list]
+            match = get_booking_cache().match(ordered, station_id)
+            if match is not None:
+                log(f"[SUCCESS] Matched booked plate {match[0]} after frame {rank} (cost {match[1]:.2f})")
+                check_booking(ordered, station_id, trigger_ts)
+                return True
+
+    if candidates:
+        fused_list = voter.ranked()
+        ordered = fused_list + [p for p in candidates if p not in fused_list]
+        log(f"[SUCCESS] Candidates detected: {ordered}")
+        check_booking(ordered, station_id, trigger_ts)
+        return True
+
+    log(f"[FAIL] No plate detected in best {len(top)} frames")
+    # Notify server of failure so LCD can be reset (GATE_DENIED)
+    check_booking("NO_PLATE_DETECTED", station_id, trigger_ts)
+    log("="*60)
+    return False
+
+# --- PREPROCESSING ---
+# Each stage is built from the shared graph on first use, so grayscale is
+# computed once per image and variants that are never tried cost nothing.
+def _stage_gray(graph):
+    image = graph.image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+def _stage_standard(graph):
+    # 1. Grayscale + Bilateral (Standard)
+    return cv2.bilateralFilter(graph.get("gray"), 11, 17, 17)
+
+def _stage_contrast(graph):
+    # 2. CLAHE (Contrast Enhancement) - Good for shadows
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return clahe.apply(graph.get("gray"))
+
+def _stage_threshold(graph):
+    # 3. Adaptive Threshold (Binary) - Good for clear text
+    return cv2.adaptiveThreshold(graph.get("gray"), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+PREPROCESS_STAGES = {
+    "gray": _stage_gray,
+    "Standard": _stage_standard,
+    "Contrast": _stage_contrast,
+    "Threshold": _stage_threshold,
+}
+VARIANT_NAMES = ["Standard", "Contrast", "Threshold"]
+
+class PreprocessGraph:
+    """Lazily evaluated preprocessing stages for one image"""
+
+    def __init__(self, image):
+        self.image = image
+        self.cache = {}
+
+    def get(self, stage):
+        if stage not in self.cache:
+            self.cache[stage] = PREPROCESS_STAGES[stage](self)
+        return self.cache[stage]
+
+def get_preprocessed_variants(frame):
+    """Generate multiple preprocessed versions of the frame to try"""
+    graph = PreprocessGraph(frame)
+    return [(name, graph.get(name)) for name in VARIANT_NAMES]
+
+# --- PLATE TEXT CLEANUP ---
+# Position masks: L = letter, N = digit
+PLATE_MASKS = {
+    10: "LLNNLLNNNN",  # Standard: RJ14CV0002
+    9: "LLNNLNNNN",    # Older: KA01A1234
+}
+PLATE_MASK_RES = {
+    10: re.compile(r'^[A-Z]{2}[0-9]{2}[A-Z]{2}[0-9]{4}$'),
+    9: re.compile(r'^[A-Z]{2}[0-9]{2}[A-Z]{1}[0-9]{4}$'),
+}
+
+# Weighted OCR confusions: (read as, actually is) -> likelihood relative to
+# reading the character correctly (1.0). Cross-class pairs let a digit in a
+# letter slot (or vice versa) be repaired; same-class pairs are lookalikes.
+OCR_CONFUSIONS = {
+    # letter read, digit meant
+    ('O', '0'): 0.9, ('Q', '0'): 0.6, ('D', '0'): 0.6, ('U', '0'): 0.2,
+    ('I', '1'): 0.9, ('L', '1'): 0.3, ('T', '1'): 0.2,
+    ('Z', '2'): 0.8, ('S', '5'): 0.8, ('B', '8'): 0.8, ('G', '6'): 0.7,
+    ('A', '4'): 0.6, ('L', '4'): 0.4, ('T', '7'): 0.4, ('J', '3'): 0.2,
+    # digit read, letter meant
+    ('0', 'O'): 0.9, ('0', 'D'): 0.5, ('0', 'Q'): 0.3, ('1', 'I'): 0.9,
+    ('1', 'L'): 0.3, ('2', 'Z'): 0.8, ('5', 'S'): 0.8, ('8', 'B'): 0.8,
+    ('6', 'G'): 0.7, ('4', 'A'): 0.6, ('7', 'T'): 0.4, ('3', 'B'): 0.2,
+    # lookalikes within the same class
+    ('O', 'D'): 0.3, ('D', 'O'): 0.3, ('Q', 'O'): 0.3, ('O', 'Q'): 0.2,
+    ('U', 'V'): 0.2, ('V', 'U'): 0.2, ('M', 'N'): 0.15, ('N', 'M'): 0.15,
+    ('E', 'F'): 0.15, ('F', 'E'): 0.15, ('P', 'R'): 0.15, ('R', 'P'): 0.15,
+    ('8', '3'): 0.2, ('3', '8'): 0.2, ('8', '0'): 0.15, ('0', '8'): 0.15,
+    ('1', '7'): 0.2, ('7', '1'): 0.2, ('5', '6'): 0.15, ('6', '5'): 0.15,
+}
+
+def _build_char_options():
+    """(read char, slot class) -> [(replacement, log weight)], best first"""
+    letters = set('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    digits = set('0123456789')
+    options = {}
+    for read in letters | digits:
+        for cls, allowed in (('L', letters), ('N', digits)):
+            opts = []
+            if read in allowed:
+                opts.append((read, 0.0))
+            for (seen, meant), w in OCR_CONFUSIONS.items():
+                if seen == read and meant in allowed:
+                    opts.append((meant, math.log(w)))
+            opts.sort(key=lambda o: o[1], reverse=True)
+            options[(read, cls)] = opts
+    return options
+
+PLATE_CHAR_OPTIONS = _build_char_options()
+
+# The last-4-digits fallback only trusts the long-standing strong confusions;
+# weak pairs (U->0, T->7) are for ranking candidates, not rewriting a suffix
+PLATE_SUFFIX_DIGITS = {c: PLATE_CHAR_OPTIONS[(c, 'N')][0][0] for c in 'OIZSBGQDAL'}
+
+def plate_candidates(text, k=PLATE_TOP_K):
+    """Ranked plate readings for `text` as [(plate, score)], best first.
+
+    Beam search over the 9/10 character masks using OCR_CONFUSIONS; score
+    is the product of per-character weights (1.0 = read as-is). Returns []
+    if the text can't be forced into a plate mask.
+    """
+    clean = ''.join(c for c in text if c.isalnum()).upper()
+    mask = PLATE_MASKS.get(len(clean))
+    if mask is None:
+        return []
+
+    beams = [("", 0.0)]
+    for ch, cls in zip(clean, mask):
+        opts = PLATE_CHAR_OPTIONS.get((ch, cls))
+        if not opts:
+            return []
+        beams = [(prefix + rep, score + w) for prefix, score in beams for rep, w in opts]
+        beams.sort(key=lambda b: b[1], reverse=True)
+        del beams[PLATE_BEAM_WIDTH:]
+
+    pattern = PLATE_MASK_RES[len(clean)]
+    return [(plate, math.exp(score)) for plate, score in beams if pattern.match(plate)][:k]
+
+def heuristic_clean(text):
+    """Fix common OCR errors based on Indian Plate format (LLNNLLNNNN)"""
+    # LL = 2 Letters (State)
+    # NN = 2 Numbers (District)
+    # LL = 2 Letters (Series) - Sometimes 1 Letter
+    # NNNN = 4 Numbers (Unique ID)
+
+    # Remove any non-alphanumeric
+    clean = ''.join(c for c in text if c.isalnum()).upper()
+
+    # Length 10 / 9: best reading under the plate mask
+    ranked = plate_candidates(clean, k=1)
+    if ranked:
+        return ranked[0][0]
+
+    # Fallback: Just try to fix last 4 digits
+    if len(clean) >= 4:
+        prefix = clean[:-4]
+        suffix = clean[-4:]
+        new_suffix = ''.join(PLATE_SUFFIX_DIGITS.get(c, c) for c in suffix)
+        if new_suffix.isdigit():
+            return prefix + new_suffix
+            
+    return clean
+
+# --- CANDIDATE FUSION ---
+class PlateVoter:
+    """Fuse plate reads from several frames and variants into one plate.
+
+    Reads that fit a plate mask are aligned position by position (per mask
+    length) and vote for each character with their OCR confidence. The
+    fused plate's score is the weakest position's vote share times a
+    saturating function of the total confidence behind it, so one shaky
+    read scores low and several agreeing reads score high.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.votes = {}    # length -> [{char: weight}, ...] per position
+        self.support = {}  # length -> total confidence of reads of that length
+        self.tally = {}    # plate -> summed confidence, for the ranked list
+        self.count = 0
+
+    def add(self, plate, conf):
+        conf = max(0.0, float(conf))
+        with self.lock:
+            self.count += 1
+            self.tally[plate] = self.tally.get(plate, 0.0) + conf
+            pattern = PLATE_MASK_RES.get(len(plate))
+            if pattern is None or not pattern.match(plate):
+                return
+            positions = self.votes.setdefault(len(plate), [{} for _ in plate])
+            for pos, ch in zip(positions, plate):
+                pos[ch] = pos.get(ch, 0.0) + conf
+            self.support[len(plate)] = self.support.get(len(plate), 0.0) + conf
+
+    def fuse(self):
+        """Return (fused plate, score), or (None, 0.0) if nothing fits a mask"""
+        with self.lock:
+            if not self.support:
+                return None, 0.0
+            length = max(self.support, key=self.support.get)
+            positions = self.votes[length]
+            support = self.support[length]
+        plate = ''.join(max(pos, key=pos.get) for pos in positions)
+        agreement = min(max(pos.values()) / sum(pos.values()) for pos in positions)
+        score = agreement * (1.0 - math.exp(-support / VOTE_SUPPORT_SCALE))
+        return plate, score
+
+    def converged(self):
+        plate, score = self.fuse()
+        return plate is not None and score >= VOTE_CONVERGE_SCORE
+
+    def ranked(self, n=VOTE_TOP_N):
+        """Fused plate first, then the most supported raw reads"""
+        plate, _ = self.fuse()
+        with self.lock:
+            reads = sorted(self.tally, key=self.tally.get, reverse=True)
+        out = [plate] if plate else []
+        out += [r for r in reads if r != plate]
+        return out[:n]
+
+# --- PLATE LOCALIZATION ---
+_plate_cascade = None
+
+def get_plate_cascade():
+    """Load PLATE_CASCADE once; returns None when not configured or unreadable"""
+    global _plate_cascade
+    if _plate_cascade is None and PLATE_CASCADE:
+        cascade = cv2.CascadeClassifier(PLATE_CASCADE)
+        if cascade.empty():
+            log(f"[WARN] Could not load plate cascade: {PLATE_CASCADE}")
+            cascade = False
+        _plate_cascade = cascade
+    return _plate_cascade or None
+
+def order_corners(pts):
+    """Order 4 points as top-left, top-right, bottom-right, bottom-left"""
+    pts = np.asarray(pts, dtype=np.float32)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+def warp_plate(frame, rect, pad=0.08):
+    """Crop a (possibly rotated) rect out of the frame and deskew it to horizontal"""
+    (cx, cy), (w, h), angle = rect
+    if w < h:
+        # minAreaRect may report the long side as height; rotate so it is width
+        w, h, angle = h, w, angle + 90
+    w, h = w * (1 + pad), h * (1 + 2 * pad)
+    corners = order_corners(cv2.boxPoints(((cx, cy), (w, h), angle)))
+    out_w, out_h = max(1, int(round(w))), max(1, int(round(h)))
+    dst = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+    roi = cv2.warpPerspective(frame, cv2.getPerspectiveTransform(corners, dst), (out_w, out_h))
+    return upscale_roi(roi)
+
+def upscale_roi(roi):
+    """EasyOCR struggles with tiny text: bring small crops up to a readable height"""
+    h, w = roi.shape[:2]
+    if h < 64:
+        scale = 64.0 / h
+        roi = cv2.resize(roi, (max(1, int(w * scale)), 64), interpolation=cv2.INTER_CUBIC)
+    return roi
+
+_roi_config = (None, {})  # (mtime, {station id: [[x, y, w, h], ...]})
+
+def fixed_rois(frame, station_id):
+    """Crops for the station's fixed plate boxes from roi_config.json, if any"""
+    global _roi_config
+    try:
+        mtime = os.path.getmtime(ROI_CONFIG_PATH)
+    except OSError:
+        return []
+    if _roi_config[0] != mtime:
+        try:
+            with open(ROI_CONFIG_PATH, 'r', encoding='utf-8') as f:
+                _roi_config = (mtime, json.load(f))
+        except Exception as e:
+            log(f"[WARN] Could not read {ROI_CONFIG_PATH}: {e}")
+            _roi_config = (mtime, {})
+    boxes = _roi_config[1].get(str(station_id), [])
+    fh, fw = frame.shape[:2]
+    crops = []
+    for box in boxes:
+        x, y, w, h = box
+        if all(v <= 1 for v in box):
+            x, y, w, h = x * fw, y * fh, w * fw, h * fh
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(fw, int(x + w)), min(fh, int(y + h))
+        if x1 > x0 and y1 > y0:
+            crops.append(upscale_roi(frame[y0:y1, x0:x1]))
+    return crops
+
+def localize_plates(frame, max_rois=PLATE_MAX_ROIS):
+    """Find plate-like regions and return deskewed crops, best first.
+
+    Contour pass: edges -> closed contours -> min-area rects with a plate
+    aspect ratio and size, ranked by rectangularity times local contrast.
+    If PLATE_CASCADE is set, its detections are ranked ahead of contours.
+    """
+    h, w = frame.shape[:2]
+    scale = min(1.0, LOCALIZE_WIDTH / float(w))
+    small = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    frame_area = float(gray.shape[0] * gray.shape[1])
+
+    rects = []  # (score, rect in full-frame coordinates)
+
+    cascade = get_plate_cascade()
+    if cascade is not None:
+        for (x, y, bw, bh) in cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4):
+            rect = ((x + bw / 2.0) / scale, (y + bh / 2.0) / scale), (bw / scale, bh / scale), 0.0
+            rects.append((float('inf'), rect))
+
+    blur = cv2.bilateralFilter(gray, 11, 17, 17)
+    edges = cv2.Canny(blur, 30, 200)
+    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 3)))
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if not (PLATE_AREA_RANGE[0] * frame_area <= area <= PLATE_AREA_RANGE[1] * frame_area):
+            continue
+        rect = cv2.minAreaRect(cnt)
+        (cx, cy), (rw, rh), angle = rect
+        long_side, short_side = max(rw, rh), min(rw, rh)
+        if short_side < 1:
+            continue
+        aspect = long_side / short_side
+        if not (PLATE_ASPECT_RANGE[0] <= aspect <= PLATE_ASPECT_RANGE[1]):
+            continue
+        rectangularity = area / (rw * rh)
+        if rectangularity < 0.6:
+            continue
+        x, y, bw, bh = cv2.boundingRect(cnt)
+        contrast = float(gray[y:y + bh, x:x + bw].std())
+        rect = ((cx / scale, cy / scale), (rw / scale, rh / scale), angle)
+        rects.append((rectangularity * contrast, rect))
+
+    rects.sort(key=lambda item: item[0], reverse=True)
+
+    # Drop candidates whose centre falls inside an already chosen region
+    chosen = []
+    for score, rect in rects:
+        (cx, cy) = rect[0]
+        if any(cv2.pointPolygonTest(cv2.boxPoints(c).astype(np.float32), (cx, cy), False) >= 0 for c in chosen):
+            continue
+        chosen.append(rect)
+        if len(chosen) >= max_rois:
+            break
+
+    return [warp_plate(frame, rect) for rect in chosen]
+
+# --- OCR BACKENDS ---
+# Every backend answers in EasyOCR's shape, [(bbox, text, prob)] with prob in
+# 0..1, and honours the same allowlist, so the rest of the pipeline does not
+# care which engine produced a read.
+class OcrBackend:
+    """Base class: subclasses implement readtext() and _recognize_line()"""
+    name = "base"
+
+    def describe(self):
+        return self.name
+
+    def readtext(self, image, allowlist=None):
+        raise NotImplementedError
+
+    def _recognize_line(self, image, allowlist):
+        """(text, prob) for an image that holds one line of text"""
+        raise NotImplementedError
+
+    def recognize(self, image, horizontal_list=None, free_list=None, allowlist=None, batch_size=1):
+        """Recognizer only, on whole image or on [x_min, x_max, y_min, y_max] boxes"""
+        h, w = image.shape[:2]
+        boxes = horizontal_list if horizontal_list is not None else [[0, w, 0, h]]
+        out = []
+        for x0, x1, y0, y1 in boxes:
+            text, prob = self._recognize_line(image[y0:y1, x0:x1], allowlist or OCR_ALLOWLIST)
+            if text:
+                out.append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, prob))
+        return out
+
+class EasyOcrBackend(OcrBackend):
+    """EasyOCR (CRAFT detector + CRNN recognizer) on torch"""
+    name = "easyocr"
+
+    def __init__(self, threads=0, int8=False):
+        import easyocr
+        if threads:
+            import torch
+            torch.set_num_threads(threads)  # process-wide for torch
+        self.reader = easyocr.Reader(['en'])
+        self.int8 = False
+        if int8:
+            if getattr(self.reader, 'device', 'cpu') != 'cpu':
+                log("[WARN] OCR_INT8 ignored: EasyOCR is running on GPU")
+            else:
+                import torch
+                # Dynamic quantization: LSTM/Linear weights stored as int8
+                self.reader.recognizer = torch.quantization.quantize_dynamic(
+                    self.reader.recognizer, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+                self.int8 = True
+        self.threads = threads
+
+    def describe(self):
+        return f"EasyOCR, threads={self.threads or 'default'}{', int8' if self.int8 else ''}"
+
+    def readtext(self, image, allowlist=None):
+        return self.reader.readtext(image, allowlist=allowlist or OCR_ALLOWLIST)
+
+    def readtext_batched(self, images, allowlist=None, batch_size=1):
+        return self.reader.readtext_batched(images, allowlist=allowlist or OCR_ALLOWLIST, batch_size=batch_size)
+
+    def recognize(self, image, horizontal_list=None, free_list=None, allowlist=None, batch_size=1):
+        kwargs = {'allowlist': allowlist or OCR_ALLOWLIST, 'batch_size': batch_size}
+        if horizontal_list is not None:
+            kwargs.update(horizontal_list=horizontal_list, free_list=free_list or [])
+        return self.reader.recognize(image, **kwargs)
+
+class TesseractBackend(OcrBackend):
+    """Tesseract through pytesseract; sparse-text mode for frames, single line for crops"""
+    name = "tesseract"
+
+    def __init__(self, threads=0, int8=False):
+        import pytesseract
+        self.tess = pytesseract
+        self.threads = threads
+        if threads:
+            # The tesseract binary reads this from the environment it inherits
+            os.environ['OMP_THREAD_LIMIT'] = str(threads)
+        if int8:
+            log("[WARN] OCR_INT8 ignored: not supported by the tesseract backend")
+        self.tess.get_tesseract_version()  # fail now if the binary is missing
+
+    def describe(self):
+        return f"Tesseract {self.tess.get_tesseract_version()}, threads={self.threads or 'default'}"
+
+    def _data(self, image, psm, allowlist):
+        config = f"--psm {psm} -c tessedit_char_whitelist={allowlist}"
+        return self.tess.image_to_data(image, config=config, output_type=self.tess.Output.DICT)
+
+    def readtext(self, image, allowlist=None):
+        data = self._data(image, 11, allowlist or OCR_ALLOWLIST)
+        lines = OrderedDict()  # (block, paragraph, line) -> words
+        for i, word in enumerate(data['text']):
+            conf = float(data['conf'][i])
+            if not word.strip() or conf < 0:
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(i)
+        out = []
+        for idx in lines.values():
+            x0 = min(data['left'][i] for i in idx)
+            y0 = min(data['top'][i] for i in idx)
+            x1 = max(data['left'][i] + data['width'][i] for i in idx)
+            y1 = max(data['top'][i] + data['height'][i] for i in idx)
+            text = ' '.join(data['text'][i].strip() for i in idx)
+            prob = sum(float(data['conf'][i]) for i in idx) / len(idx) / 100.0
+            out.append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, prob))
+        return out
+
+    def _recognize_line(self, image, allowlist):
+        data = self._data(image, 7, allowlist)
+        words = [(w.strip(), float(c)) for w, c in zip(data['text'], data['conf']) if w.strip() and float(c) >= 0]
+        if not words:
+            return "", 0.0
+        return ' '.join(w for w, _ in words), sum(c for _, c in words) / len(words) / 100.0
+
+class OnnxRecognizerBackend(OcrBackend):
+    """CTC text recognizer (CRNN-style ONNX model) on ONNX Runtime or OpenCV DNN.
+
+    There is no text detector: readtext() reads the whole image as one line,
+    so this backend is meant for plate crops (localizer / fixed ROIs).
+    """
+    name = "onnx"
+
+    def __init__(self, model, threads=0, int8=False, charset=OCR_ONNX_CHARSET):
+        if not model:
+            raise ValueError("onnx backend needs a model path (OCR_ONNX_MODEL or \"model\" in config)")
+        if not os.path.isabs(model):
+            model = os.path.join(os.path.dirname(os.path.abspath(__file__)), model)
+        if int8:
+            model = self._int8_model(model)
+        self.model = model
+        self.threads = threads
+        self.charset = charset
+        self.session = None
+        self.net = None
+        try:
+            import onnxruntime as ort
+            opts = ort.SessionOptions()
+            if threads:
+                opts.intra_op_num_threads = threads
+                opts.inter_op_num_threads = 1
+            self.session = ort.InferenceSession(model, opts, providers=['CPUExecutionProvider'])
+            inp = self.session.get_inputs()[0]
+            self.input_name = inp.name
+            shape = inp.shape
+        except ImportError:
+            self.net = cv2.dnn.readNetFromONNX(model)
+            if threads:
+                cv2.setNumThreads(threads)  # process-wide for OpenCV
+            shape = [1, 1, 32, None]
+        self.height = shape[2] if isinstance(shape[2], int) else 32
+        self.width = shape[3] if isinstance(shape[3], int) else None  # None: keep aspect
+
+    @staticmethod
+    def _int8_model(model):
+        """Path of the int8 copy of `model`, quantizing it once if needed"""
+        root, ext = os.path.splitext(model)
+        quantized = f"{root}.int8{ext}"
+        if not os.path.exists(quantized):
+            try:
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                quantize_dynamic(model, quantized, weight_type=QuantType.QInt8)
+                log(f"[INFO] Wrote int8 OCR model {quantized}")
+            except Exception as e:
+                log(f"[WARN] Could not quantize {model} to int8, using float weights: {e}")
+                return model
+        return quantized
+
+    def describe(self):
+        engine = "ONNX Runtime" if self.session is not None else "OpenCV DNN"
+        return f"{engine} {os.path.basename(self.model)}, threads={self.threads or 'default'}"
+
+    def _blob(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        h, w = gray.shape[:2]
+        width = self.width or max(self.height, int(round(w * self.height / float(max(h, 1)))))
+        resized = cv2.resize(gray, (width, self.height), interpolation=cv2.INTER_CUBIC)
+        return ((resized.astype(np.float32) / 255.0 - 0.5) / 0.5)[None, None, :, :]
+
+    def _recognize_line(self, image, allowlist):
+        if image.size == 0:
+            return "", 0.0
+        blob = self._blob(image)
+        if self.session is not None:
+            logits = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            self.net.setInput(blob)
+            logits = self.net.forward()
+        logits = np.squeeze(logits)  # (T, C) after dropping the batch axis
+        if logits.ndim != 2:
+            return "", 0.0
+        if logits.shape[0] == len(self.charset) + 1 and logits.shape[1] != len(self.charset) + 1:
+            logits = logits.T
+        # Softmax, then drop characters outside the allowlist (blank stays)
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        allowed = set(allowlist.upper())
+        mask = np.array([True] + [c.upper() in allowed for c in self.charset])
+        probs = probs * mask
+        best = probs.argmax(axis=1)
+        text, confs, prev = [], [], 0
+        for t, k in enumerate(best):
+            if k != 0 and k != prev:
+                text.append(self.charset[k - 1].upper())
+                confs.append(probs[t, k])
+            prev = k
+        if not text:
+            return "", 0.0
+        return ''.join(text), float(np.prod(confs) ** (1.0 / len(confs)))
+
+    def readtext(self, image, allowlist=None):
+        return self.recognize(image, allowlist=allowlist)
+
+OCR_BACKENDS = {
+    'easyocr': lambda spec: EasyOcrBackend(spec.get('threads', 0), spec.get('int8', False)),
+    'tesseract': lambda spec: TesseractBackend(spec.get('threads', 0), spec.get('int8', False)),
+    'onnx': lambda spec: OnnxRecognizerBackend(spec.get('model'), spec.get('threads', 0), spec.get('int8', False),
+                                               spec.get('charset', OCR_ONNX_CHARSET)),
+}
+
+def make_ocr_backend(spec):
+    try:
+        factory = OCR_BACKENDS[spec['backend']]
+    except KeyError:
+        raise ValueError(f"unknown OCR backend {spec['backend']!r} (choose from {', '.join(OCR_BACKENDS)})")
+    return factory(spec)
+
+# --- OCR SERVICE ---
+class OcrOverloaded(Exception):
+    """Raised when the OCR queue is full (backpressure)"""
+
+class OcrService:
+    """Micro-batching front end for the shared EasyOCR reader.
+
+    submit() returns a Future. The worker waits up to max_wait after the
+    first queued request for more to arrive, pads similarly sized images to
+    a common shape and runs them through one readtext_batched call, so the
+    detector and recognizer see one batch instead of N serial calls.
+    Recognizer-only requests are stacked into one image with one box per
+    crop and go through a single recognize call.
+    """
+
+    def __init__(self, ocr_reader, max_batch=OCR_BATCH_MAX, max_wait=OCR_BATCH_WAIT, queue_max=OCR_QUEUE_MAX):
+        self.reader = ocr_reader
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=queue_max)
+        self.batched = hasattr(ocr_reader, 'readtext_batched')
+        self.can_recognize = hasattr(ocr_reader, 'recognize')
+        self.batches = 0
+        self.images = 0
+        self.expired = 0
+        self.thread = threading.Thread(target=self._run, name="ocr-service")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, image, deadline=None, op="readtext"):
+        """Queue `image` for `op` ("readtext" or "recognize"); returns a Future"""
+        fut = Future()
+        deadline = deadline or time.time() + OCR_DEADLINE
+        try:
+            # Brief wait for room, then push back on the caller
+            self.queue.put((image, fut, deadline, op), timeout=min(0.5, OCR_DEADLINE))
+        except queue.Full:
+            fut.set_exception(OcrOverloaded("OCR queue full"))
+        return fut
+
+    def readtext(self, image, deadline=None):
+        """Blocking helper: submit and wait for the result"""
+        deadline = deadline or time.time() + OCR_DEADLINE
+        return self._wait(self.submit(image, deadline), deadline)
+
+    def recognize(self, image, deadline=None):
+        """Blocking helper for the recognizer-only path"""
+        deadline = deadline or time.time() + OCR_DEADLINE
+        return self._wait(self.submit(image, deadline, "recognize"), deadline)
+
+    def _wait(self, fut, deadline):
+        """The deadline only bounds queueing: work that has started is waited for"""
+        try:
+            return fut.result(timeout=max(0.0, deadline - time.time()) + 1.0)
+        except FutureTimeout:
+            if fut.cancel():
+                self.expired += 1
+                raise FutureTimeout("OCR request not started before its deadline")
+            return fut.result()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        cutoff = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = cutoff - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.time()
+            live = []
+            recognize = []
+            for image, fut, deadline, op in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue  # the caller already gave up on it
+                if now > deadline:
+                    self.expired += 1
+                    fut.set_exception(FutureTimeout("OCR request expired in queue"))
+                else:
+                    (recognize if op == "recognize" else live).append((image, fut))
+            if recognize:
+                self._execute_recognize(recognize)
+            for group in self._group(live):
+                self._execute(group)
+
+    def _group(self, items):
+        """Split requests into shape-compatible groups (padding waste <= 50%)"""
+        items = sorted(items, key=lambda it: it[0].shape[0] * it[0].shape[1], reverse=True)
+        groups = []
+        for item in items:
+            h, w = item[0].shape[:2]
+            if groups:
+                gh, gw = groups[-1][0]
+                if h * w * 2 >= gh * gw:
+                    groups[-1][1].append(item)
+                    continue
+            groups.append(((h, w), [item]))
+        return [g[1] for g in groups]
+
+    def _execute(self, group):
+        self.batches += 1
+        self.images += len(group)
+        try:
+            if len(group) == 1 or not self.batched:
+                for image, fut in group:
+                    fut.set_result(self.reader.readtext(image, allowlist=OCR_ALLOWLIST))
+                return
+            h = max(img.shape[0] for img, _ in group)
+            w = max(img.shape[1] for img, _ in group)
+            padded = []
+            for img, _ in group:
+                if img.ndim == 3:
+                    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+                canvas = np.full((h, w), 255, dtype=np.uint8)
+                canvas[:img.shape[0], :img.shape[1]] = img
+                padded.append(canvas)
+            results = self.reader.readtext_batched(padded, allowlist=OCR_ALLOWLIST, batch_size=len(padded))
+            for (_, fut), result in zip(group, results):
+                fut.set_result(result)
+        except Exception as e:
+            for _, fut in group:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    def _execute_recognize(self, items):
+        self.batches += 1
+        self.images += len(items)
+        try:
+            if not self.can_recognize:
+                for image, fut in items:
+                    fut.set_result(self.reader.readtext(image, allowlist=OCR_ALLOWLIST))
+                return
+            if len(items) == 1:
+                image, fut = items[0]
+                fut.set_result(self.reader.recognize(image, allowlist=OCR_ALLOWLIST))
+                return
+            # Stack crops vertically, one horizontal box per crop
+            crops = [cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img for img, _ in items]
+            width = max(c.shape[1] for c in crops)
+            canvas = np.full((sum(c.shape[0] for c in crops), width), 255, dtype=np.uint8)
+            boxes, y = [], 0
+            for c in crops:
+                canvas[y:y + c.shape[0], :c.shape[1]] = c
+                boxes.append([0, c.shape[1], y, y + c.shape[0]])
+                y += c.shape[0]
+            results = self.reader.recognize(canvas, horizontal_list=boxes, free_list=[],
+                                            allowlist=OCR_ALLOWLIST, batch_size=len(boxes))
+            per_item = [[] for _ in items]
+            for bbox, text, prob in results:
+                top = min(pt[1] for pt in bbox)
+                for i, (_, _, y0, y1) in enumerate(boxes):
+                    if y0 <= top < y1:
+                        shifted = [[pt[0], pt[1] - y0] for pt in bbox]
+                        per_item[i].append((shifted, text, prob))
+                        break
+            for (_, fut), result in zip(items, per_item):
+                fut.set_result(result)
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+
+_ocr_services = {}  # id(backend) -> OcrService
+_ocr_service_lock = threading.Lock()
+
+def get_ocr_service(ocr_reader):
+    with _ocr_service_lock:
+        if id(ocr_reader) not in _ocr_services:
+            _ocr_services[id(ocr_reader)] = OcrService(ocr_reader)
+        return _ocr_services[id(ocr_reader)]
+
+def ocr_readtext(img, station_id=None):
+    """readtext through the batching service (or directly when batching is off)"""
+    ocr_reader = get_reader(station_id)
+    if not OCR_BATCHING:
+        return ocr_reader.readtext(img, allowlist=OCR_ALLOWLIST)
+    return get_ocr_service(ocr_reader).readtext(img)
+
+def ocr_recognize(img, station_id=None):
+    """Recognizer only: treat the whole image as one text box, no CRAFT detection"""
+    ocr_reader = get_reader(station_id)
+    if not OCR_BATCHING:
+        if not hasattr(ocr_reader, 'recognize'):
+            return ocr_reader.readtext(img, allowlist=OCR_ALLOWLIST)
+        return ocr_reader.recognize(img, allowlist=OCR_ALLOWLIST)
+    return get_ocr_service(ocr_reader).recognize(img)
+
+# --- OCR WORKER PROCESS ---
+class OcrWorkerUnavailable(Exception):
+    """Raised when the OCR worker process is down (crashed / restarting)"""
+
+def _ocr_worker_main(slot_names, requests_q, results_q, spec):
+    """Entry point of the OCR worker process"""
+    # Spawned children share the parent's resource tracker, so attaching here
+    # does not make the segments go away if this process dies
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+
+    ocr = make_ocr_backend(spec)
+    ocr.readtext(np.full((64, 256), 255, dtype=np.uint8), allowlist=OCR_ALLOWLIST)
+    results_q.put(("ready", None, None))
+
+    while True:
+        msg = requests_q.get()
+        if msg is None:
+            break
+        req_id, slot, shape, dtype, inline, op, kwargs = msg
+        try:
+            if inline is not None:
+                img = inline
+            else:
+                img = np.ndarray(shape, dtype=np.dtype(dtype), buffer=slots[slot].buf)
+            if op == "recognize":
+                result = ocr.recognize(img, allowlist=OCR_ALLOWLIST, **kwargs)
+            else:
+                result = ocr.readtext(img, allowlist=OCR_ALLOWLIST)
+            del img
+            out = [([[int(x), int(y)] for x, y in bbox], text, float(prob)) for bbox, text, prob in result]
+            results_q.put((req_id, out, None))
+        except Exception as e:
+            results_q.put((req_id, None, repr(e)))
+
+class ProcessOcr:
+    """Drop-in for an OCR backend's readtext/recognize, run in a worker process.
+
+    The caller copies the image into a free shared-memory slot and sends only
+    (request id, slot, shape, dtype) over the queue. If the worker dies, all
+    in-flight requests fail with OcrWorkerUnavailable and a new worker is
+    started after a backoff that doubles with each recent crash. A worker
+    that has work but has not answered for OCR_HANG_TIMEOUT is treated as
+    hung: it is terminated and restarted the same way. A caller that gives
+    up on its deadline stops waiting and a late reply is ignored, but the
+    slot stays with the worker until it answers or is restarted.
+    """
+
+    def __init__(self, spec, slots=OCR_SHM_SLOTS, slot_bytes=OCR_SHM_SLOT_BYTES):
+        self.spec = spec
+        self.ctx = multiprocessing.get_context('spawn')
+        self.slot_bytes = slot_bytes
+        self.shms = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slots)]
+        self.free = queue.Queue()
+        for i in range(slots):
+            self.free.put(i)
+        self.pending = {}  # request id -> future, while the caller waits
+        self.inflight = {}  # request id -> (send time, slot or None), until the worker answers
+        self.last_reply = time.time()
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.ready = threading.Event()
+        self.crashes = deque()
+        self.closing = False
+        self.proc = None
+        self._spawn()
+        self.monitor = threading.Thread(target=self._monitor, name="ocr-worker-monitor")
+        self.monitor.daemon = True
+        self.monitor.start()
+        atexit.register(self.close)
+
+    def _spawn(self):
+        self.ready.clear()
+        self.requests = self.ctx.Queue()
+        results = self.ctx.Queue()
+        self.proc = self.ctx.Process(target=_ocr_worker_main, name="ocr-worker",
+                                     args=([s.name for s in self.shms], self.requests, results, self.spec))
+        self.proc.daemon = True
+        self.proc.start()
+        t = threading.Thread(target=self._read_results, args=(self.proc, results), name="ocr-worker-results")
+        t.daemon = True
+        t.start()
+
+    def _read_results(self, proc, results):
+        while True:
+            try:
+                req_id, out, err = results.get(timeout=0.5)
+            except queue.Empty:
+                if not proc.is_alive():
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            if req_id == "ready":
+                self.ready.set()
+                continue
+            with self.lock:
+                _, slot = self.inflight.pop(req_id, (None, None))
+                self.last_reply = time.time()
+                fut = self.pending.pop(req_id, None)
+            if slot is not None:
+                self.free.put(slot)
+            if fut is None:
+                continue
+            if err is None:
+                fut.set_result([(bbox, text, prob) for bbox, text, prob in out])
+            else:
+                fut.set_exception(RuntimeError(f"OCR worker error: {err}"))
+
+    def _fail_pending(self, reason):
+        # Only called once the worker is gone, so its slots are free again
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            inflight, self.inflight = self.inflight, {}
+        for _, slot in inflight.values():
+            if slot is not None:
+                self.free.put(slot)
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(OcrWorkerUnavailable(reason))
+
+    def _stuck_for(self):
+        """Seconds the worker has held work without answering anything"""
+        with self.lock:
+            if not self.inflight:
+                return 0.0
+            busy_since = max(self.last_reply, min(sent for sent, _ in self.inflight.values()))
+        return time.time() - busy_since
+
+    def _monitor(self):
+        while not self.closing:
+            self.proc.join(timeout=1.0)
+            if self.closing:
+                continue
+            if self.proc.exitcode is None:
+                stuck = self._stuck_for()
+                if stuck > OCR_HANG_TIMEOUT:
+                    log(f"[ERR] OCR worker unresponsive for {stuck:.1f}s, terminating it")
+                    self.proc.terminate()
+                    self.proc.join(timeout=2)
+                    if self.proc.exitcode is None:
+                        self.proc.kill()
+                        self.proc.join(timeout=2)
+                continue
+            code = self.proc.exitcode
+            self.ready.clear()
+            self._fail_pending(f"worker exited with code {code}")
+            now = time.time()
+            self.crashes.append(now)
+            while self.crashes and now - self.crashes[0] > 600:
+                self.crashes.popleft()
+            backoff = min(OCR_RESTART_MAX_BACKOFF, 2 ** (len(self.crashes) - 1))
+            log(f"[ERR] OCR worker died (exit code {code}), restarting in {backoff}s")
+            time.sleep(backoff)
+            if not self.closing:
+                self._spawn()
+
+    def readtext(self, image, allowlist=None):
+        return self._call(image, "readtext", {})
+
+    def recognize(self, image, allowlist=None, **kwargs):
+        return self._call(image, "recognize", kwargs)
+
+    def _call(self, image, op, kwargs):
+        if not self.ready.wait(OCR_DEADLINE):
+            raise OcrWorkerUnavailable("OCR worker not ready")
+        image = np.ascontiguousarray(image)
+        inline = None
+        slot = None
+        if image.nbytes <= self.slot_bytes:
+            try:
+                slot = self.free.get(timeout=OCR_DEADLINE)
+            except queue.Empty:
+                raise OcrOverloaded("no free OCR slot")
+        else:
+            inline = image  # too big for a slot: rare, send it pickled
+        fut = Future()
+        req_id = next(self.ids)
+        with self.lock:
+            self.pending[req_id] = fut
+        sent = False
+        try:
+            if slot is not None:
+                view = np.ndarray(image.shape, dtype=image.dtype, buffer=self.shms[slot].buf)
+                view[...] = image
+                del view
+            with self.lock:
+                # A worker that died meanwhile already failed the future
+                if req_id in self.pending:
+                    self.inflight[req_id] = (time.time(), slot)
+                    requests = self.requests
+                    sent = True
+            if sent:
+                requests.put((req_id, slot, image.shape, image.dtype.str, inline, op, kwargs))
+            return fut.result(timeout=OCR_DEADLINE)
+        finally:
+            # A late reply is ignored; a sent slot is freed by the reply or a restart
+            with self.lock:
+                self.pending.pop(req_id, None)
+            if not sent and slot is not None:
+                self.free.put(slot)
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        try:
+            self.requests.put(None)
+            self.proc.join(timeout=2)
+            if self.proc.is_alive():
+                self.proc.terminate()
+        except Exception:
+            pass
+        self._fail_pending("OCR worker shut down")
+        for shm in self.shms:
+            try:
+                shm.close()
+                shm.unlink()
+            except Exception:
+                pass
+
+# --- VARIANT EXECUTION ---
+_variant_pool = None
+variant_times = {}  # variant name -> smoothed OCR time (s), used to estimate savings
+
+def get_variant_pool():
+    global _variant_pool
+    if _variant_pool is None:
+        _variant_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="ocr-variant")
+    return _variant_pool
+
+def record_variant_time(name, elapsed):
+    prev = variant_times.get(name)
+    variant_times[name] = elapsed if prev is None else 0.8 * prev + 0.2 * elapsed
+
+def ocr_variant(name, img, label="", recognize_only=False, station_id=None):
+    """Run OCR on one preprocessed image; returns ([(plate, conf), ...], seconds)"""
+    start = time.time()
+    try:
+        result = ocr_recognize(img, station_id) if recognize_only else ocr_readtext(img, station_id)
+    except Exception as e:
+        result = []
+    elapsed = time.time() - start
+    record_stage("ocr.recognize" if recognize_only else "ocr.readtext", elapsed, name, start)
+
+    reads = []
+    for i, (bbox, text, prob) in enumerate(result or []):
+        # Clean text
+        clean_text = ''.join(e for e in text if e.isalnum()).upper()
+        
+        # Filter noise (Timestamps are usually long, plates are 8-10 chars)
+        if len(clean_text) < 6 or len(clean_text) > 11:
+            continue
+        
+        # Apply heuristic cleaning
+        cleaned_plate = heuristic_clean(clean_text)
+        
+        # Check if it looks like an Indian Plate (e.g., KA01AB1234)
+        is_plate_structure = PLATE_STRUCTURE_RE.match(cleaned_plate) is not None
+        
+        log(f"  [{label}{name}] Found: '{clean_text}' -> '{cleaned_plate}' (conf: {prob:.2f}) {'[PLATE MATCH]' if is_plate_structure else ''}")
+        
+        # Collection Logic:
+        # Collect if:
+        # 1. Matches Plate Structure
+        # 2. High confidence (> 0.4)
+        
+        should_add = False
+        if is_plate_structure:
+            should_add = True
+        elif prob > 0.4 and len(cleaned_plate) >= 8: # Arbitrary confidence threshold for non-perfect structures
+            should_add = True
+            
+        if should_add:
+            reads.append((cleaned_plate, prob))
+            # Runner-up readings from the confusion model, so the right plate
+            # still reaches the server when e.g. a B was read as 8
+            ranked = plate_candidates(clean_text)
+            if ranked and ranked[0][0] == cleaned_plate:
+                for alt, score in ranked[1:]:
+                    rel = score / ranked[0][1]
+                    if rel >= PLATE_ALT_MIN:
+                        reads.append((alt, prob * rel))
+    return reads, elapsed
+
+def is_confident_plate(reads):
+    """Early-exit rule: a strict plate read at or above EARLY_EXIT_CONF"""
+    return any(STRICT_PLATE_RE.match(plate) and prob >= EARLY_EXIT_CONF for plate, prob in reads)
+
+# --- ADAPTIVE VARIANT ORDER ---
+class VariantStats:
+    """Variant attempt/win counters per station and hour of day, kept on disk.
+
+    Layout: {station: {hour or "all": {variant: [attempts, wins]}}}
+    """
+
+    def __init__(self, path=VARIANT_STATS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        self.dirty = False
+        self.last_save = 0.0
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.data = json.load(f)
+        except Exception as e:
+            log(f"[WARN] Could not load variant stats: {e}")
+
+    def _bucket(self, station_id, key):
+        return self.data.setdefault(str(station_id), {}).setdefault(str(key), {})
+
+    def record(self, station_id, hour, ran, winner):
+        with self.lock:
+            for key in (hour, "all"):
+                bucket = self._bucket(station_id, key)
+                for name in ran:
+                    counts = bucket.setdefault(name, [0, 0])
+                    counts[0] += 1
+                    if name == winner:
+                        counts[1] += 1
+            self.dirty = True
+        if time.time() - self.last_save >= VARIANT_STATS_SAVE_INTERVAL:
+            self.save()
+
+    def order(self, station_id, hour=None, names=VARIANT_NAMES):
+        """Variant names ordered by smoothed win rate, best first"""
+        if hour is None:
+            hour = datetime.now().hour
+        with self.lock:
+            station = self.data.get(str(station_id), {})
+            bucket = station.get(str(hour), {})
+            if sum(c[0] for c in bucket.values()) < VARIANT_STATS_MIN:
+                bucket = station.get("all", {})
+            def rate(name):
+                attempts, wins = bucket.get(name, (0, 0))
+                return (wins + 1.0) / (attempts + 2.0)
+            # Stable sort keeps the default order for untried/tied variants
+            return sorted(names, key=rate, reverse=True)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            snapshot = json.dumps(self.data, indent=2)
+            self.dirty = False
+            self.last_save = time.time()
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(snapshot)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log(f"[WARN] Could not save variant stats: {e}")
+
+_variant_stats = None
+
+def get_variant_stats():
+    global _variant_stats
+    if _variant_stats is None:
+        _variant_stats = VariantStats()
+    return _variant_stats
+
+def print_variant_stats():
+    """Print the learned variant order for every station and hour"""
+    stats = get_variant_stats()
+    if not stats.data:
+        print(f"No variant statistics recorded yet ({stats.path})")
+        return
+    for station_id in sorted(stats.data, key=str):
+        print(f"Station {station_id}:")
+        buckets = stats.data[station_id]
+        keys = sorted((k for k in buckets if k != "all"), key=int) + (["all"] if "all" in buckets else [])
+        for key in keys:
+            order = stats.order(station_id, key)
+            detail = ", ".join(f"{n} {buckets[key].get(n, [0, 0])[1]}/{buckets[key].get(n, [0, 0])[0]}" for n in order)
+            label = f"{int(key):02d}:00" if key != "all" else "all  "
+            print(f"  {label}  {' > '.join(order)}   ({detail})")
+
+def run_variants(graph, label="", mode=None, station_id=None, recognize_only=False):
+    """Execute OCR over preprocessing variants according to VARIANT_MODE.
+
+    Variants are tried in the order learned for this station and hour, and
+    are only built from `graph` when they are actually run. Returns
+    (results, winner, early_exit) where results is a list of (variant name,
+    reads) for every variant that finished.
+    """
+    mode = mode or VARIANT_MODE
+    station_id = STATION_ID if station_id is None else station_id
+    hour = datetime.now().hour
+    stats = get_variant_stats()
+    names = stats.order(station_id, hour)
+    results = []
+    winner = None
+    start = time.time()
+
+    if mode == "parallel" and len(names) > 1:
+        pool = get_variant_pool()
+        # Build the shared stage up front so worker threads don't race on it
+        graph.get("gray")
+        trace = current_trace()
+
+        def run_one(n):
+            with use_trace(trace):
+                return ocr_variant(n, graph.get(n), label, recognize_only, station_id)
+        futures = {pool.submit(run_one, name): name for name in names}
+        for fut in as_completed(futures):
+            name = futures[fut]
+            reads, elapsed = fut.result()
+            record_variant_time(name, elapsed)
+            results.append((name, reads))
+            if is_confident_plate(reads):
+                winner = name
+                # Variants still queued are dropped; ones already running finish in the background
+                for other in futures:
+                    other.cancel()
+                break
+    else:
+        for name in names:
+            reads, elapsed = ocr_variant(name, graph.get(name), label, recognize_only, station_id)
+            record_variant_time(name, elapsed)
+            results.append((name, reads))
+            if mode != "all" and is_confident_plate(reads):
+                winner = name
+                break
+
+    wall = time.time() - start
+    early_exit = winner is not None
+    if winner is None:
+        # No early exit: credit the variant with the best strict/confident read;
+        # on a tie the one that ran first, not the one with the greatest name
+        best = max(((STRICT_PLATE_RE.match(p) is not None, prob, -index, name)
+                    for index, (name, reads) in enumerate(results) for p, prob in reads), default=None)
+        winner = best[3] if best else None
+    stats.record(station_id, hour, [name for name, _ in results], winner)
+
+    # Savings vs. running every variant back to back, using smoothed per-variant timings
+    saved = max(0.0, sum(variant_times.get(n, 0.0) for n in names) - wall)
+    log(f"[INFO] {label}Variants ({mode}, order {'>'.join(names)}): winner={winner or '-'}, "
+        f"ran {len(results)}/{len(names)}, {wall * 1000:.0f} ms, ~{saved * 1000:.0f} ms saved")
+    return results, winner, early_exit
+
+def read_candidates(image, candidates, seen_candidates, label="", voter=None, station_id=None, recognize_only=False):
+    """OCR preprocessing variants of `image`, appending plate candidates.
+
+    Every read is also fed to `voter` (a PlateVoter) when given. Returns
+    True if a variant hit the early-exit rule, so callers can stop.
+    """
+    results, winner, early_exit = run_variants(PreprocessGraph(image), label, station_id=station_id,
+                                               recognize_only=recognize_only)
+    # Winner's reads first so the best guess ends up at the front
+    results.sort(key=lambda item: item[0] != winner)
+    for name, reads in results:
+        for plate, prob in reads:
+            if voter is not None:
+                voter.add(plate, prob)
+            if plate not in seen_candidates:
+                candidates.append(plate)
+                seen_candidates.add(plate)
+    return early_exit
+
+path_times = {}  # "fast" / "detector" -> smoothed per-frame seconds
+
+def record_path_time(path, elapsed):
+    prev = path_times.get(path)
+    path_times[path] = elapsed if prev is None else 0.8 * prev + 0.2 * elapsed
+
+def detect_plate(frame, voter=None, station_id=None, cancel=None, trigger_ts=None):
+    """Detect plate from frame using multiple preprocessing strategies"""
+    if get_reader(station_id) is None:
+        log('[WARN] OCR disabled or not available. Skipping text detection.')
+        log('[INFO] To enable OCR: pip install easyocr && set ENABLE_OCR=1')
+        return []
+
+    candidates = []
+    seen_candidates = set()
+    station_id = STATION_ID if station_id is None else station_id
+
+    # Known plate regions: fixed gate geometry first, then the localizer
+    rois = fixed_rois(frame, station_id)
+    if PLATE_LOCALIZE:
+        start = time.time()
+        localized = localize_plates(frame)
+        record_stage("detect.localize", time.time() - start, start=start)
+        log(f"[INFO] Localized {len(localized)} plate region(s) in {(time.time() - start) * 1000:.0f} ms")
+        rois += localized
+
+    # Same car still at the gate: reuse its reads instead of running OCR
+    if RECENT_CACHE:
+        kind = "roi" if rois else "frame"
+        key_hash = dhash(rois[0] if rois else frame)
+        hit = recent_vehicles.lookup(station_id, kind, key_hash, trigger_ts)
+        if hit is not None:
+            for plate, conf in hit['reads']:
+                if voter is not None:
+                    voter.add(plate, conf)
+            log(f"[CACHE] Recent vehicle (hash distance {hit['distance']}, "
+                f"{time.time() - hit['ts']:.1f}s old): {hit['candidates']} {recent_vehicles.stats}")
+            return CachedCandidates(hit['candidates'])
+        voter = ReadRecorder(voter)
+
+    # Fast path: recognizer only on the known crops, no text detector at all
+    if RECOGNIZER_FAST_PATH and rois:
+        start = time.time()
+        for idx, roi in enumerate(rois, start=1):
+            if read_candidates(roi, candidates, seen_candidates, label=f"FAST{idx}/", voter=voter,
+                               station_id=station_id, recognize_only=True):
+                break
+        fast = time.time() - start
+        record_path_time("fast", fast)
+        record_stage("detect.fast_path", fast, start=start)
+        if candidates:
+            detector = path_times.get("detector")
+            compare = f", detector path avg {detector * 1000:.0f} ms" if detector is not None else ""
+            log(f"[TIME] Fast path hit in {fast * 1000:.0f} ms{compare}")
+            log(f"[SUCCESS] Candidates found: {candidates}")
+            if RECENT_CACHE:
+                recent_vehicles.store(station_id, kind, key_hash, candidates, voter.reads, trigger_ts)
+            return candidates
+        log(f"[INFO] Fast path found nothing in {fast * 1000:.0f} ms, running text detector")
+
+    check_cancel(cancel)
+    start = time.time()
+    # Localized pass: the text detector only sees small plate crops, which is
+    # much cheaper than a full frame and skips timestamps/signage entirely.
+    for idx, roi in enumerate(rois, start=1):
+        if read_candidates(roi, candidates, seen_candidates, label=f"ROI{idx}/", voter=voter, station_id=station_id):
+            break
+    if not candidates:
+        check_cancel(cancel)
+        if rois:
+            log("[INFO] No plate text in localized regions, falling back to full frame")
+        log("[INFO] Running OCR (trying multiple filters)...")
+        read_candidates(frame, candidates, seen_candidates, voter=voter, station_id=station_id)
+    detector = time.time() - start
+    record_path_time("detector", detector)
+    record_stage("detect.detector_path", detector, start=start)
+    if RECOGNIZER_FAST_PATH and "fast" in path_times:
+        log(f"[TIME] Detector path {detector * 1000:.0f} ms, fast path avg {path_times['fast'] * 1000:.0f} ms")
+
+    # Sort candidates by structure match (prioritize regex match)? 
+    # For now, just sending all of them is fine, server checks all.
+    # But maybe we want to identify the "best" one for logging?
+    
+    if candidates:
         log(f"[SUCCESS] Candidates found: {candidates}")
+        if RECENT_CACHE:
+            recent_vehicles.store(station_id, kind, key_hash, candidates, voter.reads, trigger_ts)
         return candidates
         
     log("[FAIL] No valid plate detected in any variant")
     return []
 
-def check_booking(candidates):
+# --- RECENT VEHICLE CACHE ---
+def dhash(image, size=8):
+    """64-bit difference hash: robust to noise and exposure, not to movement"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+class ReadRecorder:
+    """Voter stand-in that remembers the reads it forwards"""
+
+    def __init__(self, voter=None):
+        self.voter = voter
+        self.reads = []
+
+    def add(self, plate, conf):
+        self.reads.append((plate, conf))
+        if self.voter is not None:
+            self.voter.add(plate, conf)
+
+class CachedCandidates(list):
+    """detect_plate result served from the recent-vehicle cache (ends the burst)"""
+
+class RecentVehicleCache:
+    """Short-lived LRU of detect_plate results, looked up by hash distance"""
+
+    def __init__(self, ttl=RECENT_CACHE_TTL, size=RECENT_CACHE_SIZE, max_distance=RECENT_HASH_DISTANCE):
+        self.ttl = ttl
+        self.size = size
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (station, kind, hash) -> entry, least recently used first
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def lookup(self, station_id, kind, key_hash, trigger_ts=None):
+        """Entry for a matching scene from an earlier trigger, or None"""
+        now = time.time()
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if now - e['ts'] > self.ttl]:
+                del self.entries[key]
+            best = None
+            for key, entry in self.entries.items():
+                # Frames of the same burst must stay independent reads
+                if key[0] != station_id or key[1] != kind or entry['trigger_ts'] == trigger_ts:
+                    continue
+                distance = bin(key[2] ^ key_hash).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, key)
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(best[1])
+            self.stats["hits"] += 1
+            return dict(self.entries[best[1]], distance=best[0])
+
+    def store(self, station_id, kind, key_hash, candidates, reads, trigger_ts=None):
+        with self.lock:
+            self.entries[(station_id, kind, key_hash)] = {
+                'ts': time.time(), 'trigger_ts': trigger_ts,
+                'candidates': list(candidates), 'reads': list(reads),
+            }
+            self.entries.move_to_end((station_id, kind, key_hash))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, plates, station_id=None):
+        """Forget every entry that produced one of `plates`"""
+        plates = set(plates)
+        with self.lock:
+            stale = [k for k, e in self.entries.items()
+                     if (station_id is None or k[0] == station_id) and plates & set(e['candidates'])]
+            for key in stale:
+                del self.entries[key]
+            self.stats["invalidations"] += len(stale)
+
+recent_vehicles = RecentVehicleCache()
+
+# --- EXPECTED PLATE MATCHING ---
+def edit_distance(a, b):
+    """Plain Levenshtein distance (a metric, so it can index a BK-tree)"""
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        cur = [i]
+        for j, cb in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+def confusion_distance(read, expected):
+    """Edit distance where substituting a likely OCR confusion is cheap"""
+    prev = [float(j) for j in range(len(expected) + 1)]
+    for i, r in enumerate(read, start=1):
+        cur = [float(i)]
+        for j, e in enumerate(expected, start=1):
+            sub = 0.0 if r == e else 1.0 - OCR_CONFUSIONS.get((r, e), 0.0)
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + sub))
+        prev = cur
+    return prev[-1]
+
+class BKTree:
+    """Burkhard-Keller tree over plates for radius queries under edit_distance"""
+
+    def __init__(self, words=()):
+        self.root = None  # (word, {distance: child})
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            d = edit_distance(word, node[0])
+            if d == 0:
+                return
+            if d not in node[1]:
+                node[1][d] = (word, {})
+                self.size += 1
+                return
+            node = node[1][d]
+
+    def search(self, word, radius):
+        """[(distance, plate)] for every plate within `radius` edits of `word`"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            plate, children = stack.pop()
+            d = edit_distance(word, plate)
+            if d <= radius:
+                found.append((d, plate))
+            for dist, child in children.items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        return found
+
+def match_expected(candidates, tree, max_cost=FUZZY_MAX_COST, margin=FUZZY_MARGIN):
+    """Best expected plate for the reads, as (plate, cost, margin), or None.
+
+    Each expected plate scores its cheapest confusion_distance over all
+    candidates; the winner must be within max_cost and ahead of the runner-up
+    by at least `margin`, so two similar bookings never get confused.
+    """
+    if tree is None or tree.size == 0:
+        return None
+    costs = {}
+    for read in candidates:
+        read = normalize_plate(read)
+        for _, plate in tree.search(read, FUZZY_MAX_EDITS):
+            cost = confusion_distance(read, plate)
+            if cost < costs.get(plate, float('inf')):
+                costs[plate] = cost
+    if not costs:
+        return None
+    ranked = sorted(costs.items(), key=lambda kv: kv[1])
+    plate, cost = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else float('inf')
+    if cost > max_cost or runner_up - cost < margin:
+        return None
+    return plate, cost, runner_up - cost
+
+# --- LOCAL BOOKING CACHE ---
+def normalize_plate(text):
+    return ''.join(c for c in text if c.isalnum()).upper()
+
+def booking_window(booking):
+    """(entry opens, start, end) as epoch seconds, same rules as the server"""
+    try:
+        day = datetime.fromisoformat(str(booking['date']).replace('Z', '+00:00'))
+        if day.tzinfo is not None:
+            day = day.astimezone().replace(tzinfo=None)  # server applies HH:MM in local time
+        hours, mins = (int(v) for v in booking['startTime'].split(':'))
+        start = day.replace(hour=hours, minute=mins, second=0, microsecond=0)
+        end = start + timedelta(hours=int(booking['duration']))
+    except Exception:
+        return None
+    return start.timestamp() - BOOKING_EARLY_ENTRY, start.timestamp(), end.timestamp()
+
+class EntryQueue:
+    """Store-and-forward log of locally authorized entries, replayed in order.
+
+    Entries are kept as JSON lines so they survive a restart; one is only
+    dropped after the server has accepted (or permanently rejected) it.
+    """
+
+    def __init__(self, path=PENDING_ENTRIES_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.replaying = threading.Lock()
+        self.entries = deque()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries.extend(json.loads(line) for line in f if line.strip())
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log(f"[WARN] Could not read {path}: {e}")
+        if self.entries:
+            log(f"[INFO] {len(self.entries)} offline entry(ies) waiting for replay")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+        log(f"[INFO] Queued offline entry for booking {entry['bookingId']} ({len(self.entries)} pending)")
+
+    def _rewrite(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+
+    def replay(self):
+        """Send queued entries oldest first; stop at the first one that fails.
+
+        The batch is taken off the queue under the lock and posted without
+        it, so put() on the gate path never waits on the server. The file
+        keeps the batch until the end, then holds only what is still unsent.
+        """
+        if not self.replaying.acquire(blocking=False):
+            return False  # another thread is already replaying
+        try:
+            with self.lock:
+                batch = list(self.entries)
+                self.entries.clear()
+            sent = 0
+            ok = True
+            for entry in batch:
+                try:
+                    response = get_http_session().post(f"{SERVER_URL}/api/hardware/entries", json=entry,
+                                                       headers=hardware_headers(), timeout=IDENTIFY_TIMEOUT)
+                except Exception as e:
+                    log(f"[WARN] Entry replay failed, will retry: {e}")
+                    ok = False
+                    break
+                if response.status_code >= 500:
+                    log(f"[WARN] Entry replay failed ({response.status_code}), will retry")
+                    ok = False
+                    break
+                if response.status_code >= 400:
+                    log(f"[WARN] Server rejected offline entry {entry['bookingId']}: {response.text}")
+                else:
+                    log(f"[INFO] Replayed offline entry for booking {entry['bookingId']}: {response.json()}")
+                sent += 1
+            with self.lock:
+                # Unsent ones go back in front of anything queued meanwhile
+                self.entries.extendleft(reversed(batch[sent:]))
+                if batch:
+                    self._rewrite()
+            return ok
+        finally:
+            self.replaying.release()
+
+class BookingCache:
+    """Index of bookings that can still enter, per station and plate.
+
+    decide() mirrors the server's identify rules (30 min early entry, no
+    re-entry on an active booking) so a decision takes microseconds and does
+    not depend on the server being up.
+    """
+
+    def __init__(self):
+        self.index = {}  # station id -> {plate: [booking, ...]}
+        self.trees = {}  # station id -> BKTree of plates expected today
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.refresh_now = threading.Event()
+        self.entries = EntryQueue()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="booking-sync")
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def invalidate(self):
+        self.refresh_now.set()
+
+    def _run(self):
+        while not stop_requested.is_set():
+            # Replay first so the refreshed index already includes those entries
+            if self.entries.replay():
+                self.refresh()
+            self.refresh_now.wait(BOOKING_REFRESH_INTERVAL)
+            self.refresh_now.clear()
+
+    def refresh(self):
+        start = time.time()
+        try:
+            response = get_http_session().get(f"{SERVER_URL}/api/bookings", timeout=IDENTIFY_TIMEOUT)
+            response.raise_for_status()
+            bookings = response.json()
+        except Exception as e:
+            log(f"[WARN] Booking cache refresh failed: {e}")
+            return False
+        index = {}
+        today = {}  # station id -> plates whose entry window opens before midnight
+        midnight = (datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        count = 0
+        for booking in bookings:
+            if booking.get('status') not in ('upcoming', 'active'):
+                continue
+            window = booking_window(booking)
+            plate = normalize_plate(booking.get('carNumber') or '')
+            if window is None or not plate or window[2] < start:
+                continue
+            entry = {'id': booking['id'], 'status': booking['status'], 'opens': window[0], 'end': window[2]}
+            index.setdefault(int(booking['stationId']), {}).setdefault(plate, []).append(entry)
+            if window[0] < midnight:
+                today.setdefault(int(booking['stationId']), set()).add(plate)
+            count += 1
+        trees = {station: BKTree(sorted(plates)) for station, plates in today.items()}
+        with self.lock:
+            self.index = index
+            self.trees = trees
+            self.loaded_at = time.time()
+        log(f"[INFO] Booking cache: {count} booking(s) in {(time.time() - start) * 1000:.0f} ms")
+        return True
+
+    def decide(self, candidates, station_id, now=None):
+        """Return ("authorized" | "denied" | "unknown", booking or None, plate or None)"""
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.loaded_at is None:
+                return "unknown", None, None
+            station = self.index.get(station_id, {})
+            for plate in candidates:
+                for booking in station.get(normalize_plate(plate), []):
+                    if booking['opens'] <= now <= booking['end']:
+                        if booking['status'] == 'active':
+                            return "denied", booking, plate  # already inside, no re-entry
+                        return "authorized", booking, plate
+        return "denied", None, None
+
+    def match(self, candidates, station_id):
+        """Fuzzy-match reads against the station's plates for today"""
+        with self.lock:
+            tree = self.trees.get(station_id)
+        return match_expected(candidates, tree)
+
+    def mark_entered(self, booking):
+        """Optimistic local update so a second trigger is not let in again"""
+        with self.lock:
+            booking['status'] = 'active'
+
+    def unmark_entered(self, booking):
+        """Undo mark_entered for a car the gate did not let in after all"""
+        with self.lock:
+            booking['status'] = 'upcoming'
+
+_booking_cache = None
+_reconcile_pools = {}  # station id -> single-worker executor
+_reconcile_lock = threading.Lock()
+
+def get_booking_cache():
+    global _booking_cache
+    if _booking_cache is None:
+        _booking_cache = BookingCache()
+    return _booking_cache
+
+def get_reconcile_pool(station_id):
+    """One worker per station: its server calls stay in trigger order, and a slow station can't delay others"""
+    with _reconcile_lock:
+        pool = _reconcile_pools.get(station_id)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"booking-reconcile-s{station_id}")
+            _reconcile_pools[station_id] = pool
+        return pool
+
+_http_session = None
+decision_times = {}  # "ws" / "http" -> smoothed trigger-to-decision seconds
+
+def get_http_session():
+    """Keep-alive session so identify calls reuse pooled connections"""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session = session
+    return _http_session
+
+def hardware_headers():
+    return {"Authorization": f"Bearer {HARDWARE_TOKEN}"} if HARDWARE_TOKEN else {}
+
+def never_reached_server(error):
+    """True if an HTTP call failed before connecting, so the server cannot have acted on it"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    return isinstance(getattr(error.args[0], 'reason', None), urllib3.exceptions.NewConnectionError)
+
+def open_gate_locally(station_id, plate):
+    """Open the gate through its controller's own endpoint; True once it confirms"""
+    url = load_camera_config().get('gates', {}).get(str(station_id))
+    if url is None and station_id == STATION_ID:
+        url = LOCAL_GATE_URL
+    if not url:
+        log(f"[WARN] No local gate configured for station {station_id}, gate stays closed")
+        return False
+    try:
+        response = get_http_session().post(url, json={"plateNumber": plate}, headers=hardware_headers(),
+                                           timeout=LOCAL_GATE_TIMEOUT)
+        if response.status_code == 200 and response.json().get("opened") is True:
+            return True
+        log(f"[WARN] Local gate refused to open ({response.status_code}): {response.text}")
+    except Exception as e:
+        log(f"[WARN] Local gate unreachable: {e}")
+    return False
+
+def identify_over_ws(payload):
+    """Send IDENTIFY on the open socket and wait for its reply.
+
+    Returns the reply dict, or None if the request could not be sent (the
+    caller then uses HTTP). Once sent, a missing reply is an error rather
+    than a retry, since the server may already have opened the gate.
+    """
+    ws = ws_app
+    if ws is None:
+        return None
+    request_id = f"{os.getpid()}-{next(identify_ids)}"
+    fut = Future()
+    with identify_lock:
+        identify_pending[request_id] = fut
+    try:
+        ws.send(json.dumps({"type": "IDENTIFY", "requestId": request_id, **payload}))
+    except Exception as e:
+        with identify_lock:
+            identify_pending.pop(request_id, None)
+        log(f"[WARN] IDENTIFY over WebSocket failed, using HTTP: {e}")
+        return None
+    try:
+        return fut.result(timeout=IDENTIFY_TIMEOUT)
+    finally:
+        with identify_lock:
+            identify_pending.pop(request_id, None)
+
+def record_decision_time(transport, elapsed):
+    prev = decision_times.get(transport)
+    decision_times[transport] = elapsed if prev is None else 0.8 * prev + 0.2 * elapsed
+
+def check_booking(candidates, station_id=None, trigger_ts=None):
     """Check with server if plate is authorized"""
     # If called with string (error case logic from main), wrap in list
     if isinstance(candidates, str):
@@ -598,102 +3352,514 @@ def check_booking(candidates):
     if not candidates:
         return
 
+    station_id = STATION_ID if station_id is None else station_id
+    if not BOOKING_CACHE:
+        identify_with_server(candidates, station_id, trigger_ts)
+        return
+
+    # Decide locally at once; the server call that drives the gate and
+    # confirms the decision runs in the background
+    start = time.perf_counter()
+    cache = get_booking_cache()
+    match = cache.match(candidates, station_id) if FUZZY_MATCH else None
+    if match is not None and match[0] != candidates[0]:
+        # The server matches exactly, so the booked plate goes first
+        log(f"[MATCH] {candidates[0]} -> {match[0]} (cost {match[1]:.2f}, margin {match[2]:.2f})")
+        candidates = [match[0]] + [c for c in candidates if c != match[0]]
+    decision, booking, plate = cache.decide(candidates, station_id)
+    took = (time.perf_counter() - start) * 1e6
+    if decision == "authorized":
+        cache.mark_entered(booking)
+        log(f"[LOCAL] AUTHORIZED {plate} (booking {booking['id']}) in {took:.0f} us")
+    elif decision == "denied":
+        log(f"[LOCAL] NOT AUTHORIZED {candidates[0]}{' (already inside)' if booking else ''} in {took:.0f} us")
+    else:
+        log("[LOCAL] Booking cache not loaded yet, waiting for server")
+    local = (decision, booking, plate)
+    trace = current_trace()
+    if trace is not None:
+        trace.event(f"local decision: {decision}")
+        trace.handed_off = True
+
+    def reconcile():
+        with use_trace(trace):
+            identify_with_server(candidates, station_id, trigger_ts, local)
+    get_reconcile_pool(station_id).submit(reconcile)
+
+def identify_with_server(candidates, station_id, trigger_ts=None, local=None):
+    """Ask the server for the gate decision; reconcile it with the local one"""
     # Use first candidate as "primary" for logging/compatibility
     primary_plate = candidates[0]
     
     log(f"[INFO] Checking booking for candidates: {candidates}")
+    trace = current_trace()
+    outcome = "error"
     try:
-        url = f"{SERVER_URL}/api/hardware/identify"
         # Send both plateNumber (best guess) and candidates list
         payload = {
-            "stationId": STATION_ID, 
+            "stationId": station_id, 
             "plateNumber": primary_plate,
             "candidates": candidates
         }
-        response = requests.post(url, json=payload, timeout=5)
+        if trace is not None:
+            payload["traceId"] = trace.trace_id
+        start = time.time()
+        data = identify_over_ws(payload) if IDENTIFY_OVER_WS else None
+        if data is not None:
+            transport = "ws"
+            status = data.get("status", 200)
+        else:
+            transport = "http"
+            url = f"{SERVER_URL}/api/hardware/identify"
+            response = get_http_session().post(url, json=payload, timeout=IDENTIFY_TIMEOUT)
+            status = response.status_code
+            data = response.json() if status == 200 else {"error": response.text}
+        done = time.time()
+        record_stage("identify.roundtrip", done - start, transport, start)
+        timing = data.get("timing") or {}
+        if "handlerMs" in timing:
+            record_stage("identify.server", timing["handlerMs"] / 1000.0)
+        if "gateCommandMs" in timing:
+            record_stage("identify.gate_command", timing["gateCommandMs"] / 1000.0)
         
-        log(f"[INFO] Server response: {response.status_code}")
-        if response.status_code == 200:
-            data = response.json()
+        log(f"[INFO] Server response: {status} via {transport} in {(done - start) * 1000:.0f} ms")
+        if trigger_ts is not None:
+            record_decision_time(transport, done - trigger_ts)
+            record_stage("trigger.to_decision", done - trigger_ts, transport, trigger_ts)
+            averages = ", ".join(f"{t} avg {v * 1000:.0f} ms" for t, v in sorted(decision_times.items()))
+            log(f"[TIME] Trigger -> gate decision {(done - trigger_ts) * 1000:.0f} ms ({averages})")
+        if status == 200:
+            # The gate got GATE_OPEN / GATE_DENIED for this car: read it afresh next time
+            recent_vehicles.invalidate(candidates, station_id)
+            outcome = "authorized" if data.get("authorized") else "denied"
             if data.get("authorized"):
                 log("[AUTH] ✅ AUTHORIZED!")
                 log(f"       Booking ID: {data.get('bookingId')}")
             else:
                 log("[AUTH] 🚫 NOT AUTHORIZED")
                 log(f"       No valid booking for: {candidates}")
+            if local is not None and local[0] != "unknown" and (local[0] == "authorized") != bool(data.get("authorized")):
+                log(f"[WARN] Local decision ({local[0]}) disagreed with server, refreshing booking cache")
+                get_booking_cache().invalidate()
         else:
-            log(f"[ERR] Server error: {response.text}")
+            log(f"[ERR] Server error: {data.get('error')}")
             
     except Exception as e:
         log(f"[ERR] Failed to contact server: {e}")
+        if local is not None and local[0] == "authorized":
+            booking, plate = local[1], local[2]
+            if not never_reached_server(e):
+                # e.g. a timeout: the server may already have opened the gate and recorded the entry
+                log(f"[WARN] Server may have handled booking {booking['id']}, not opening the gate locally")
+            elif open_gate_locally(station_id, plate):
+                log(f"[AUTH] ✅ AUTHORIZED offline, gate opened locally (booking {booking['id']})")
+                get_booking_cache().entries.put({
+                    "stationId": station_id,
+                    "bookingId": booking['id'],
+                    "plateNumber": plate,
+                    "enteredAt": datetime.now().astimezone().isoformat(),
+                })
+            else:
+                get_booking_cache().unmark_entered(booking)
+    finally:
+        if TRACING and trace is not None:
+            trace.finish(outcome)
+
+# --- HEADLESS CONTROL & PREVIEW ---
+stop_requested = threading.Event()
+signal_triggers = deque()  # SIGUSR1 arrivals; the main loop turns them into triggers
+
+def request_trigger(source, station_id=None):
+    """Manual trigger for one station, or every station when none is given"""
+    targets = [p for sid, p in pipelines.items() if station_id is None or sid == station_id]
+    if not targets:
+        log(f"[WARN] Manual trigger ({source}) for unknown station {station_id}")
+        return False
+    for pipeline in targets:
+        log(f"[MANUAL] Manual trigger ({source}) for station {pipeline.station_id}")
+        pipeline.trigger(source)
+    return True
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """One command per line: 'trigger [station]' or 'quit'"""
+
+    def handle(self):
+        for line in self.rfile:
+            parts = line.decode('utf-8', 'ignore').strip().lower().split()
+            cmd = parts[0] if parts else ''
+            if cmd in ('trigger', 'c'):
+                try:
+                    station_id = int(parts[1]) if len(parts) > 1 else None
+                except ValueError:
+                    self.wfile.write(b"ERR bad station id\n")
+                    continue
+                ok = request_trigger("control socket", station_id)
+                self.wfile.write(b"OK\n" if ok else b"ERR unknown station\n")
+            elif cmd in ('quit', 'q'):
+                log("[QUIT] Quit requested over control socket")
+                stop_requested.set()
+                self.wfile.write(b"OK\n")
+            elif cmd:
+                self.wfile.write(b"ERR unknown command\n")
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_control_server(port=CONTROL_PORT):
+    if not port:
+        return None
+    try:
+        server = ControlServer(('127.0.0.1', port), ControlHandler)
+    except OSError as e:
+        log(f"[WARN] Control socket unavailable on port {port}: {e}")
+        return None
+    t = threading.Thread(target=server.serve_forever, name="control-socket")
+    t.daemon = True
+    t.start()
+    log(f"[INFO] Control socket on 127.0.0.1:{port} (send 'trigger [station]' or 'quit')")
+    return server
+
+def install_signal_handlers():
+    """SIGUSR1 triggers a capture; SIGTERM/SIGINT stop the main loop cleanly"""
+    if hasattr(signal, 'SIGUSR1'):
+        # The handler interrupts the main thread, which may hold a trigger
+        # queue or log lock, so it only records the signal (deque.append
+        # takes no Python lock) and the main loop does the rest
+        signal.signal(signal.SIGUSR1, lambda signum, frame: signal_triggers.append(signum))
+    for name in ('SIGTERM', 'SIGINT'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda signum, frame: stop_requested.set())
+
+class PreviewServer:
+    """Throttled MJPEG stream of the newest grabbed frame.
+
+    The JPEG for a given frame is encoded once and shared by all viewers; with
+    no viewers connected nothing is encoded at all.
+    """
+
+    def __init__(self, grabber, port=PREVIEW_PORT, fps=PREVIEW_FPS, width=PREVIEW_WIDTH):
+        self.grabber = grabber
+        self.interval = 1.0 / max(1, fps)
+        self.width = width
+        self.lock = threading.Lock()
+        self.cached = (None, None)  # (frame timestamp, jpeg bytes)
+        self.viewers = 0
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                preview.stream(self)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mjpeg-preview")
+        self.thread.daemon = True
+        self.thread.start()
+        log(f"[INFO] MJPEG preview on http://127.0.0.1:{port}/ ({fps} fps max)")
+
+    def jpeg(self):
+        ts, frame = self.grabber.latest()
+        if frame is None:
+            return None
+        with self.lock:
+            if self.cached[0] == ts:
+                return self.cached[1]
+        h, w = frame.shape[:2]
+        if w > self.width:
+            frame = cv2.resize(frame, (self.width, int(h * self.width / w)), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        if not ok:
+            return None
+        data = buf.tobytes()
+        with self.lock:
+            self.cached = (ts, data)
+        return data
+
+    def stream(self, handler):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.end_headers()
+        with self.lock:
+            self.viewers += 1
+        try:
+            while not stop_requested.is_set():
+                start = time.time()
+                data = self.jpeg()
+                if data is not None:
+                    handler.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+                    handler.wfile.write(f"Content-Length: {len(data)}\r\n\r\n".encode())
+                    handler.wfile.write(data + b"\r\n")
+                time.sleep(max(0.0, self.interval - (time.time() - start)))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.lock:
+                self.viewers -= 1
+
+    def stop(self):
+        self.httpd.shutdown()
+
+def run_capture_sequence(grabber, trigger_ts, station_id=None, cancel=None, trace=None):
+    """Worker: grab a burst of fresh frames for this trigger and run detection"""
+    trace = trace or Trace(station_id, "direct", trigger_ts)
+    outcome = "error"
+    with use_trace(trace):
+        try:
+            with traced("capture.collect"):
+                frames = grabber.collect(BURST_FRAMES, BURST_WINDOW, trigger_ts)
+            if not frames:
+                log("[ERR] No frame available for capture")
+                outcome = "no_frames"
+                return
+            ages = [a for a in (grabber.age_of(ts) for ts, _ in frames) if a is not None]
+            age_note = ""
+            if ages:
+                # How old the picture already was when the grabber got it
+                age = float(np.median(ages))
+                record_stage("capture.frame_age", age / 1000.0)
+                age_note = f", frame age {age:.0f} ms"
+            log(f"[INFO] Collected {len(frames)} frames in {(frames[-1][0] - trigger_ts) * 1000:.0f} ms{age_note}")
+            check_cancel(cancel)
+            with traced("burst.total"):
+                process_burst(frames, station_id, trigger_ts, cancel)
+            outcome = "done"
+            log("")
+            log(f"[INFO] Station {station_id}: ready for next trigger...")
+        except TriggerSuperseded:
+            outcome = "cancelled"
+            log(f"[INFO] Station {station_id}: capture cancelled, a newer trigger takes over")
+        finally:
+            if TRACING and not trace.handed_off:
+                trace.finish(outcome)
+            wake_main.set()  # let the main loop start a queued trigger right away
+
+# --- STATION PIPELINE ---
+class StationPipeline:
+    """Camera, frame grabber and trigger dispatch for one gate.
+
+    All pipelines in a process share the WebSocket and the OCR reader; each
+    runs its capture sequences on its own worker thread.
+    """
+
+    def __init__(self, station_id, camera_id):
+        self.station_id = station_id
+        self.camera_id = camera_id
+        self.cap = None
+        self.grabber = None
+        self.worker = None
+        self.cancel = None  # set to stop the running capture sequence
+        self.last_shown = 0.0
+        self.done = threading.Condition()
+        self.script_runs = 0  # finished capture sequences for scripted triggers
+
+    def open(self):
+        start = time.time()
+        cap = open_source(self.camera_id, self.station_id)
+        if not cap.isOpened():
+            log(f"[ERR] Failed to open camera {self.camera_id} for station {self.station_id}")
+            if isinstance(self.camera_id, int):
+                forget_camera_probe(self.camera_id)
+            return False
+        stage = "camera open" if not SUPERVISOR else f"camera open s{self.station_id}"
+        mark_startup(stage, time.time() - start)
+        self.cap = cap
+        size = FRAME_BUFFER_SIZE
+        if isinstance(cap, ReplaySource):
+            cap.attach(self)
+            size = max(size, BURST_FRAMES)  # a fast replay delivers a whole burst at once
+        self.grabber = FrameGrabber(cap, size, measure_age=isinstance(self.camera_id, int)).start()
+        return True
+
+    def trigger(self, source="server", trace_id=None, delivery=None):
+        return trigger_queue.put(self.station_id, source, trace_id=trace_id, delivery=delivery)
+
+    def poll(self):
+        """Start the queued trigger once the station is idle; cancel work it supersedes"""
+        if trigger_queue.peek(self.station_id) is None:
+            return
+        if self.worker is not None and self.worker.is_alive():
+            if not self.cancel.is_set():
+                log(f"[TRIG] Station {self.station_id}: newer trigger, cancelling capture in progress")
+                self.cancel.set()
+                trigger_queue.peek(self.station_id)[2].event("superseded the capture in progress")
+                trigger_queue.superseded()
+            return
+        trigger_ts, source, trace = trigger_queue.take(self.station_id)
+        log("")
+        log(f"[TRIG] CAPTURE TRIGGERED! (station {self.station_id}, {source}, "
+            f"queued {(time.time() - trigger_ts) * 1000:.0f} ms, trace {trace.trace_id})")
+        with use_trace(trace):
+            record_stage("trigger.queue", time.time() - trigger_ts, start=trigger_ts)
+        self.cancel = threading.Event()
+        self.worker = threading.Thread(target=self._capture, args=(trigger_ts, source, trace, self.cancel),
+                                       name=f"capture-s{self.station_id}")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _capture(self, trigger_ts, source, trace, cancel):
+        try:
+            run_capture_sequence(self.grabber, trigger_ts, self.station_id, cancel, trace)
+        finally:
+            if source == "script":
+                with self.done:
+                    self.script_runs += 1
+                    self.done.notify_all()
+
+    def close(self):
+        if self.grabber is not None:
+            self.grabber.stop()
+        if self.cap is not None:
+            self.cap.release()
 
 def main():
-    global should_capture
-    
     log("="*60)
     log("[INFO] EV STATION CAMERA SYSTEM STARTED")
     log("="*60)
-    log(f"[INFO] Station ID: {STATION_ID}")
-    log(f"[INFO] Camera ID: {CAMERA_ID}")
+
+    # OCR model loads in the background while the WebSocket connects and the camera opens
+    start_ocr_loader()
+
+    if SUPERVISOR:
+        station_map = load_station_map()
+        if not station_map:
+            log("[ERR] Supervisor mode needs a station map (--stations FILE or 'stations' in camera_config.json)")
+            return
+    else:
+        station_map = {STATION_ID: FRAME_SOURCE or get_camera_id()}
+
+    for station_id, camera_id in station_map.items():
+        log(f"[INFO] Station ID: {station_id}")
+        log(f"[INFO] Camera ID: {camera_id}")
+        pipelines[station_id] = StationPipeline(station_id, camera_id)
     log(f"[INFO] Captures saved to: {CAPTURES_DIR}/")
-    log(f"[INFO] Max retries: {MAX_RETRIES}")
+    log(f"[INFO] Burst: {BURST_FRAMES} frames / {BURST_WINDOW}s, OCR best {BURST_TOP_K}")
     log("="*60)
 
-    # Start WebSocket thread
+    # Start WebSocket thread (registers every station in `pipelines`)
     t = threading.Thread(target=ws_thread)
     t.daemon = True
     t.start()
+    if BOOKING_CACHE:
+        get_booking_cache().start()
     
-    time.sleep(1)  # Give WebSocket time to connect
-    
-    # Open Camera
-    cap = cv2.VideoCapture(CAMERA_ID)
-    if not cap.isOpened():
-        log("[ERR] Failed to open camera")
+    # Open Camera(s)
+    for station_id, pipeline in list(pipelines.items()):
+        if not pipeline.open():
+            del pipelines[station_id]
+    if not pipelines:
         return
 
     log("[INFO] Camera opened successfully")
     log("[INFO] Waiting for IR sensor trigger from ESP32...")
-    log("[INFO] Press 'c' to manually trigger capture")
-    log("[INFO] Press 'q' to quit")
+    if HEADLESS:
+        log("[INFO] Headless mode: trigger with SIGUSR1 or the control socket")
+    else:
+        log("[INFO] Press 'c' to manually trigger capture")
+        log("[INFO] Press 'q' to quit")
     log("")
-    
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            log("[ERR] Failed to read frame")
-            break
-            
-        # Show feed
-        cv2.imshow('EV Station Camera', frame)
+
+    install_signal_handlers()
+    control = start_control_server()
+    metrics_server = None
+    if TRACING and METRICS_PORT:
+        try:
+            metrics_server = MetricsServer()
+        except OSError as e:
+            log(f"[WARN] Metrics endpoint unavailable on port {METRICS_PORT}: {e}")
+
+    # Frames are read on per-camera threads; this loop only shows the feeds
+    # and dispatches triggers, so neither stalls while OCR is running.
+    first = next(iter(pipelines.values()))
+    if first.grabber.wait_for_frame(0.0, 5.0)[1] is not None:
+        mark_startup("first frame")
+    startup_report()
+    preview = None
+    if PREVIEW_PORT:
+        try:
+            preview = PreviewServer(first.grabber)
+        except OSError as e:
+            log(f"[WARN] Preview unavailable on port {PREVIEW_PORT}: {e}")
+    last_heartbeat = time.time()
+    while not stop_requested.is_set() and pipelines:
+        while signal_triggers:
+            signal_triggers.popleft()
+            request_trigger("SIGUSR1")
+
+        for station_id, pipeline in list(pipelines.items()):
+            if pipeline.grabber.failed:
+                if getattr(pipeline.cap, 'finished', False):
+                    log(f"[INFO] Source for station {station_id} finished")
+                else:
+                    log(f"[ERR] Camera for station {station_id} stopped delivering frames")
+                pipeline.close()
+                del pipelines[station_id]
+                continue
+
+            # Show feed
+            if not HEADLESS:
+                ts, frame = pipeline.grabber.latest()
+                if frame is not None and ts > pipeline.last_shown:
+                    pipeline.last_shown = ts
+                    title = 'EV Station Camera' if not SUPERVISOR else f'EV Station {station_id}'
+                    cv2.imshow(title, frame)
+
+            # Logic: Only process if triggered
+            pipeline.poll()
         
-        # Heartbeat every ~5 seconds (assuming ~30fps)
-        frame_count += 1
-        if frame_count % 150 == 0:
+        # Heartbeat every ~5 seconds
+        if time.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+            last_heartbeat = time.time()
             print(".", end="", flush=True) # Minimal heartbeat
-            
-        # Logic: Only process if triggered
-        if should_capture:
-            log("")
-            log("[TRIG] CAPTURE TRIGGERED!")
-            process_frame_with_retry(frame)
-            should_capture = False # Reset trigger
-            log("")
-            log("[INFO] Ready for next trigger...")
-            
+
+        if HEADLESS:
+            wake_main.wait(0.1)
+            wake_main.clear()
+            continue
+
         # Manual trigger for testing (Press 'c')
-        key = cv2.waitKey(1) & 0xFF
+        key = cv2.waitKey(10) & 0xFF
         if key == ord('c'):
-            log("[MANUAL] Manual trigger (pressed 'c')")
-            should_capture = True
+            request_trigger("pressed 'c'")
         elif key == ord('q'):
             log("[QUIT] Quitting...")
             break
-            
-    cap.release()
-    cv2.destroyAllWindows()
+
+    stop_requested.set()
+    if preview is not None:
+        preview.stop()
+    if control is not None:
+        control.shutdown()
+    if metrics_server is not None:
+        metrics_server.stop()
+    for pipeline in pipelines.values():
+        pipeline.close()
+    for pool in list(_reconcile_pools.values()):
+        pool.shutdown(wait=True)  # let in-flight identify calls report
+    get_variant_stats().save()
+    log(f"[INFO] Triggers: {trigger_queue.stats}")
+    if TRACING:
+        stage_metrics.write()
+    if RECENT_CACHE:
+        log(f"[INFO] Recent vehicle cache: {recent_vehicles.stats}")
+    if _capture_writer is not None:
+        _capture_writer.flush()
+    if not HEADLESS:
+        cv2.destroyAllWindows()
     log("[INFO] Camera system stopped")
 
 if __name__ == "__main__":
-    main()
+    # If user asked to list cameras, do it and exit early.
+    if '--list-cameras' in sys.argv:
+        list_cameras(10)
+        sys.exit(0)
+    if '--select-camera' in sys.argv:
+        select_camera()
+    if '--variant-stats' in sys.argv:
+        print_variant_stats()
+    else:
+        main()
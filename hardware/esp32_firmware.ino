@@ -1,5 +1,6 @@
 #include <WiFi.h>
 #include <WebSocketsClient.h>
+#include <WebServer.h>
 #include <ESP32Servo.h>
 #include <LiquidCrystal_I2C.h>
 #include <Preferences.h>
@@ -11,6 +12,9 @@ const char* password = "Mirha@2023";
 String ws_server_ip = "192.168.0.3"; 
 const int ws_port = 5000;
 const int STATION_ID = 1;
+// Shared with the server and camera (HARDWARE_TOKEN). The camera opens the gate
+// through POST /gate/open when the server is down; empty disables that endpoint.
+const char* HARDWARE_TOKEN = "";
 
 // --- PINS ---
 const int SERVO_PIN = 13;
@@ -21,6 +25,7 @@ const int IR_ENTRANCE_PIN = 23;
 
 // --- OBJECTS ---
 WebSocketsClient webSocket;
+WebServer gateServer(80);
 Servo gateServo;
 LiquidCrystal_I2C lcd(0x27, 16, 2);
 Preferences preferences;
@@ -77,10 +82,17 @@ void setup() {
 
   // WebSocket Connect
   connectWebSocket();
+
+  // Local gate endpoint for the camera's offline decisions
+  const char* headerKeys[] = {"Authorization"};
+  gateServer.collectHeaders(headerKeys, 1);
+  gateServer.on("/gate/open", HTTP_POST, handleLocalGateOpen);
+  gateServer.begin();
 }
 
 void loop() {
   webSocket.loop();
+  gateServer.handleClient();
   checkSerialForConfig(); // Check for IP updates
 
   // Handle Gate Auto-Close
@@ -267,6 +279,19 @@ void denyAccess() {
   resetLCD();
 }
 
+// Camera -> gate while the server is unreachable. Replies opened:true only
+// after the gate has actually been opened; the camera queues the entry then.
+void handleLocalGateOpen() {
+  if (strlen(HARDWARE_TOKEN) == 0 ||
+      gateServer.header("Authorization") != String("Bearer ") + HARDWARE_TOKEN) {
+    gateServer.send(401, "application/json", "{\"opened\":false}");
+    return;
+  }
+  Serial.println("Local gate open (server offline)");
+  openGate("Offline", 0);
+  gateServer.send(200, "application/json", "{\"opened\":true}");
+}
+
 void closeGate() {
   Serial.println("Closing Gate");
   gateServo.write(0); 
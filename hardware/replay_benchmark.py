@@ -0,0 +1,240 @@
+"""Offline replay benchmark for the plate pipeline.
+
+Feeds a directory of saved gate images (e.g. captures/) through the same
+code the camera runs - get_preprocessed_variants, detect_plate and
+heuristic_clean - without a camera or server, and reports throughput,
+per-stage latency percentiles, per-variant hit rate and, given a
+ground-truth CSV (filename,plate), exact-match accuracy.
+
+    python hardware/replay_benchmark.py captures/ --truth plates.csv --json before.json
+    python hardware/replay_benchmark.py captures/ --truth plates.csv --compare before.json
+
+camera_script options such as --ocr-backend, OCR_THREADS or VARIANT_MODE
+apply as usual, so runs can be compared before and after a change.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay saved images through the plate pipeline")
+    parser.add_argument('images', help="directory of images (searched recursively)")
+    parser.add_argument('--truth', help="CSV of filename,plate for accuracy")
+    parser.add_argument('--json', dest='json_path', help="write the full report as JSON here")
+    parser.add_argument('--compare', help="earlier JSON report to diff against")
+    parser.add_argument('--station', type=int, help="station id for fixed ROIs (default: STATION_ID)")
+    parser.add_argument('--limit', type=int, default=0, help="only replay the first N images")
+    parser.add_argument('--no-sweep', action='store_true', help="skip the per-variant sweep")
+    parser.add_argument('--label', default="", help="free-form run label stored in the report")
+    # Anything else (--ocr-backend, --ocr-process, ...) is read by camera_script itself
+    args, _ = parser.parse_known_args()
+    return args
+
+def list_images(root, limit=0):
+    paths = []
+    for dirpath, _, files in os.walk(root):
+        paths += [os.path.join(dirpath, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS)]
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+def load_truth(path, normalize):
+    """{file name: plate}; a header row is skipped if present"""
+    truth = {}
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].strip().lower() in ('file', 'filename', 'image', 'path'):
+                continue
+            truth[os.path.basename(row[0].strip())] = normalize(row[1])
+    return truth
+
+def percentiles(samples):
+    import numpy as np
+    values = np.asarray(samples, dtype=float) * 1000.0
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+def run(args):
+    import cv2
+    import camera_script as cs
+
+    # Replay must not learn from (or write to) the live installation
+    cs.ENABLE_OCR = True
+    cs.RECENT_CACHE = False
+    cs.TRACING = True
+    cs._variant_stats = cs.VariantStats(os.path.join(tempfile.mkdtemp(prefix="replay-"), "variant_stats.json"))
+    station_id = cs.STATION_ID if args.station is None else args.station
+
+    paths = list_images(args.images, args.limit)
+    if not paths:
+        print(f"No images found under {args.images}")
+        return None
+    truth = load_truth(args.truth, cs.normalize_plate) if args.truth else {}
+
+    start = time.time()
+    cs.start_ocr_loader()
+    if cs.get_reader(station_id) is None:
+        print("OCR backend not available; see the log above")
+        return None
+    load_s = time.time() - start
+
+    stages = {}  # "stage" or "stage/detail" -> [seconds]
+    variants = {name: {"runs": 0, "hits": 0, "correct": 0, "labeled": 0} for name in cs.VARIANT_NAMES}
+    per_image = []
+    top1 = anyk = labeled = 0
+    detect_total = 0.0
+    wall_start = time.time()
+
+    for index, path in enumerate(paths, start=1):
+        name = os.path.basename(path)
+        expected = truth.get(name)
+        trace = cs.Trace(station_id, "replay")
+        with cs.use_trace(trace):
+            with cs.traced("image.load"):
+                frame = cv2.imread(path)
+            if frame is None:
+                print(f"[{index}/{len(paths)}] {name}: unreadable, skipped")
+                continue
+
+            if not args.no_sweep:
+                # Every variant on its own, so hit rates are not hidden by early exit
+                with cs.traced("variant.sweep"):
+                    for variant, image in cs.get_preprocessed_variants(frame):
+                        reads, _ = cs.ocr_variant(variant, image, "SWEEP/", station_id=station_id)
+                        stats = variants[variant]
+                        stats["runs"] += 1
+                        stats["hits"] += bool(reads)
+                        if expected:
+                            stats["labeled"] += 1
+                            stats["correct"] += any(plate == expected for plate, _ in reads)
+
+            voter = cs.PlateVoter()
+            t0 = time.time()
+            with cs.traced("detect.plate"):
+                found = cs.detect_plate(frame, voter=voter, station_id=station_id)
+            detect_total += time.time() - t0
+
+        ranked = voter.ranked()
+        candidates = ranked + [p for p in found if p not in ranked]
+        sweep = [(b, b + sec) for st, _, b, sec in trace.spans if st == "variant.sweep"]
+        for stage, detail, begin, seconds in trace.spans:
+            if stage != "variant.sweep" and any(lo <= begin < hi for lo, hi in sweep):
+                stage = "sweep." + stage  # keep sweep OCR apart from the pipeline's own calls
+            stages.setdefault(f"{stage}/{detail}" if detail else stage, []).append(seconds)
+
+        record = {"image": name, "candidates": candidates}
+        if expected:
+            labeled += 1
+            record["expected"] = expected
+            record["top1"] = bool(candidates) and candidates[0] == expected
+            record["any"] = expected in candidates
+            top1 += record["top1"]
+            anyk += record["any"]
+        per_image.append(record)
+        verdict = "" if not expected else (" OK" if record["top1"] else f" MISS (want {expected})")
+        print(f"[{index}/{len(paths)}] {name}: {candidates[:3] or '-'}{verdict}")
+
+    wall = time.time() - wall_start
+    done = len(per_image)
+    report = {
+        "label": args.label,
+        "created": datetime.now().astimezone().isoformat(),
+        "config": {
+            "images_dir": os.path.abspath(args.images),
+            "station": station_id,
+            "ocr": cs.ocr_spec(station_id),
+            "variant_mode": cs.VARIANT_MODE,
+            "fast_path": cs.RECOGNIZER_FAST_PATH,
+            "localize": cs.PLATE_LOCALIZE,
+            "batching": cs.OCR_BATCHING,
+            "sweep": not args.no_sweep,
+        },
+        "throughput": {
+            "images": done,
+            "ocr_load_s": round(load_s, 2),
+            "wall_s": round(wall, 2),
+            "detect_fps": round(done / detect_total, 3) if detect_total else None,
+            "wall_fps": round(done / wall, 3) if wall else None,
+        },
+        "stages": {stage: percentiles(samples) for stage, samples in sorted(stages.items())},
+        "variants": {
+            name: dict(v, hit_rate=round(v["hits"] / v["runs"], 3) if v["runs"] else None,
+                       accuracy=round(v["correct"] / v["labeled"], 3) if v["labeled"] else None)
+            for name, v in variants.items()
+        },
+        "accuracy": {
+            "labeled": labeled,
+            "top1": round(top1 / labeled, 3) if labeled else None,
+            "any_candidate": round(anyk / labeled, 3) if labeled else None,
+        },
+        "per_image": per_image,
+    }
+    return report
+
+def print_report(report):
+    t = report["throughput"]
+    print("")
+    print(f"Images: {t['images']}   detect: {t['detect_fps']} fps   wall: {t['wall_fps']} fps   "
+          f"(OCR load {t['ocr_load_s']} s)")
+    print("")
+    print(f"{'stage':<32} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, p in report["stages"].items():
+        print(f"{stage:<32} {p['count']:>5} {p['p50_ms']:>9.1f} {p['p95_ms']:>9.1f} {p['p99_ms']:>9.1f}")
+    if report["config"]["sweep"]:
+        print("")
+        print(f"{'variant':<12} {'runs':>5} {'hit rate':>9} {'accuracy':>9}")
+        for name, v in report["variants"].items():
+            hit = f"{v['hit_rate']:.1%}" if v['hit_rate'] is not None else "-"
+            acc = f"{v['accuracy']:.1%}" if v['accuracy'] is not None else "-"
+            print(f"{name:<12} {v['runs']:>5} {hit:>9} {acc:>9}")
+    a = report["accuracy"]
+    if a["labeled"]:
+        print("")
+        print(f"Accuracy on {a['labeled']} labeled images: top-1 {a['top1']:.1%}, any candidate {a['any_candidate']:.1%}")
+
+def print_comparison(report, path):
+    with open(path, 'r', encoding='utf-8') as f:
+        before = json.load(f)
+    print("")
+    print(f"Compared with {path} ({before.get('label') or before.get('created')}):")
+
+    def delta(label, old, new, unit="", better_up=True):
+        if old is None or new is None:
+            return
+        change = new - old
+        arrow = "=" if abs(change) < 1e-9 else ("better" if (change > 0) == better_up else "worse")
+        print(f"  {label:<34} {old:>10.3f} -> {new:>10.3f}{unit}  ({change:+.3f}, {arrow})")
+
+    delta("detect fps", before["throughput"].get("detect_fps"), report["throughput"].get("detect_fps"))
+    delta("top-1 accuracy", before["accuracy"].get("top1"), report["accuracy"].get("top1"))
+    for stage, p in report["stages"].items():
+        old = before["stages"].get(stage)
+        if old:
+            delta(f"{stage} p50", old["p50_ms"], p["p50_ms"], " ms", better_up=False)
+
+def main():
+    args = parse_args()
+    report = run(args)
+    if report is None:
+        sys.exit(1)
+    print_report(report)
+    if args.compare:
+        print_comparison(report, args.compare)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+"""Load generator for the hardware WebSocket and identify endpoints.
+
+Grown out of test_hardware_integration.py: instead of one ESP32 and one
+identify request it simulates an ESP32 and a camera for each of many
+stations, drives CAMERA_TRIGGER, SLOT_UPDATE and /api/hardware/identify
+traffic at configurable rates, and reports identify latency and the delay
+until SCANNING / GATE_* reach the right ESP32 (p50/p95/p99), plus lost,
+misrouted and duplicate messages.
+
+    python load_test_hardware.py --stations 200 --duration 60
+    python load_test_hardware.py --stub --stations 300 --trigger-rate 0.5 --json run.json
+    python load_test_hardware.py --serve-stub --port 5055
+
+Each simulated camera answers its CAMERA_TRIGGER with an IDENTIFY over the
+WebSocket, like camera_script.py does, so trigger-to-gate time is measured
+end to end. --stub runs a local stand-in for server/websocket.ts and
+server/identify.ts (message routing only, no database; plates starting
+with "BK" are treated as booked). Against the real server the made-up
+plates are simply denied, but SLOT_UPDATE writes slot state, so
+--slot-rate defaults to 0 there.
+
+Needs aiohttp (pip install aiohttp).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from collections import defaultdict, deque
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+
+# Configuration
+SERVER_URL = "http://localhost:5000"
+STUB_PORT = 5055
+FIRST_STATION = 1
+CONNECT_CONCURRENCY = 50
+SETTLE_TIME = 1.0  # seconds between registering and sending traffic
+
+def now_ms():
+    return time.perf_counter() * 1000.0
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100.0 * len(ordered)) - 1)]
+
+class Stats:
+    """Latency samples (ms) and event counters"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.counts = defaultdict(int)
+
+    def observe(self, metric, ms):
+        self.samples[metric].append(ms)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def summary(self):
+        return {
+            metric: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(max(values), 2),
+            }
+            for metric, values in sorted(self.samples.items()) if values
+        }
+
+class Tracker:
+    """Outstanding traffic and where each reply is supposed to land"""
+
+    def __init__(self, stats, booked_ratio, rng):
+        self.stats = stats
+        self.booked_ratio = booked_ratio
+        self.rng = rng
+        self.ids = itertools.count(1)
+        self.identify = {}  # traceId -> request
+        self.by_plate = {}  # plate -> traceId (SCANNING only carries the plate)
+        self.ws_requests = {}  # requestId -> request waiting for IDENTIFY_RESULT
+        self.triggers = {}  # traceId -> trigger
+        self.slots = defaultdict(deque)  # (station, slot, occupied) -> send times
+
+    def new_identify(self, station, path, trace_id=None, trigger_sent=None):
+        seq = next(self.ids)
+        prefix = "BK" if self.rng.random() < self.booked_ratio else "LT"
+        plate = f"{prefix}{station:03d}{seq:06d}"
+        trace_id = trace_id or f"lt{seq:014x}"
+        request = {"station": station, "plate": plate, "trace": trace_id, "path": path, "sent": now_ms(),
+                   "trigger_sent": trigger_sent, "scanning": None, "gate": None, "result": None}
+        self.identify[trace_id] = request
+        self.by_plate[plate] = trace_id
+        self.stats.count(f"identify_{path}_sent")
+        return request
+
+    def new_trigger(self, station):
+        trace_id = f"tr{next(self.ids):014x}"
+        self.triggers[trace_id] = {"station": station, "sent": now_ms(), "received": None}
+        self.stats.count("trigger_sent")
+        return trace_id
+
+    def receipt(self, request, station, field, at, label):
+        if request is None:
+            self.stats.count(f"{label}_unexpected")
+            return False
+        if request["station"] != station:
+            self.stats.count(f"{label}_misrouted")
+            return False
+        if request[field] is not None:
+            self.stats.count(f"{label}_duplicate")
+            return False
+        request[field] = at
+        return True
+
+    def on_esp32(self, station, message, at):
+        kind = message.get("type")
+        if kind == "SCANNING":
+            request = self.identify.get(self.by_plate.get(message.get("plateNumber")))
+            if self.receipt(request, station, "scanning", at, "scanning"):
+                self.stats.observe("scanning_delay", at - request["sent"])
+        elif kind in ("GATE_OPEN", "GATE_DENIED"):
+            request = self.identify.get(message.get("traceId"))
+            if self.receipt(request, station, "gate", at, "gate"):
+                self.stats.count(kind.lower())
+                self.stats.observe("gate_delay", at - request["sent"])
+                if request["trigger_sent"] is not None:
+                    self.stats.observe("trigger_to_gate", at - request["trigger_sent"])
+        else:
+            self.stats.count("esp32_other")
+
+    def on_camera(self, station, message, at):
+        kind = message.get("type")
+        if kind == "CAMERA_TRIGGER":
+            trigger = self.triggers.get(message.get("traceId"))
+            if self.receipt(trigger, station, "received", at, "trigger"):
+                self.stats.observe("trigger_delivery", at - trigger["sent"])
+                return trigger
+        elif kind == "IDENTIFY_RESULT":
+            request = self.ws_requests.pop(message.get("requestId"), None)
+            if request is None:
+                self.stats.count("identify_ws_unexpected")
+            else:
+                request["result"] = at
+                self.stats.observe("identify_ws", at - request["sent"])
+                self.stats.count(f"identify_ws_{message.get('status')}")
+        else:
+            self.stats.count("camera_other")
+        return None
+
+    def on_observer(self, message, at):
+        if message.get("type") != "SLOT_UPDATE":
+            self.stats.count("observer_other")
+            return
+        pending = self.slots.get((message.get("stationId"), message.get("slotId"), bool(message.get("isOccupied"))))
+        if not pending:
+            self.stats.count("slot_unexpected")
+            return
+        self.stats.observe("slot_broadcast", at - pending.popleft())
+
+    def lost(self):
+        requests = list(self.identify.values())
+        return {
+            "scanning": sum(1 for r in requests if r["scanning"] is None),
+            "gate": sum(1 for r in requests if r["gate"] is None),
+            "identify_ws": len(self.ws_requests),
+            "trigger": sum(1 for t in self.triggers.values() if t["received"] is None),
+            "slot": sum(len(q) for q in self.slots.values()),
+        }
+
+class Device:
+    """One simulated WebSocket client (ESP32, camera or dashboard observer)"""
+
+    def __init__(self, kind, station, on_message):
+        self.kind = kind
+        self.station = station
+        self.on_message = on_message
+        self.ws = None
+        self.reader = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self, session, ws_url):
+        self.ws = await session.ws_connect(ws_url)
+        register = {"type": f"REGISTER_{self.kind}"}
+        if self.station is not None:
+            register["stationId"] = self.station
+        await self.send(register)
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        async for msg in self.ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                try:
+                    message = json.loads(msg.data)
+                except ValueError:
+                    continue
+                result = self.on_message(self, message, now_ms())
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+
+    async def send(self, payload):
+        async with self.lock:
+            await self.ws.send_str(json.dumps(payload))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+class LoadTest:
+    def __init__(self, args, base_url):
+        self.args = args
+        self.base_url = base_url.rstrip('/')
+        self.ws_url = self.base_url.replace("http", "ws", 1) + "/ws"
+        self.rng = random.Random(args.seed)
+        self.stats = Stats()
+        self.tracker = Tracker(self.stats, args.booked_ratio, self.rng)
+        self.stations = list(range(args.first_station, args.first_station + args.stations))
+        self.esp32s = {}
+        self.cameras = {}
+        self.observer = None
+        self.tasks = set()
+        self.stopping = False
+        self.request_ids = itertools.count(1)
+
+    # --- message handlers ---
+    def esp32_message(self, device, message, at):
+        self.tracker.on_esp32(device.station, message, at)
+
+    def camera_message(self, device, message, at):
+        trigger = self.tracker.on_camera(device.station, message, at)
+        if trigger is not None and self.args.camera_identify:
+            return self.camera_identify(device, message.get("traceId"), trigger["sent"])
+        return None
+
+    def observer_message(self, device, message, at):
+        self.tracker.on_observer(message, at)
+
+    # --- traffic ---
+    async def camera_identify(self, camera, trace_id, trigger_sent):
+        request = self.tracker.new_identify(camera.station, "ws", trace_id, trigger_sent)
+        request_id = next(self.request_ids)
+        self.tracker.ws_requests[request_id] = request
+        try:
+            await camera.send({"type": "IDENTIFY", "requestId": request_id, "stationId": camera.station,
+                               "plateNumber": request["plate"], "candidates": [request["plate"]],
+                               "traceId": trace_id})
+        except Exception:
+            self.stats.count("ws_send_error")
+
+    async def http_identify(self, session, station):
+        request = self.tracker.new_identify(station, "http")
+        try:
+            async with session.post(f"{self.base_url}/api/hardware/identify", json={
+                "stationId": station,
+                "plateNumber": request["plate"],
+                "candidates": [request["plate"]],
+                "traceId": request["trace"],
+            }) as response:
+                await response.read()
+                request["result"] = now_ms()
+                self.stats.observe("identify_http", request["result"] - request["sent"])
+                self.stats.count(f"identify_http_{response.status}")
+        except Exception:
+            self.stats.count("identify_http_error")
+
+    async def trigger(self, station):
+        trace_id = self.tracker.new_trigger(station)
+        try:
+            await self.esp32s[station].send({"type": "CAMERA_TRIGGER", "stationId": station, "traceId": trace_id})
+        except Exception:
+            self.stats.count("ws_send_error")
+
+    async def slot_update(self, station):
+        slot = self.rng.randint(1, self.args.slots)
+        occupied = self.rng.random() < 0.5
+        self.tracker.slots[(station, slot, occupied)].append(now_ms())
+        self.stats.count("slot_sent")
+        try:
+            await self.esp32s[station].send({"type": "SLOT_UPDATE", "stationId": station,
+                                             "slotId": slot, "isOccupied": occupied})
+        except Exception:
+            self.stats.count("ws_send_error")
+
+    async def poisson(self, rate, action, *args):
+        """Open loop: start `action` at Poisson arrivals without waiting for it"""
+        if rate <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if self.stopping:
+                return
+            task = asyncio.create_task(action(*args))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    # --- run ---
+    async def connect_all(self, session):
+        gate = asyncio.Semaphore(self.args.connect_concurrency)
+        devices = []
+        for station in self.stations:
+            self.esp32s[station] = Device("ESP32", station, self.esp32_message)
+            devices.append(self.esp32s[station])
+            if not self.args.no_cameras:
+                self.cameras[station] = Device("CAMERA", station, self.camera_message)
+                devices.append(self.cameras[station])
+        if self.args.slot_rate > 0:
+            self.observer = Device("CLIENT", None, self.observer_message)
+            devices.append(self.observer)
+
+        async def connect(device):
+            async with gate:
+                await device.connect(session, self.ws_url)
+
+        start = time.time()
+        results = await asyncio.gather(*(connect(d) for d in devices), return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            print(f"{len(failed)} of {len(devices)} WebSocket connections failed: {failed[0]!r}")
+        print(f"Connected {len(devices) - len(failed)} WebSocket clients in {time.time() - start:.1f} s")
+        return devices, not failed
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        connector = aiohttp.TCPConnector(limit=self.args.http_connections)
+        # WebSockets hold their connection for the whole run, so they get a
+        # session without a pool limit; identify calls share a bounded pool
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session, \
+                aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as ws_session:
+            devices, ok = await self.connect_all(ws_session)
+            if not ok:
+                for device in devices:
+                    await device.close()
+                return None
+            await asyncio.sleep(SETTLE_TIME)
+
+            print(f"Sending traffic for {self.args.duration:g} s "
+                  f"(per station: {self.args.trigger_rate:g} triggers/s, {self.args.identify_rate:g} identify/s, "
+                  f"{self.args.slot_rate:g} slot updates/s)...")
+            generators = []
+            for station in self.stations:
+                if not self.args.no_cameras:
+                    generators.append(asyncio.create_task(self.poisson(self.args.trigger_rate, self.trigger, station)))
+                generators.append(asyncio.create_task(
+                    self.poisson(self.args.identify_rate, self.http_identify, session, station)))
+                generators.append(asyncio.create_task(self.poisson(self.args.slot_rate, self.slot_update, station)))
+            started = time.time()
+            await asyncio.sleep(self.args.duration)
+            self.stopping = True
+            for task in generators:
+                task.cancel()
+            elapsed = time.time() - started
+
+            # Let in-flight requests finish and late messages arrive
+            if self.tasks:
+                await asyncio.wait(list(self.tasks), timeout=self.args.timeout)
+            await asyncio.sleep(self.args.drain)
+            for device in devices:
+                await device.close()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        counts = dict(sorted(self.stats.counts.items()))
+        lost = self.tracker.lost()
+        misrouted = {k[:-len("_misrouted")]: v for k, v in counts.items() if k.endswith("_misrouted")}
+        return {
+            "server": self.base_url,
+            "stations": len(self.stations),
+            "duration_s": round(elapsed, 2),
+            "rates": {"trigger": self.args.trigger_rate, "identify": self.args.identify_rate,
+                      "slot": self.args.slot_rate},
+            "latency": self.stats.summary(),
+            "counts": counts,
+            "lost": lost,
+            "misrouted": misrouted,
+        }
+
+def print_report(report):
+    print("")
+    print(f"Server {report['server']}, {report['stations']} stations, {report['duration_s']} s")
+    print("")
+    print(f"{'metric':<20} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for metric, p in report["latency"].items():
+        print(f"{metric:<20} {p['count']:>7} {p['p50_ms']:>9.1f} {p['p95_ms']:>9.1f} "
+              f"{p['p99_ms']:>9.1f} {p['max_ms']:>9.1f}")
+    print("")
+    print("Counts:    " + ", ".join(f"{k} {v}" for k, v in report["counts"].items()))
+    print("Lost:      " + ", ".join(f"{k} {v}" for k, v in report["lost"].items()))
+    print("Misrouted: " + (", ".join(f"{k} {v}" for k, v in report["misrouted"].items()) or "none"))
+
+# --- STUB SERVER ---
+class StubServer:
+    """Routing-only stand-in for server/websocket.ts and server/identify.ts"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.clients = []
+        self.slot_ids = itertools.count(1)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/ws", self.websocket)
+        app.router.add_post("/api/hardware/identify", self.identify_http)
+        return app
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client = {"ws": ws, "type": "CLIENT", "stations": set()}
+        self.clients.append(client)
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    try:
+                        await self.handle(client, json.loads(msg.data))
+                    except Exception as e:
+                        print(f"Stub: bad message: {e}")
+        finally:
+            self.clients.remove(client)
+        return ws
+
+    async def handle(self, client, data):
+        kind = data.get("type")
+        if kind in ("REGISTER_ESP32", "REGISTER_CAMERA", "REGISTER_CLIENT"):
+            client["type"] = kind[len("REGISTER_"):]
+            if data.get("stationId") is not None:
+                client["stations"].add(data["stationId"])
+        elif kind == "SLOT_UPDATE":
+            station = data.get("stationId", next(iter(client["stations"]), None))
+            await self.send("CLIENT", None, {"type": "SLOT_UPDATE", "stationId": station,
+                                             "slotId": data.get("slotId"), "isOccupied": data.get("isOccupied")})
+        elif kind == "CAMERA_TRIGGER":
+            station = data.get("stationId", next(iter(client["stations"]), None))
+            await self.send("CAMERA", station, {"type": "CAMERA_TRIGGER", "stationId": station,
+                                                "traceId": data.get("traceId"), "serverTs": time.time() * 1000})
+        elif kind == "IDENTIFY":
+            status, body = await self.identify(data)
+            await client["ws"].send_str(json.dumps({"type": "IDENTIFY_RESULT", "requestId": data.get("requestId"),
+                                                    "status": status, **body}))
+
+    async def identify_http(self, request):
+        status, body = await self.identify(await request.json())
+        return web.json_response(body, status=status)
+
+    async def identify(self, data):
+        started = time.time()
+        station = data.get("stationId")
+        candidates = data.get("candidates") or ([data["plateNumber"]] if data.get("plateNumber") else [])
+        if not station or not candidates:
+            return 400, {"error": "Missing fields"}
+        trace_id = data.get("traceId")
+        await self.send("ESP32", station, {"type": "SCANNING", "plateNumber": data.get("plateNumber") or candidates[0]})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if any(str(plate).startswith("BK") for plate in candidates):
+            slot_id = next(self.slot_ids)
+            await self.send("ESP32", station, {"type": "GATE_OPEN", "name": "Load Test", "slotId": slot_id,
+                                               "traceId": trace_id})
+            body = {"authorized": True, "slotId": slot_id}
+        else:
+            await self.send("ESP32", station, {"type": "GATE_DENIED", "traceId": trace_id})
+            body = {"authorized": False}
+        body.update(traceId=trace_id, timing={"handlerMs": round((time.time() - started) * 1000, 1)})
+        return 200, body
+
+    async def send(self, client_type, station, message):
+        payload = json.dumps(message)
+        for client in list(self.clients):
+            if client["type"] == client_type and (station is None or station in client["stations"]):
+                if not client["ws"].closed:
+                    await client["ws"].send_str(payload)
+
+async def start_stub(port, latency_ms):
+    runner = web.AppRunner(StubServer(latency_ms).app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+async def run_load_test(args):
+    runner = None
+    base_url = args.server
+    if args.stub:
+        runner = await start_stub(args.port, args.stub_latency_ms)
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(f"Stub server listening on {base_url}")
+    try:
+        return await LoadTest(args, base_url).run()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate many ESP32s and cameras against the hardware endpoints")
+    parser.add_argument('--server', default=SERVER_URL, help=f"backend base URL (default {SERVER_URL})")
+    parser.add_argument('--stations', type=int, default=10, help="simulated stations (one ESP32 and camera each)")
+    parser.add_argument('--first-station', type=int, default=FIRST_STATION)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument('--trigger-rate', type=float, default=0.2, help="CAMERA_TRIGGERs per station per second")
+    parser.add_argument('--identify-rate', type=float, default=0.2, help="HTTP identify calls per station per second")
+    parser.add_argument('--slot-rate', type=float, default=None,
+                        help="SLOT_UPDATEs per station per second (default 0.2 with --stub, else 0)")
+    parser.add_argument('--slots', type=int, default=4, help="slot ids used by SLOT_UPDATE")
+    parser.add_argument('--booked-ratio', type=float, default=0.3, help="share of plates the stub treats as booked")
+    parser.add_argument('--no-cameras', action='store_true', help="no camera clients (and no triggers)")
+    parser.add_argument('--no-camera-identify', dest='camera_identify', action='store_false',
+                        help="cameras do not answer triggers with IDENTIFY")
+    parser.add_argument('--http-connections', type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument('--connect-concurrency', type=int, default=CONNECT_CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=10.0, help="per-request timeout in seconds")
+    parser.add_argument('--drain', type=float, default=3.0, help="seconds to wait for late messages")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', dest='json_path', help="write the report as JSON here")
+    parser.add_argument('--stub', action='store_true', help="run against a bundled local stub server")
+    parser.add_argument('--serve-stub', action='store_true', help="only run the stub server")
+    parser.add_argument('--port', type=int, default=STUB_PORT, help="stub server port")
+    parser.add_argument('--stub-latency-ms', type=float, default=0.0, help="simulated booking lookup time in the stub")
+    args = parser.parse_args()
+    if args.slot_rate is None:
+        args.slot_rate = 0.2 if (args.stub or args.serve_stub) else 0.0
+    return args
+
+def main():
+    if aiohttp is None:
+        print("load_test_hardware.py needs aiohttp: pip install aiohttp")
+        sys.exit(2)
+    args = parse_args()
+    if args.serve_stub:
+        print(f"Stub server on http://127.0.0.1:{args.port} (Ctrl+C to stop)")
+        web.run_app(StubServer(args.stub_latency_ms).app(), host="127.0.0.1", port=args.port, print=None)
+        return
+
+    print("Starting Hardware Load Test...")
+    report = asyncio.run(run_load_test(args))
+    if report is None:
+        print("Could not connect; make sure the server is running (or use --stub)")
+        sys.exit(1)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json_path}")
+    if any(report["lost"].values()) or report["misrouted"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
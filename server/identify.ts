@@ -0,0 +1,185 @@
+import { storage } from "./storage";
+import { getWebSocketHandler } from "./websocket";
+import type { Booking } from "@shared/schema";
+
+export interface IdentifyRequest {
+  stationId: number;
+  plateNumber?: string;
+  candidates?: string[];
+  // Camera's trace ID, echoed back and logged so both sides can be joined
+  traceId?: string;
+}
+
+export interface IdentifyResult {
+  status: number;
+  body: Record<string, unknown>;
+}
+
+// Gate decision for a plate read at a station. Shared by the HTTP route and
+// the camera's IDENTIFY WebSocket message so both paths behave the same.
+// The reply carries server-side timing for the camera's latency trace.
+export async function identifyPlate(request: IdentifyRequest): Promise<IdentifyResult> {
+  const startedAt = Date.now();
+  const timing: { handlerMs?: number; gateCommandMs?: number } = {};
+  const result = await decide(request, () => {
+    timing.gateCommandMs = Date.now() - startedAt;
+  });
+  timing.handlerMs = Date.now() - startedAt;
+  if (request.traceId) {
+    console.log(`   Trace ${request.traceId}: ${timing.handlerMs} ms in identify`);
+  }
+  return { ...result, body: { ...result.body, traceId: request.traceId, timing } };
+}
+
+async function decide(
+  { stationId, plateNumber, candidates, traceId }: IdentifyRequest,
+  onGateCommand: () => void,
+): Promise<IdentifyResult> {
+  console.log(`Identify request: Station ${stationId}, Plate ${plateNumber}, Candidates: ${candidates?.join(', ')}`);
+
+  const platesToCheck: string[] = candidates?.length ? candidates : plateNumber ? [plateNumber] : [];
+  if (!stationId || platesToCheck.length === 0) {
+    return { status: 400, body: { error: "Missing fields" } };
+  }
+
+  // Map Station 1 to Indiranagar (ID 1) explicitly for clarity/logging
+  if (stationId == 1) {
+    console.log("📍 Station 1 = Indiranagar Power Hub");
+  }
+
+  // Send SCANNING status to LCD
+  const ws = getWebSocketHandler();
+  if (ws) {
+    ws.sendCommandToESP32(stationId, "SCANNING", { plateNumber: plateNumber || platesToCheck[0] });
+  }
+
+  // Look up bookings for ALL candidates
+  let bookings: Booking[] = [];
+
+  console.log(`🔍 Checking plates: ${platesToCheck.join(', ')}`);
+
+  // Use a set to avoid duplicates if multiple candidates match same booking (unlikely but safe)
+  const bookingIds = new Set();
+
+  for (const plate of platesToCheck) {
+    const matches = await storage.getBookingsByPlate(plate);
+    for (const b of matches) {
+      if (!bookingIds.has(b.id)) {
+        bookings.push(b);
+        bookingIds.add(b.id);
+      }
+    }
+  }
+
+  console.log(`📋 Found ${bookings.length} booking(s) across candidates`);
+
+  const now = new Date();
+  let validBooking: typeof bookings[0] | undefined;
+
+  // Iterate through bookings to find a valid one and clean up expired ones
+  for (const booking of bookings) {
+    // Must match station
+    if (booking.stationId !== stationId) continue;
+
+    // Skip cancelled or completed
+    if (booking.status === "cancelled" || booking.status === "completed") continue;
+
+    // Parse Schedule
+    // booking.startTime is "HH:MM"
+    const [hours, mins] = booking.startTime.split(':').map(Number);
+
+    // Construct Start and End times
+    // We assume booking.date represents the day. We set the hours/mins on that day.
+    const startDateTime = new Date(booking.date);
+    startDateTime.setHours(hours, mins, 0, 0);
+
+    const endDateTime = new Date(startDateTime);
+    endDateTime.setHours(startDateTime.getHours() + booking.duration);
+
+    // Check if expired
+    if (now > endDateTime) {
+      // If it's active but time has passed, mark it completed
+      if (booking.status === "active") {
+        console.log(`   Booking ${booking.id} is active but EXPIRED (End: ${endDateTime.toLocaleTimeString()}). Marking completed.`);
+        await storage.updateBookingStatus(booking.id, "completed");
+        getWebSocketHandler()?.notifyBookingsChanged(stationId);
+      }
+      // If upcoming and passed... treat as missed? For now just ignore for entry.
+      continue;
+    }
+
+    // Check window (Allow entry 30 mins early)
+    const entryStart = new Date(startDateTime);
+    entryStart.setMinutes(entryStart.getMinutes() - 30);
+
+    if (now >= entryStart && now <= endDateTime) {
+      validBooking = booking;
+      // If found a valid one, we can stop looking (or prioritize active?)
+      // If we found an "active" one that is valid, perfect.
+      // If we found an "upcoming" one, also good.
+      break;
+    } else {
+      console.log(`   Booking ${booking.id} logic: NOW ${now.toLocaleString()} vs Window ${entryStart.toLocaleString()} - ${endDateTime.toLocaleString()} -> OUT OF WINDOW`);
+    }
+  }
+
+  if (validBooking) {
+    console.log(`✅ AUTHORIZED! Booking ${validBooking.id}`);
+    console.log(`   Name: ${validBooking.personName || 'Guest'}`);
+    console.log(`   Time: ${validBooking.startTime}`);
+
+    const ws = getWebSocketHandler();
+
+    // Check if already active
+    if (validBooking.status === "active") {
+      console.log(`   Booking already active (Re-entry attempted). Slot: ${validBooking.slotId}`);
+
+      // User requested strict "One Entry" logic.
+      // If already active, deny entry (User must book again or is already inside).
+      if (ws) {
+        // We use GATE_DENIED which shows "Access Denied / Not Booked" on LCD (based on current firmware)
+        // This matches user expectation "he has to book again".
+        ws.sendCommandToESP32(stationId, "GATE_DENIED", { traceId });
+        onGateCommand();
+      }
+      return { status: 200, body: { authorized: false, reason: "Booking already used/active" } };
+    }
+
+    // New Entry: Assign Slot
+    const slotId = storage.getAvailableSlot(stationId);
+    if (!slotId) {
+      console.log(`🚫 STATION FULL - No slots available for ${plateNumber}`);
+      if (ws) {
+        ws.sendCommandToESP32(stationId, "GATE_DENIED", { traceId }); // Could add reason "FULL"
+        onGateCommand();
+      }
+      return { status: 200, body: { authorized: false, reason: "Station Full" } };
+    }
+
+    // Update Booking
+    await storage.assignSlotToBooking(validBooking.id, slotId);
+    await storage.updateBookingStatus(validBooking.id, "active");
+    getWebSocketHandler()?.notifyBookingsChanged(stationId);
+
+    console.log(`   Assigned Slot ${slotId}`);
+
+    if (ws) {
+      // Send name if available
+      ws.sendCommandToESP32(stationId, "GATE_OPEN", {
+        name: validBooking.personName || "User",
+        slotId: slotId,
+        traceId,
+      });
+      onGateCommand();
+    }
+    return { status: 200, body: { authorized: true, bookingId: validBooking.id, slotId } };
+  } else {
+    console.log(`🚫 NOT AUTHORIZED - No valid active/upcoming booking for ${plateNumber} at station ${stationId} right now.`);
+    const ws = getWebSocketHandler();
+    if (ws) {
+      ws.sendCommandToESP32(stationId, "GATE_DENIED", { traceId });
+      onGateCommand();
+    }
+    return { status: 200, body: { authorized: false } };
+  }
+}
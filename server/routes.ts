@@ -1,9 +1,11 @@
-import type { Express } from "express";
+import type { Express, Request } from "express";
 import { createServer, type Server } from "http";
 import { storage } from "./storage";
 import { setupWebSocket, getWebSocketHandler } from "./websocket";
-import { insertBookingSchema, type Booking } from "@shared/schema";
+import { identifyPlate } from "./identify";
+import { insertBookingSchema } from "@shared/schema";
 import Stripe from "stripe";
+import { timingSafeEqual } from "crypto";
 // @ts-ignore
 import bcrypt from "bcryptjs";
 
@@ -24,6 +26,16 @@ if (process.env.STRIPE_SECRET_KEY) {
   console.warn('STRIPE_SECRET_KEY not set — Stripe features disabled. Use demo payments.');
 }
 
+// Camera/ESP32 calls that change booking state must carry
+// "Authorization: Bearer <HARDWARE_TOKEN>". With no token set they are refused.
+function hasHardwareToken(req: Request): boolean {
+  const token = process.env.HARDWARE_TOKEN;
+  if (!token) return false;
+  const given = Buffer.from(req.get("authorization") ?? "");
+  const expected = Buffer.from(`Bearer ${token}`);
+  return given.length === expected.length && timingSafeEqual(given, expected);
+}
+
 export async function registerRoutes(app: Express): Promise<Server> {
   console.log('registerRoutes: registering API routes');
   console.log('[INFO] Server restarted. Data should be fresh if server_data.json was deleted.');
@@ -164,149 +176,47 @@ export async function registerRoutes(app: Express): Promise<Server> {
   // Hardware/Camera endpoints
   app.post("/api/hardware/identify", async (req, res) => {
     try {
-      const { stationId, plateNumber, candidates } = req.body;
-      console.log(`Identify request: Station ${stationId}, Plate ${plateNumber}, Candidates: ${candidates?.join(', ')}`);
+      const result = await identifyPlate(req.body);
+      res.status(result.status).json(result.body);
+    } catch (error) {
+      console.error("Identify error:", error);
+      res.status(500).json({ error: "Internal error" });
+    }
+  });
 
-      if (!stationId || (!plateNumber && (!candidates || candidates.length === 0))) {
+  // Store-and-forward: entries a camera let in through the gate's local
+  // endpoint while this server was unreachable. Records the entry (slot +
+  // active) but sends no gate command; replaying an already-recorded entry is
+  // a no-op.
+  app.post("/api/hardware/entries", async (req, res) => {
+    if (!hasHardwareToken(req)) {
+      return res.status(401).json({ error: "Not authenticated" });
+    }
+    try {
+      const { stationId, bookingId, plateNumber, enteredAt } = req.body;
+      if (!stationId || !bookingId) {
         return res.status(400).json({ error: "Missing fields" });
       }
 
-      // Map Station 1 to Indiranagar (ID 1) explicitly for clarity/logging
-      if (stationId == 1) {
-        console.log("📍 Station 1 = Indiranagar Power Hub");
-      }
-
-      // Send SCANNING status to LCD
-      const ws = getWebSocketHandler();
-      if (ws) {
-        ws.sendCommandToESP32(stationId, "SCANNING", { plateNumber: plateNumber || (candidates ? candidates[0] : "???") });
+      const booking = await storage.getBooking(bookingId);
+      if (!booking || booking.stationId !== stationId) {
+        return res.status(404).json({ error: "Booking not found" });
       }
-
-      // Look up bookings for ALL candidates
-      let bookings: Booking[] = [];
-      const platesToCheck = candidates && candidates.length > 0 ? candidates : [plateNumber];
-
-      console.log(`🔍 Checking plates: ${platesToCheck.join(', ')}`);
-
-      // Use a set to avoid duplicates if multiple candidates match same booking (unlikely but safe)
-      const bookingIds = new Set();
-
-      for (const plate of platesToCheck) {
-        const matches = await storage.getBookingsByPlate(plate);
-        for (const b of matches) {
-          if (!bookingIds.has(b.id)) {
-            bookings.push(b);
-            bookingIds.add(b.id);
-          }
-        }
+      if (booking.status !== "upcoming") {
+        return res.json({ recorded: false, reason: `Booking is ${booking.status}` });
       }
 
-      console.log(`📋 Found ${bookings.length} booking(s) across candidates`);
-
-      const now = new Date();
-      let validBooking: typeof bookings[0] | undefined;
-
-      // Iterate through bookings to find a valid one and clean up expired ones
-      for (const booking of bookings) {
-        // Must match station
-        if (booking.stationId !== stationId) continue;
-
-        // Skip cancelled or completed
-        if (booking.status === "cancelled" || booking.status === "completed") continue;
-
-        // Parse Schedule
-        // booking.startTime is "HH:MM"
-        const [hours, mins] = booking.startTime.split(':').map(Number);
-
-        // Construct Start and End times
-        // We assume booking.date represents the day. We set the hours/mins on that day.
-        const startDateTime = new Date(booking.date);
-        startDateTime.setHours(hours, mins, 0, 0);
-
-        const endDateTime = new Date(startDateTime);
-        endDateTime.setHours(startDateTime.getHours() + booking.duration);
-
-        // Check if expired
-        if (now > endDateTime) {
-          // If it's active but time has passed, mark it completed
-          if (booking.status === "active") {
-            console.log(`   Booking ${booking.id} is active but EXPIRED (End: ${endDateTime.toLocaleTimeString()}). Marking completed.`);
-            await storage.updateBookingStatus(booking.id, "completed");
-          }
-          // If upcoming and passed... treat as missed? For now just ignore for entry.
-          continue;
-        }
-
-        // Check window (Allow entry 30 mins early)
-        const entryStart = new Date(startDateTime);
-        entryStart.setMinutes(entryStart.getMinutes() - 30);
-
-        if (now >= entryStart && now <= endDateTime) {
-          validBooking = booking;
-          // If found a valid one, we can stop looking (or prioritize active?)
-          // If we found an "active" one that is valid, perfect.
-          // If we found an "upcoming" one, also good.
-          break;
-        } else {
-          console.log(`   Booking ${booking.id} logic: NOW ${now.toLocaleString()} vs Window ${entryStart.toLocaleString()} - ${endDateTime.toLocaleString()} -> OUT OF WINDOW`);
-        }
+      const slotId = storage.getAvailableSlot(stationId);
+      if (slotId) {
+        await storage.assignSlotToBooking(bookingId, slotId);
       }
+      await storage.updateBookingStatus(bookingId, "active");
+      console.log(`📥 Offline entry recorded: booking ${bookingId} (${plateNumber}) at ${enteredAt}, slot ${slotId ?? "none"}`);
 
-      if (validBooking) {
-        console.log(`✅ AUTHORIZED! Booking ${validBooking.id}`);
-        console.log(`   Name: ${validBooking.personName || 'Guest'}`);
-        console.log(`   Time: ${validBooking.startTime}`);
-
-        const ws = getWebSocketHandler();
-
-        // Check if already active
-        if (validBooking.status === "active") {
-          console.log(`   Booking already active (Re-entry attempted). Slot: ${validBooking.slotId}`);
-
-          // User requested strict "One Entry" logic.
-          // If already active, deny entry (User must book again or is already inside).
-          if (ws) {
-            // We use GATE_DENIED which shows "Access Denied / Not Booked" on LCD (based on current firmware)
-            // This matches user expectation "he has to book again".
-            ws.sendCommandToESP32(stationId, "GATE_DENIED");
-          }
-          return res.json({ authorized: false, reason: "Booking already used/active" });
-        }
-
-        // New Entry: Assign Slot
-        const slotId = storage.getAvailableSlot(stationId);
-        if (!slotId) {
-          console.log(`🚫 STATION FULL - No slots available for ${plateNumber}`);
-          if (ws) {
-            ws.sendCommandToESP32(stationId, "GATE_DENIED"); // Could add reason "FULL"
-          }
-          return res.json({ authorized: false, reason: "Station Full" });
-        }
-
-        // Update Booking
-        await storage.assignSlotToBooking(validBooking.id, slotId);
-        await storage.updateBookingStatus(validBooking.id, "active");
-
-        console.log(`   Assigned Slot ${slotId}`);
-
-        if (ws) {
-          // Send name if available
-          ws.sendCommandToESP32(stationId, "GATE_OPEN", {
-            name: validBooking.personName || "User",
-            slotId: slotId
-          });
-        }
-        return res.json({ authorized: true, bookingId: validBooking.id, slotId });
-      } else {
-        console.log(`🚫 NOT AUTHORIZED - No valid active/upcoming booking for ${plateNumber} at station ${stationId} right now.`);
-        const ws = getWebSocketHandler();
-        if (ws) {
-          ws.sendCommandToESP32(stationId, "GATE_DENIED");
-        }
-        return res.json({ authorized: false });
-      }
+      getWebSocketHandler()?.notifyBookingsChanged(stationId);
+      res.json({ recorded: true, slotId });
     } catch (error) {
-      console.error("Identify error:", error);
+      console.error("Entry replay error:", error);
       res.status(500).json({ error: "Internal error" });
     }
   });
@@ -515,6 +425,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
 
       // Create booking
       const booking = await storage.createBooking(validatedData);
+      getWebSocketHandler()?.notifyBookingsChanged(booking.stationId);
 
       res.json(booking);
     } catch (error: any) {
@@ -532,6 +443,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       if (!booking) {
         return res.status(404).json({ error: "Booking not found" });
       }
+      getWebSocketHandler()?.notifyBookingsChanged(booking.stationId);
 
       // Refund the payment if it exists
       if (booking.stripePaymentId) {
@@ -607,6 +519,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
 
       // Reschedule
       const updated = await storage.rescheduleBooking(bookingId, newDate, startTime);
+      getWebSocketHandler()?.notifyBookingsChanged(booking.stationId);
       res.json(updated);
 
     } catch (error) {
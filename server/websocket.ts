@@ -1,11 +1,15 @@
 import { WebSocketServer, WebSocket } from "ws";
+import { randomUUID } from "crypto";
 import type { Server } from "http";
 import { storage } from "./storage";
+import { identifyPlate } from "./identify";
 
 interface StationClient {
   ws: WebSocket;
   type: "ESP32" | "CLIENT" | "CAMERA";
   stationId?: number;
+  // A camera supervisor registers several stations over one socket
+  stationIds?: Set<number>;
 }
 
 export class WebSocketHandler {
@@ -62,6 +66,8 @@ export class WebSocketHandler {
       case "REGISTER_CAMERA":
         client.type = "CAMERA";
         client.stationId = data.stationId;
+        if (!client.stationIds) client.stationIds = new Set();
+        client.stationIds.add(data.stationId);
         console.log(`Camera registered for Station ${data.stationId}`);
         this.logClientSummary();
         break;
@@ -96,18 +102,47 @@ export class WebSocketHandler {
         // Forward trigger to Camera Script (if connected via WS)
         const triggerStation = data.stationId ?? client.stationId;
         console.log(`🎥 Camera Trigger received from ESP32 for Station ${triggerStation}`);
-        // Send to camera, not to browser clients!
+        // Send to camera, not to browser clients! The trace ID follows this
+        // trigger through the camera pipeline and back in IDENTIFY.
         this.sendToCamera(triggerStation, {
           type: "CAMERA_TRIGGER",
           stationId: triggerStation,
+          traceId: data.traceId ?? randomUUID().replace(/-/g, "").slice(0, 16),
+          serverTs: Date.now(),
         });
         break;
 
+      case "IDENTIFY":
+        // Same decision as POST /api/hardware/identify; the reply carries the
+        // camera's requestId so it can match it to the waiting plate read
+        this.handleIdentify(client, data);
+        break;
+
       default:
         console.warn("Unknown message type:", data.type);
     }
   }
 
+  private async handleIdentify(client: StationClient, data: any) {
+    const { requestId } = data;
+    let reply: any;
+    try {
+      const result = await identifyPlate({
+        stationId: data.stationId ?? client.stationId,
+        plateNumber: data.plateNumber,
+        candidates: data.candidates,
+        traceId: data.traceId,
+      });
+      reply = { type: "IDENTIFY_RESULT", requestId, status: result.status, ...result.body };
+    } catch (error) {
+      console.error("Identify error:", error);
+      reply = { type: "IDENTIFY_RESULT", requestId, status: 500, error: "Internal error" };
+    }
+    if (client.ws.readyState === WebSocket.OPEN) {
+      client.ws.send(JSON.stringify(reply));
+    }
+  }
+
   private broadcastToClients(message: any) {
     this.clients.forEach((client) => {
       if (client.type === "CLIENT" && client.ws.readyState === WebSocket.OPEN) {
@@ -120,13 +155,19 @@ export class WebSocketHandler {
   private sendToCamera(stationId: number, message: any) {
     console.log(`Sending to camera for station ${stationId}:`, message.type);
     this.clients.forEach((client) => {
-      if (client.type === "CAMERA" && client.stationId === stationId && client.ws.readyState === WebSocket.OPEN) {
+      const servesStation = client.stationId === stationId || client.stationIds?.has(stationId);
+      if (client.type === "CAMERA" && servesStation && client.ws.readyState === WebSocket.OPEN) {
         client.ws.send(JSON.stringify(message));
         console.log(`✓ Message sent to camera`);
       }
     });
   }
 
+  // Tell cameras serving this station to refresh their local booking cache
+  public notifyBookingsChanged(stationId: number) {
+    this.sendToCamera(stationId, { type: "BOOKINGS_CHANGED", stationId });
+  }
+
   public sendCommandToESP32(stationId: number, command: string, payload: any = {}) {
     console.log(`Sending command to ESP32 station ${stationId}: ${command}`);
     this.clients.forEach((client) => {